@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+#
+#  benchmarks/corpus.py
+"""
+Generates a reproducible corpus of synthetic photographs and videos for the benchmarks.
+"""
+#
+#  Copyright © 2014-2021 Dominic Davis-Foster <dominic@davis-foster.co.uk>
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#  EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+#  MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+#  IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+#  DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+#  OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
+#  OR OTHER DEALINGS IN THE SOFTWARE.
+#
+#
+#  Usage: python benchmarks/corpus.py DIRECTORY [--jpegs N] [--raws N] [--videos N] ...
+#
+
+# stdlib
+import argparse
+import datetime
+import json
+import os
+import random
+import struct
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+__all__ = ["CorpusSpec", "generate_corpus", "jpeg", "mp4", "tiff"]
+
+#: Camera models written to the files, in rotation.
+CAMERAS = ("Canon EOS 5D", "NIKON D750", "iPhone 12 Pro", "HERO7 Black", "DMC-FZ200")
+
+# Seconds between 1904-01-01 (the QuickTime epoch) and 1970-01-01.
+_QUICKTIME_EPOCH = 2082844800
+
+
+class CorpusSpec(NamedTuple):
+	"""
+	The number and size of each kind of file in a corpus.
+	"""
+
+	#: JPEGs with ``DateTimeOriginal`` and ``Model`` in their EXIF data.
+	jpegs: int = 1000
+	#: TIFF-based raw files (``.NEF``).
+	raws: int = 100
+	#: MP4 videos with a creation date in their ``mvhd`` box.
+	videos: int = 50
+	#: QuickTime (``.MOV``) videos with a creation date in their ``mvhd`` box.
+	movs: int = 50
+	#: Files with no metadata at all.
+	no_metadata: int = 50
+	#: JPEGs with the same name and date as each other, in separate directories, so their names collide.
+	collisions: int = 50
+	#: The approximate size of each file, in bytes.
+	size: int = 256 * 1024
+	#: The number of distinct days the files were taken on.
+	days: int = 30
+	#: The number of files in each source directory.
+	per_directory: int = 200
+	#: The seed for the random number generator.
+	seed: int = 0
+
+
+def tiff(model: str, timestamp: str, payload: bytes = b'', big_endian: bool = False) -> bytes:
+	"""
+	Returns a TIFF file with ``Model`` and ``DateTime`` in IFD0 and ``DateTimeOriginal`` in the EXIF IFD.
+
+	:param model:
+	:param timestamp: In EXIF format, e.g. ``2019:07:14 12:34:56``.
+	:param payload: Image data to append.
+	:param big_endian:
+	"""
+
+	e = '>' if big_endian else '<'
+	model_bytes = model.encode("ascii") + b'\0'
+	timestamp_bytes = timestamp.encode("ascii") + b'\0'
+
+	# Header, then IFD0 with three entries, then the EXIF IFD with one, then the values.
+	ifd0_offset = 8
+	exif_offset = ifd0_offset + 2 + 12 * 3 + 4
+	values_offset = exif_offset + 2 + 12 + 4
+	model_offset = values_offset
+	timestamp_offset = model_offset + len(model_bytes)
+
+	header = (b"MM\0*" if big_endian else b"II*\0") + struct.pack(e + 'I', ifd0_offset)
+	ifd0 = struct.pack(e + 'H', 3)
+	ifd0 += struct.pack(e + "HHII", 0x0110, 2, len(model_bytes), model_offset)
+	ifd0 += struct.pack(e + "HHII", 0x0132, 2, len(timestamp_bytes), timestamp_offset)
+	ifd0 += struct.pack(e + "HHII", 0x8769, 4, 1, exif_offset)
+	ifd0 += struct.pack(e + 'I', 0)
+	exif = struct.pack(e + 'H', 1)
+	exif += struct.pack(e + "HHII", 0x9003, 2, len(timestamp_bytes), timestamp_offset)
+	exif += struct.pack(e + 'I', 0)
+
+	return header + ifd0 + exif + model_bytes + timestamp_bytes + payload
+
+
+def jpeg(model: str, timestamp: str, payload: bytes = b'') -> bytes:
+	"""
+	Returns a JPEG file with an EXIF segment. The image data is not a valid image.
+
+	:param model:
+	:param timestamp: In EXIF format, e.g. ``2019:07:14 12:34:56``.
+	:param payload: Image data.
+	"""
+
+	exif = b"Exif\0\0" + tiff(model, timestamp, big_endian=True)
+	app1 = b"\xff\xe1" + struct.pack(">H", len(exif) + 2) + exif
+	return b"\xff\xd8" + app1 + b"\xff\xda\x00\x02" + payload + b"\xff\xd9"
+
+
+def _box(box_type: bytes, payload: bytes) -> bytes:
+	return struct.pack(">I4s", 8 + len(payload), box_type) + payload
+
+
+def mp4(model: str, when: datetime.datetime, payload: bytes = b'', brand: bytes = b"isom") -> bytes:
+	"""
+	Returns an MP4 or QuickTime file with the creation date in its ``mvhd`` and ``mdhd`` boxes.
+
+	The camera model is given in ``udta/©mod``.
+
+	:param model:
+	:param when: The creation date, in UTC.
+	:param payload: The media data.
+	:param brand: The major brand, e.g. ``b"qt  "`` for a QuickTime movie.
+	"""
+
+	seconds = int(when.replace(tzinfo=datetime.timezone.utc).timestamp()) + _QUICKTIME_EPOCH
+	model_bytes = model.encode("ascii")
+
+	mvhd = _box(b"mvhd", b"\0\0\0\0" + struct.pack(">II", seconds, seconds) + b"\0" * 88)
+	mdhd = _box(b"mdhd", b"\0\0\0\0" + struct.pack(">II", seconds, seconds) + b"\0" * 12)
+	trak = _box(b"trak", _box(b"tkhd", b"\0" * 84) + _box(b"mdia", mdhd))
+	udta = _box(b"udta", _box(b"\xa9mod", struct.pack(">HH", len(model_bytes), 0) + model_bytes))
+
+	ftyp = _box(b"ftyp", brand + b"\0\0\0\0" + brand)
+	return ftyp + _box(b"mdat", payload) + _box(b"moov", mvhd + trak + udta)
+
+
+def _payload(rng: random.Random, block: bytes, size: int, index: int) -> bytes:
+	# A shared random block keeps generation fast; a unique prefix and suffix
+	# stop the duplicate detection from treating the files as identical.
+	unique = struct.pack(">Q", index) + rng.getrandbits(64).to_bytes(8, "big")
+	repeats, remainder = divmod(max(size - 2 * len(unique), 0), len(block))
+	return unique + block * repeats + block[:remainder] + unique
+
+
+def generate_corpus(directory: str, spec: CorpusSpec = CorpusSpec()) -> Dict[str, int]:
+	"""
+	Generate a corpus of files in ``directory``. The same ``spec`` always produces the same files.
+
+	:param directory: Created if it does not exist.
+	:param spec:
+
+	:returns: The number of files of each kind, and in total.
+	"""
+
+	rng = random.Random(spec.seed)
+	block = bytes(rng.getrandbits(8) for _ in range(64 * 1024))
+	start = datetime.datetime(2019, 1, 1)
+
+	def random_time() -> datetime.datetime:
+		return start + datetime.timedelta(days=rng.randrange(spec.days), seconds=rng.randrange(86400))
+
+	files: List[Tuple[str, str, bytes]] = []
+
+	for index in range(spec.jpegs):
+		when = random_time()
+		data = jpeg(
+				CAMERAS[index % len(CAMERAS)],
+				when.strftime("%Y:%m:%d %H:%M:%S"),
+				_payload(rng, block, spec.size, len(files)),
+				)
+		files.append(("jpegs", f"IMG_{index:05d}.JPG", data))
+
+	for index in range(spec.raws):
+		when = random_time()
+		data = tiff(
+				CAMERAS[index % len(CAMERAS)],
+				when.strftime("%Y:%m:%d %H:%M:%S"),
+				_payload(rng, block, spec.size, len(files)),
+				big_endian=bool(index % 2),
+				)
+		files.append(("raws", f"DSC_{index:05d}.NEF", data))
+
+	for index in range(spec.videos):
+		data = mp4(CAMERAS[3], random_time(), _payload(rng, block, spec.size, len(files)))
+		files.append(("videos", f"GOPR{index:04d}.MP4", data))
+
+	for index in range(spec.movs):
+		data = mp4(CAMERAS[2], random_time(), _payload(rng, block, spec.size, len(files)), brand=b"qt  ")
+		files.append(("movs", f"IMG_{index:04d}.MOV", data))
+
+	for index in range(spec.no_metadata):
+		files.append(("no_metadata", f"notes_{index:05d}.bin", _payload(rng, block, spec.size, len(files))))
+
+	collision_time = start.strftime("%Y:%m:%d 12:00:00")
+	for index in range(spec.collisions):
+		data = jpeg(CAMERAS[0], collision_time, _payload(rng, block, spec.size, len(files)))
+		files.append((f"collisions/{index:05d}", "IMG_0001.JPG", data))
+
+	rng.shuffle(files)
+
+	counts: Dict[str, int] = {}
+
+	for number, (kind, filename, data) in enumerate(files):
+		subdirectory = os.path.join(directory, f"DCIM{number // spec.per_directory:03d}")
+		if kind.startswith("collisions/"):
+			subdirectory = os.path.join(subdirectory, kind.split('/')[1])
+			kind = "collisions"
+
+		os.makedirs(subdirectory, exist_ok=True)
+		with open(os.path.join(subdirectory, filename), "wb") as fp:
+			fp.write(data)
+
+		counts[kind] = counts.get(kind, 0) + 1
+
+	counts["total"] = len(files)
+	return counts
+
+
+def main(argv: Optional[List[str]] = None) -> None:  # noqa: D103
+	parser = argparse.ArgumentParser(description="Generate a synthetic corpus for the Photo Sort benchmarks.")
+	parser.add_argument("directory")
+	for field, default in CorpusSpec._field_defaults.items():
+		parser.add_argument(f"--{field.replace('_', '-')}", type=int, default=default)
+
+	args = vars(parser.parse_args(argv))
+	directory = args.pop("directory")
+	print(json.dumps(generate_corpus(directory, CorpusSpec(**args)), indent=2))
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,363 @@
+#!/usr/bin/env python3
+#
+#  benchmarks/run.py
+"""
+Benchmarks for each stage of a sort, and for a whole sort, over a synthetic corpus.
+"""
+#
+#  Copyright © 2014-2021 Dominic Davis-Foster <dominic@davis-foster.co.uk>
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#  EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+#  MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+#  IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+#  DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+#  OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
+#  OR OTHER DEALINGS IN THE SOFTWARE.
+#
+#
+#  Usage: python benchmarks/run.py [--output results.json] [--compare baseline.json]
+#
+
+# stdlib
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+from typing import Callable, Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# this package
+from benchmarks.corpus import CorpusSpec, generate_corpus  # noqa: E402
+from photo_sort.discovery import scan_files  # noqa: E402
+from photo_sort.exiftool_session import ExifToolSession  # noqa: E402
+from photo_sort.extractors import ExtractorChain, default_extractors  # noqa: E402
+from photo_sort.metrics import Metrics  # noqa: E402
+from photo_sort.parsing import Resolved  # noqa: E402
+from photo_sort.pipeline import iter_metadata  # noqa: E402
+from photo_sort.worker import Worker, duplicate_copy, mode_copy, mode_move  # noqa: E402
+
+__all__ = ["BENCHMARKS", "compare", "run_benchmark", "main"]
+
+
+def _extractors(session: ExifToolSession) -> List:
+	extractors = default_extractors(session)
+	if shutil.which("exiftool") is None:
+		extractors = [(name, extractor) for name, extractor in extractors if name != "exiftool"]
+	return extractors
+
+
+def _worker(corpus: str, destination: str, **kwargs) -> Worker:
+	worker = Worker(scan_paths(corpus), destination, on_duplicate=duplicate_copy, **kwargs)
+	worker.extractors.extractors = _extractors(worker.exiftool)
+	return worker
+
+
+def scan_paths(corpus: str) -> List[str]:
+	"""
+	Returns the path of every file in the corpus.
+
+	:param corpus:
+	"""
+
+	return [entry.path for entry in scan_files(corpus)]
+
+
+def bench_discovery(corpus: str, workdir: str) -> Dict:
+	"""
+	Find every file in the corpus.
+	"""
+
+	return {"files": len(scan_paths(corpus))}
+
+
+def bench_metadata(corpus: str, workdir: str) -> Dict:
+	"""
+	Read the metadata of every file in the corpus, without the cache.
+	"""
+
+	metrics = Metrics()
+	filenames = scan_paths(corpus)
+
+	with ExifToolSession() as session:
+		chain = ExtractorChain(_extractors(session), accept=Resolved(False), metrics=metrics)
+		for _ in iter_metadata(chain, filenames):
+			pass
+
+	return {"files": len(filenames), "stages": metrics.to_dict()["stages"]}
+
+
+def bench_plan(corpus: str, workdir: str) -> Dict:
+	"""
+	Plan where every file would be sorted to, as ``--dry-run`` does.
+	"""
+
+	metrics = Metrics()
+	worker = _worker(corpus, os.path.join(workdir, "destination"), dry_run=True, metrics=metrics)
+	worker.run()
+
+	assert worker.plan is not None
+	return {"files": len(worker.plan) + len(worker.plan.unsorted), "stages": metrics.to_dict()["stages"]}
+
+
+def _sort(corpus: str, workdir: str, mode: int, runs: int = 1) -> Dict:
+	if mode == mode_move:
+		# Moving is destructive, so move a copy of the corpus on the same filesystem as the destination.
+		source = os.path.join(workdir, "source")
+		shutil.copytree(corpus, source)
+		corpus = source
+
+	for run in range(runs):
+		# Earlier runs only fill the metadata cache.
+		metrics = Metrics()
+		worker = _worker(corpus, os.path.join(workdir, f"destination{run}"), mode=mode, metrics=metrics)
+		start = time.perf_counter()
+		worker.run()
+		elapsed = time.perf_counter() - start
+
+	return {
+			"files": worker.sorted_count + worker.unsorted_count,
+			"sorted": worker.sorted_count,
+			"failed": worker.failed_count,
+			"bytes": sum(worker.backends.bytes.values()),
+			"stages": metrics.to_dict()["stages"],
+			"seconds": elapsed,
+			}
+
+
+def bench_copy(corpus: str, workdir: str) -> Dict:
+	"""
+	Copy every file in the corpus to a new destination, with an empty metadata cache.
+	"""
+
+	return _sort(corpus, workdir, mode_copy)
+
+
+def bench_copy_cached(corpus: str, workdir: str) -> Dict:
+	"""
+	Copy every file in the corpus to a new destination, with the metadata cache filled by an earlier run.
+	"""
+
+	return _sort(corpus, workdir, mode_copy, runs=2)
+
+
+def bench_move(corpus: str, workdir: str) -> Dict:
+	"""
+	Move every file in the corpus to a new destination on the same filesystem.
+	"""
+
+	return _sort(corpus, workdir, mode_move)
+
+
+#: The benchmarks, in the order they are run.
+BENCHMARKS: Dict[str, Callable[[str, str], Dict]] = {
+		"discovery": bench_discovery,
+		"metadata": bench_metadata,
+		"plan": bench_plan,
+		"copy": bench_copy,
+		"copy_cached": bench_copy_cached,
+		"move": bench_move,
+		}
+
+
+def _peak_rss() -> int:
+	# ru_maxrss is in kilobytes on Linux but bytes on macOS.
+	peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	return peak if sys.platform == "darwin" else peak * 1024
+
+
+def run_benchmark(name: str, corpus: str) -> Dict:
+	"""
+	Run a single benchmark in this process, and return its results.
+
+	Anything the benchmark prints is discarded. The time taken is that of the whole benchmark,
+	unless it reports its own ``seconds``, e.g. to exclude setting up.
+
+	:param name: The name of the benchmark, from :data:`~.BENCHMARKS`.
+	:param corpus: The directory containing the corpus.
+	"""
+
+	workdir = tempfile.mkdtemp(prefix=f"photo-sort-bench-{name}-")
+	os.environ["XDG_CACHE_HOME"] = os.path.join(workdir, "cache")
+
+	try:
+		with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+			start = time.perf_counter()
+			results = BENCHMARKS[name](corpus, workdir)
+			elapsed = time.perf_counter() - start
+	finally:
+		shutil.rmtree(workdir, ignore_errors=True)
+
+	elapsed = results.setdefault("seconds", elapsed)
+	results["files_per_second"] = results["files"] / elapsed if elapsed else 0.0
+	results["peak_rss"] = _peak_rss()
+	return results
+
+
+def _run_isolated(name: str, corpus: str, repeat: int) -> Dict:
+	# Each run is a fresh process, so the peak RSS of one benchmark does not include another's,
+	# and the best of several runs is reported to reduce noise.
+	best: Optional[Dict] = None
+
+	for _ in range(repeat):
+		output = subprocess.run(
+				[sys.executable, os.path.abspath(__file__), "--single", name, "--corpus", corpus],
+				stdout=subprocess.PIPE,
+				stderr=subprocess.DEVNULL,
+				check=True,
+				).stdout
+		results = json.loads(output)
+		if best is None or results["seconds"] < best["seconds"]:
+			best = results
+
+	assert best is not None
+	return best
+
+
+def _git_commit() -> Optional[str]:
+	try:
+		return subprocess.run(
+				["git", "rev-parse", "HEAD"],
+				cwd=os.path.dirname(os.path.abspath(__file__)),
+				stdout=subprocess.PIPE,
+				stderr=subprocess.DEVNULL,
+				check=True,
+				).stdout.decode("UTF-8").strip()
+	except (OSError, subprocess.CalledProcessError):
+		return None
+
+
+def compare(results: Dict, baseline: Dict, threshold: float = 0.1) -> List[str]:
+	"""
+	Compare two sets of benchmark results.
+
+	:param results:
+	:param baseline: Earlier results, e.g. from the previous commit.
+	:param threshold: The fraction by which throughput may fall before it is reported as a regression.
+
+	:returns: A description of each regression.
+	"""
+
+	if results["corpus"] != baseline["corpus"]:
+		print("Warning: the results are for different corpora.", file=sys.stderr)
+
+	regressions = []
+
+	for name, current in results["benchmarks"].items():
+		if name not in baseline["benchmarks"]:
+			continue
+
+		before = baseline["benchmarks"][name]["files_per_second"]
+		after = current["files_per_second"]
+		change = (after - before) / before if before else 0.0
+		print(f"{name:>12}: {before:10.1f} -> {after:10.1f} files/s ({change:+.1%})")
+
+		if change < -threshold:
+			regressions.append(f"{name} is {-change:.1%} slower")
+
+	return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:  # noqa: D103
+	parser = argparse.ArgumentParser(description="Benchmark Photo Sort over a synthetic corpus.")
+	parser.add_argument(
+			"benchmarks",
+			nargs='*',
+			help=f"The benchmarks to run, from {', '.join(BENCHMARKS)}. Default: all of them.",
+			)
+	parser.add_argument("--corpus", help="An existing corpus to use, rather than generating one.")
+	parser.add_argument("--jpegs", type=int, default=CorpusSpec().jpegs, help="Default %(default)s.")
+	parser.add_argument("--size", type=int, default=CorpusSpec().size, help="Default %(default)s bytes.")
+	parser.add_argument("--seed", type=int, default=CorpusSpec().seed, help="Default %(default)s.")
+	parser.add_argument(
+			"--repeat",
+			type=int,
+			default=3,
+			help="Report the best of this many runs of each benchmark. Default %(default)s.",
+			)
+	parser.add_argument("--output", metavar="FILE", help="Write the results to a JSON file.")
+	parser.add_argument("--compare", metavar="FILE", help="Compare the results with those in a JSON file.")
+	parser.add_argument(
+			"--threshold",
+			type=float,
+			default=0.1,
+			help="The fall in throughput reported as a regression by --compare. Default %(default)s.",
+			)
+	parser.add_argument("--single", help=argparse.SUPPRESS)
+
+	args = parser.parse_args(argv)
+
+	for name in args.benchmarks:
+		if name not in BENCHMARKS:
+			parser.error(f"unknown benchmark {name!r}")
+
+	if args.single:
+		print(json.dumps(run_benchmark(args.single, args.corpus)))
+		return 0
+
+	if shutil.which("exiftool") is None:
+		print("exiftool not found; files only it can read will not be sorted.", file=sys.stderr)
+
+	spec = CorpusSpec(jpegs=args.jpegs, size=args.size, seed=args.seed)
+
+	with tempfile.TemporaryDirectory(prefix="photo-sort-corpus-") as tmpdir:
+		corpus = args.corpus
+		if corpus is None:
+			corpus = tmpdir
+			counts = generate_corpus(corpus, spec)
+		else:
+			counts = {"total": len(scan_paths(corpus))}
+
+		benchmarks: Dict[str, Dict] = {}
+		results = {
+				"commit": _git_commit(),
+				"python": platform.python_version(),
+				"platform": platform.platform(),
+				"corpus": {"path": args.corpus, "spec": spec._asdict() if args.corpus is None else None, **counts},
+				"benchmarks": benchmarks,
+				}
+
+		print(f"{'benchmark':>12}  {'seconds':>8}  {'files/s':>10}  {'peak RSS':>10}")
+		for name in args.benchmarks or BENCHMARKS:
+			result = benchmarks[name] = _run_isolated(name, corpus, args.repeat)
+			print(
+					f"{name:>12}  {result['seconds']:8.2f}  {result['files_per_second']:10.1f}  "
+					f"{result['peak_rss'] / 2**20:8.1f}MB"
+					)
+
+	if args.output:
+		with open(args.output, 'w') as fp:
+			json.dump(results, fp, indent=2)
+
+	if args.compare:
+		with open(args.compare) as fp:
+			regressions = compare(results, json.load(fp), args.threshold)
+
+		for regression in regressions:
+			print(f"Regression: {regression}", file=sys.stderr)
+		if regressions:
+			return 1
+
+	return 0
+
+
+if __name__ == "__main__":
+	sys.exit(main())
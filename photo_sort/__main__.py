@@ -0,0 +1,385 @@
+#!/usr/bin/env python3
+#
+#  __main__.py
+"""
+Sort photographs from the command line, without the GUI.
+"""
+#
+#  Copyright © 2014-2021 Dominic Davis-Foster <dominic@davis-foster.co.uk>
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#  EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+#  MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+#  IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+#  DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+#  OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
+#  OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+# stdlib
+import argparse
+import json
+import os
+import signal
+import sys
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+# this package
+from photo_sort.discovery import FileDiscovery
+from photo_sort.journal import JournalError
+from photo_sort.metrics import NULL_METRICS, Metrics
+from photo_sort.parsing import MetadataRules
+from photo_sort.plan import SortPlan
+from photo_sort.templates import PathTemplate
+from photo_sort.watch import FolderWatcher
+from photo_sort.worker import Worker, duplicate_copy, duplicate_link, duplicate_skip, mode_copy, mode_move
+
+__all__ = ["load_settings", "main"]
+
+_duplicate_modes = {"copy": duplicate_copy, "skip": duplicate_skip, "link": duplicate_link}
+
+
+def load_settings(filename: str) -> Tuple[Dict[str, str], Dict[str, str], Dict[str, Any]]:
+	"""
+	Load the camera names and directories saved by the GUI, and the rules for reading metadata.
+
+	:param filename: The settings file, usually ``settings.json``.
+
+	:returns: A mapping of camera models to names, a mapping of ``"Source"`` and ``"Destination"`` to directories,
+		and the tags to find the date and camera in (see :meth:`MetadataRules.from_settings() <.from_settings>`)
+		and the ``"template"`` for the destination directories.
+		All are empty if the file does not exist.
+	"""
+
+	try:
+		with open(filename) as f:
+			settings = json.load(f)
+	except FileNotFoundError:
+		return {}, {}, {}
+
+	cameras, directories, *rest = settings
+	rules = rest[0] if rest else {}
+
+	return cameras, directories, rules
+
+
+def _format_rate(count: float, elapsed: float) -> str:
+	if not elapsed:
+		return "0.0"
+	return f"{count / elapsed:.1f}"
+
+
+def _is_within(path: str, directory: str) -> bool:
+	path = os.path.normcase(os.path.realpath(path))
+	directory = os.path.normcase(os.path.realpath(directory))
+	return path == directory or path.startswith(os.path.join(directory, ''))
+
+
+def _is_same(path: str, other: str) -> bool:
+	return os.path.normcase(os.path.realpath(path)) == os.path.normcase(os.path.realpath(other))
+
+
+def _write_metrics(metrics: Metrics, args: argparse.Namespace) -> None:
+	if args.metrics:
+		metrics.write_json(args.metrics)
+	if args.prometheus:
+		metrics.write_prometheus(args.prometheus)
+
+
+def _watch(source: str, args: argparse.Namespace, options: Dict[str, Any]) -> int:
+	# Sort new files as they arrive, a batch at a time, until interrupted.
+
+	try:
+		watcher = FolderWatcher(source, settle=args.settle)
+	except OSError as e:
+		print(f"Cannot watch {source!r}: {e}", file=sys.stderr)
+		return 1
+
+	# Finish the current batch before stopping, e.g. when stopped by a service manager.
+	signal.signal(signal.SIGTERM, lambda signum, frame: watcher.stop())
+
+	print(f"Watching {source!r} for new files. Press Ctrl+C to stop.")
+
+	# The exiftool process, caches and journal are kept open between batches.
+	worker = Worker(filelist=(), **options)
+
+	try:
+		with worker.session():
+			for batch in watcher:
+				start = time.perf_counter()
+				sorted_count = worker.sorted_count
+				worker.sort(batch)
+
+				elapsed = time.perf_counter() - start
+				options["metrics"].record("run", elapsed, len(batch))
+				_write_metrics(options["metrics"], args)
+
+				print(f"Sorted {worker.sorted_count - sorted_count} of {len(batch)} new files in {elapsed:.1f}s")
+
+	except KeyboardInterrupt:
+		watcher.stop()
+		print("\nStopped.", file=sys.stderr)
+		return 130
+	except JournalError as e:
+		watcher.stop()
+		print(e, file=sys.stderr)
+		return 1
+
+	if worker.journal is not None:
+		# Kept so that the files still in the source are not read or hashed again when watching starts again.
+		worker.journal.prune()
+
+	worker.print_summary()
+
+	return 1 if worker.failed_count else 0
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+	"""
+	Entry point for the ``photo-sort`` command.
+
+	:param argv: The command line arguments. Defaults to :py:data:`sys.argv`.
+
+	:returns: ``0`` if every file could be read and copied or moved, ``1`` otherwise.
+	"""
+
+	parser = argparse.ArgumentParser(prog="photo-sort", description="Sort photographs into folders by date.")
+	parser.add_argument("source", nargs='?', help="The directory to sort. Defaults to the one saved by the GUI.")
+	parser.add_argument(
+			"destination",
+			nargs='?',
+			help="The directory to sort into. Defaults to the one saved by the GUI.",
+			)
+
+	mode = parser.add_mutually_exclusive_group()
+	mode.add_argument("--copy", dest="mode", action="store_const", const=mode_copy, help="Copy files (the default).")
+	mode.add_argument("--move", dest="mode", action="store_const", const=mode_move, help="Move files.")
+	parser.set_defaults(mode=mode_copy)
+
+	parser.add_argument(
+			"--within-dirs",
+			action="store_true",
+			help="Sort each file within the directory which contains it. No destination is needed.",
+			)
+	parser.add_argument("--by-datetime", action="store_true", help="Sort by date and time (a directory for each hour).")
+	parser.add_argument("--by-camera", action="store_true", help="Sort by camera.")
+	parser.add_argument(
+			"--template",
+			help="The directories to sort files into, e.g. '{year}/{month:02}/{date}_{camera}'. "
+			"Fields: year, month, day, hour, minute, second, date, time and camera. "
+			"Overrides --by-datetime and --by-camera.",
+			)
+	parser.add_argument(
+			"--on-duplicate",
+			choices=sorted(_duplicate_modes),
+			default="skip",
+			help="What to do with files already in the destination. Default %(default)s.",
+			)
+	parser.add_argument(
+			"--processes",
+			type=int,
+			default=None,
+			help="Read metadata in this many processes. Default: in a single thread.",
+			)
+	parser.add_argument(
+			"--copy-threads",
+			type=int,
+			default=4,
+			help="The maximum number of files to copy or move at once. Default %(default)s.",
+			)
+	parser.add_argument(
+			"--dry-run",
+			action="store_true",
+			help="Show where each file would be sorted to, without changing anything.",
+			)
+	parser.add_argument(
+			"--save-plan",
+			metavar="FILE",
+			help="Save where each file would be sorted to, without changing anything. Implies --dry-run.",
+			)
+	parser.add_argument(
+			"--apply-plan",
+			metavar="FILE",
+			help="Sort the files as planned by an earlier --save-plan, into the destination it was made for.",
+			)
+	parser.add_argument(
+			"--metrics",
+			metavar="FILE",
+			help="Write the time taken by each stage of the sort to a JSON file.",
+			)
+	parser.add_argument(
+			"--prometheus",
+			metavar="FILE",
+			help="Write the time taken by each stage of the sort to a Prometheus textfile collector file.",
+			)
+	parser.add_argument(
+			"--no-journal",
+			dest="journal",
+			action="store_false",
+			help="Do not keep a journal in the destination for resuming the sort if it is interrupted.",
+			)
+	parser.add_argument(
+			"--no-cache",
+			dest="cache",
+			action="store_false",
+			help="Do not cache the metadata of each file in the user's cache directory.",
+			)
+	parser.add_argument(
+			"--watch",
+			action="store_true",
+			help="Keep running, and sort new files as soon as they have been written to the source (Linux only).",
+			)
+	parser.add_argument(
+			"--settle",
+			type=float,
+			default=2.0,
+			metavar="SECONDS",
+			help="With --watch, how long a new file must be left alone before it is sorted. Default %(default)s.",
+			)
+	parser.add_argument(
+			"--settings",
+			default="settings.json",
+			help="The settings file to read camera names from. Default %(default)s.",
+			)
+
+	args = parser.parse_args(argv)
+
+	cameras, directories, rules = load_settings(args.settings)
+
+	plan = None
+	if args.apply_plan:
+		try:
+			plan = SortPlan.load(args.apply_plan)
+		except (OSError, ValueError, KeyError) as e:
+			parser.error(f"cannot load plan {args.apply_plan!r}: {e}")
+
+		if args.destination is None:
+			# The only directory given is the destination.
+			args.destination = args.source
+
+		if args.destination is None:
+			args.destination = plan.destination
+		elif plan.destination is not None and not _is_same(args.destination, plan.destination):
+			parser.error(f"the plan is for sorting into {plan.destination!r}, not {args.destination!r}")
+
+		args.source = args.destination
+
+	source = args.source or directories.get("Source")
+	if not source:
+		parser.error("no source directory given")
+
+	if args.within_dirs:
+		destination = source
+	else:
+		destination = args.destination or directories.get("Destination")
+		if not destination:
+			parser.error("no destination directory given")
+
+	# Checked before anything is sorted, so a mistake in the settings is reported straight away.
+	try:
+		MetadataRules.from_settings(rules, cameras)
+	except ValueError as e:
+		parser.error(f"{args.settings}: {e}")
+
+	template = args.template or rules.get("template")
+	if template is not None:
+		try:
+			PathTemplate(template)
+		except ValueError as e:
+			parser.error(str(e))
+
+	if args.metrics or args.prometheus:
+		metrics = Metrics()
+	else:
+		metrics = NULL_METRICS
+
+	options = dict(
+			destination=destination,
+			mode=args.mode,
+			within_dirs=args.within_dirs,
+			by_datetime=args.by_datetime,
+			by_camera=args.by_camera,
+			on_duplicate=_duplicate_modes[args.on_duplicate],
+			processes=args.processes,
+			copy_threads=args.copy_threads,
+			cameras=cameras,
+			rules=rules,
+			template=template,
+			metrics=metrics,
+			journal=args.journal,
+			cache=args.cache,
+			)
+
+	if args.watch:
+		if args.within_dirs or plan is not None or args.dry_run or args.save_plan:
+			parser.error("--watch cannot be used with --within-dirs, --dry-run, --save-plan or --apply-plan")
+		if _is_within(destination, source):
+			parser.error("the destination cannot be inside the source with --watch")
+
+		return _watch(source, args, options)
+
+	discovery = FileDiscovery(source, metrics=metrics)
+	worker = Worker(
+			filelist=discovery if plan is None else (),
+			plan=plan,
+			dry_run=args.dry_run or args.save_plan is not None,
+			save_plan=args.save_plan,
+			**options,
+			)
+
+	start = time.perf_counter()
+	if plan is None:
+		discovery.start()
+
+	try:
+		# The sort runs in this thread, so there is nothing to wait for.
+		worker.run()
+	except KeyboardInterrupt:
+		discovery.stop()
+		print("\nCancelled.", file=sys.stderr)
+		return 130
+	except JournalError as e:
+		discovery.stop()
+		print(e, file=sys.stderr)
+		return 1
+
+	elapsed = time.perf_counter() - start
+	metrics.record("run", elapsed, discovery.found)
+	_write_metrics(metrics, args)
+
+	megabytes = sum(worker.backends.bytes.values()) / 1e6
+
+	total = len(plan) if plan is not None else discovery.found
+
+	if worker.dry_run:
+		print(f"Planned {total} files in {elapsed:.1f}s ({_format_rate(total, elapsed)} files/s)")
+	else:
+		print(
+				f"Sorted {worker.sorted_count} of {total} files in {elapsed:.1f}s "
+				f"({_format_rate(worker.sorted_count, elapsed)} files/s, "
+				f"{_format_rate(megabytes, elapsed)} MB/s copied)"
+				)
+
+	if worker.unsorted_count:
+		print(f"{worker.unsorted_count} files were not sorted as their date could not be found.")
+
+	if worker.failed_count:
+		print(f"{worker.failed_count} files could not be read, copied or moved.", file=sys.stderr)
+		return 1
+
+	return 0
+
+
+if __name__ == "__main__":
+	sys.exit(main())
@@ -0,0 +1,362 @@
+#!/usr/bin/env python3
+#
+#  bmff.py
+"""
+Fast extraction of creation dates and camera models from ISO base media files (MP4, MOV and HEIC).
+"""
+#
+#  Copyright © 2014-2021 Dominic Davis-Foster <dominic@davis-foster.co.uk>
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#  EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+#  MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+#  IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+#  DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+#  OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
+#  OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+# stdlib
+import mmap
+import struct
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, Optional, Tuple, Union
+
+# this package
+from photo_sort.fast_exif import read_tiff_tags
+from photo_sort.utils import map_header
+
+__all__ = ["BmffExtractor", "iter_boxes", "read_bmff_tags"]
+
+_Buffer = Union[bytes, mmap.mmap]
+
+# Box types which may appear at the start of an ISO base media file.
+_FIRST_BOXES = {b"ftyp", b"moov", b"mdat", b"wide", b"free", b"skip", b"pnot"}
+
+_QUICKTIME_EPOCH = datetime(1904, 1, 1)
+
+# QuickTime user data atoms, mapped to the names exiftool gives them.
+_USER_DATA = {b"\xa9mak": "QuickTime:Make", b"\xa9mod": "QuickTime:Model"}
+
+# Keys from QuickTime metadata (e.g. iPhone videos), mapped to the names exiftool gives them.
+_METADATA_KEYS = {
+		b"com.apple.quicktime.make": "QuickTime:Make",
+		b"com.apple.quicktime.model": "QuickTime:Model",
+		b"com.apple.quicktime.creationdate": "QuickTime:CreationDate",
+		}
+
+
+def iter_boxes(buf: _Buffer, start: int, end: int) -> Iterator[Tuple[bytes, int, int]]:
+	"""
+	Iterate over the boxes between ``start`` and ``end``.
+
+	Only the box headers are read, so large boxes such as ``mdat`` are skipped over without being read.
+
+	:param buf:
+	:param start: The position of the first box.
+	:param end: The position of the end of the containing box.
+
+	:returns: An iterator of ``(type, payload_start, box_end)`` tuples.
+	"""
+
+	position = start
+
+	while position + 8 <= end:
+		size, box_type = struct.unpack_from(">I4s", buf, position)
+		header = 8
+
+		if size == 1:
+			if position + 16 > end:
+				return
+			(size, ) = struct.unpack_from(">Q", buf, position + 8)
+			header = 16
+		elif size == 0:
+			# The box extends to the end of its container.
+			size = end - position
+
+		if size < header:
+			# Corrupt file
+			return
+
+		yield box_type, position + header, min(position + size, end)
+		position += size
+
+
+def _find_box(buf: _Buffer, start: int, end: int, box_type: bytes) -> Optional[Tuple[int, int]]:
+	for child_type, child_start, child_end in iter_boxes(buf, start, end):
+		if child_type == box_type:
+			return child_start, child_end
+
+	return None
+
+
+def _read_timestamp(buf: _Buffer, start: int) -> Optional[str]:
+	"""
+	Read the creation time from a ``mvhd`` or ``mdhd`` box, formatted as exiftool would.
+	"""
+
+	version = buf[start]
+	if version == 1:
+		(seconds, ) = struct.unpack_from(">Q", buf, start + 4)
+	else:
+		(seconds, ) = struct.unpack_from(">I", buf, start + 4)
+
+	if not seconds:
+		return None
+
+	try:
+		return (_QUICKTIME_EPOCH + timedelta(seconds=seconds)).strftime("%Y:%m:%d %H:%M:%S")
+	except OverflowError:
+		# A corrupt 64-bit creation time can be far beyond the year 9999.
+		return None
+
+
+def _decode(value: bytes) -> str:
+	try:
+		return value.decode("UTF-8").rstrip('\0')
+	except UnicodeDecodeError:
+		return value.decode("latin-1").rstrip('\0')
+
+
+def _read_user_data(buf: _Buffer, start: int, end: int, tags: Dict[str, str]) -> None:
+	for box_type, box_start, box_end in iter_boxes(buf, start, end):
+		if box_type in _USER_DATA and box_end - box_start > 4:
+			# QuickTime text atom: 16-bit length, 16-bit language code, text
+			(length, ) = struct.unpack_from(">H", buf, box_start)
+			tags[_USER_DATA[box_type]] = _decode(buf[box_start + 4:min(box_start + 4 + length, box_end)])
+
+
+def _read_metadata(buf: _Buffer, start: int, end: int, tags: Dict[str, str]) -> None:
+	"""
+	Read QuickTime metadata (a ``meta`` box containing ``keys`` and ``ilst``).
+	"""
+
+	# In MP4 files ``meta`` is a full box, with a version and flags before its children.
+	if buf[start + 4:start + 8] != b"hdlr":
+		start += 4
+
+	keys = _find_box(buf, start, end, b"keys")
+	items = _find_box(buf, start, end, b"ilst")
+	if keys is None or items is None:
+		return
+
+	key_names = {}
+	keys_start, keys_end = keys
+	(n_keys, ) = struct.unpack_from(">I", buf, keys_start + 4)
+	position = keys_start + 8
+
+	for index in range(1, n_keys + 1):
+		if position + 8 > keys_end:
+			break
+		(size, ) = struct.unpack_from(">I", buf, position)
+		if size < 8:
+			break
+		key_names[index] = buf[position + 8:position + size]
+		position += size
+
+	for item_type, item_start, item_end in iter_boxes(buf, *items):
+		(index, ) = struct.unpack_from(">I", item_type)
+		name = _METADATA_KEYS.get(key_names.get(index, b''))
+		if name is None:
+			continue
+
+		data = _find_box(buf, item_start, item_end, b"data")
+		if data is not None:
+			# data box: 32-bit type indicator, 32-bit locale, value
+			tags[name] = _decode(buf[data[0] + 8:data[1]])
+
+
+def _read_movie(buf: _Buffer, start: int, end: int, tags: Dict[str, str]) -> None:
+	"""
+	Read the dates and camera model from a ``moov`` box.
+	"""
+
+	for box_type, box_start, box_end in iter_boxes(buf, start, end):
+		if box_type == b"mvhd":
+			created = _read_timestamp(buf, box_start)
+			if created:
+				tags["QuickTime:CreateDate"] = created
+
+		elif box_type == b"trak" and "QuickTime:MediaCreateDate" not in tags:
+			media = _find_box(buf, box_start, box_end, b"mdia")
+			if media is not None:
+				header = _find_box(buf, *media, b"mdhd")
+				if header is not None:
+					created = _read_timestamp(buf, header[0])
+					if created:
+						tags["QuickTime:MediaCreateDate"] = created
+
+		elif box_type == b"udta":
+			_read_user_data(buf, box_start, box_end, tags)
+
+		elif box_type == b"meta":
+			_read_metadata(buf, box_start, box_end, tags)
+
+	if "QuickTime:MediaCreateDate" not in tags and "QuickTime:CreateDate" in tags:
+		tags["QuickTime:MediaCreateDate"] = tags["QuickTime:CreateDate"]
+
+
+def _read_sized(buf: _Buffer, position: int, size: int) -> Tuple[int, int]:
+	if size == 0:
+		return 0, position
+	elif size == 4:
+		return struct.unpack_from(">I", buf, position)[0], position + 4
+	elif size == 8:
+		return struct.unpack_from(">Q", buf, position)[0], position + 8
+	else:
+		raise struct.error(f"Unsupported field size {size}")
+
+
+def _find_exif_item(buf: _Buffer, start: int, end: int) -> Optional[int]:
+	"""
+	Returns the position of the TIFF header of the ``Exif`` item in a HEIF ``meta`` box.
+	"""
+
+	# meta is a full box: skip the version and flags
+	item_info = _find_box(buf, start + 4, end, b"iinf")
+	item_locations = _find_box(buf, start + 4, end, b"iloc")
+	if item_info is None or item_locations is None:
+		return None
+
+	# Find the ID of the Exif item
+	info_start, info_end = item_info
+	first_entry = info_start + (6 if buf[info_start] == 0 else 8)
+	exif_id = None
+
+	for box_type, box_start, _ in iter_boxes(buf, first_entry, info_end):
+		version = buf[box_start]
+		if box_type != b"infe" or version < 2:
+			continue
+
+		if version == 2:
+			(item_id, ) = struct.unpack_from(">H", buf, box_start + 4)
+			item_type = buf[box_start + 8:box_start + 12]
+		else:
+			(item_id, ) = struct.unpack_from(">I", buf, box_start + 4)
+			item_type = buf[box_start + 10:box_start + 14]
+
+		if item_type == b"Exif":
+			exif_id = item_id
+			break
+
+	if exif_id is None:
+		return None
+
+	# Find where the Exif item is stored
+	position = item_locations[0]
+	version = buf[position]
+	offset_size, length_size = buf[position + 4] >> 4, buf[position + 4] & 0xF
+	base_offset_size, index_size = buf[position + 5] >> 4, buf[position + 5] & 0xF
+	if version < 2:
+		(item_count, ) = struct.unpack_from(">H", buf, position + 6)
+		position += 8
+	else:
+		(item_count, ) = struct.unpack_from(">I", buf, position + 6)
+		position += 10
+
+	for _ in range(item_count):
+		if version < 2:
+			(item_id, ) = struct.unpack_from(">H", buf, position)
+			position += 2
+		else:
+			(item_id, ) = struct.unpack_from(">I", buf, position)
+			position += 4
+
+		construction_method = 0
+		if version in {1, 2}:
+			construction_method = struct.unpack_from(">H", buf, position)[0] & 0xF
+			position += 2
+
+		position += 2  # data_reference_index
+		base_offset, position = _read_sized(buf, position, base_offset_size)
+		(extent_count, ) = struct.unpack_from(">H", buf, position)
+		position += 2
+
+		extent_offset = 0
+		for extent in range(extent_count):
+			if version in {1, 2}:
+				_, position = _read_sized(buf, position, index_size)
+			offset, position = _read_sized(buf, position, offset_size)
+			_, position = _read_sized(buf, position, length_size)
+			if extent == 0:
+				extent_offset = offset
+
+		if item_id == exif_id:
+			if construction_method != 0:
+				return None
+
+			item_start = base_offset + extent_offset
+			# The Exif item starts with the offset to the TIFF header
+			(tiff_offset, ) = struct.unpack_from(">I", buf, item_start)
+			return item_start + 4 + tiff_offset
+
+	return None
+
+
+def read_bmff_tags(buf: _Buffer) -> Optional[Dict[str, str]]:
+	"""
+	Read the dates and camera model from an ISO base media file.
+
+	For MP4 and MOV files the creation dates come from the ``mvhd`` and ``mdhd`` boxes,
+	and the camera from QuickTime user data or metadata.
+	For HEIC files the ``Exif`` item is read.
+
+	:param buf:
+
+	:returns: A mapping of tag names to values, named as exiftool or exifread would name them,
+		or :py:obj:`None` if ``buf`` is not an ISO base media file.
+	"""
+
+	if buf[4:8] not in _FIRST_BOXES:
+		return None
+
+	tags: Dict[str, str] = {}
+
+	try:
+		for box_type, box_start, box_end in iter_boxes(buf, 0, len(buf)):
+			if box_type == b"moov":
+				_read_movie(buf, box_start, box_end, tags)
+
+			elif box_type == b"meta":
+				tiff_header = _find_exif_item(buf, box_start, box_end)
+				if tiff_header is not None:
+					tags.update(read_tiff_tags(buf, tiff_header) or {})
+
+	except (struct.error, IndexError):
+		pass
+
+	return tags
+
+
+class BmffExtractor:
+	"""
+	Reads creation dates and camera models from MP4, MOV and HEIC files.
+
+	The file is memory-mapped and only the box headers and the small boxes containing metadata are read,
+	so the cost is independent of the size of the file.
+
+	Other file types give :py:obj:`None`, so a more general extractor can be tried instead.
+	"""
+
+	def __call__(self, filename: str) -> Optional[Dict]:
+		"""
+		Read the dates and camera model from the given file.
+
+		:param filename:
+
+		:raises OSError: If the file cannot be opened.
+		"""
+
+		# Without mmap the whole file would have to be read, so leave it for another extractor.
+		with open(filename, "rb") as file, map_header(file, fallback=False) as view:
+			return read_bmff_tags(view) or None
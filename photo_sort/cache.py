@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+#
+#  cache.py
+"""
+Persistent cache of file metadata, so unchanged files need not be parsed again on later runs.
+"""
+#
+#  Copyright © 2014-2021 Dominic Davis-Foster <dominic@davis-foster.co.uk>
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#  EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+#  MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+#  IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+#  DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+#  OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
+#  OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+# stdlib
+import json
+import os
+import sqlite3
+import sys
+import time
+from typing import Dict, Iterable, Mapping, Optional, Tuple
+
+__all__ = ["CACHE_VERSION", "MetadataCache", "default_cache_file"]
+
+#: The version of the cache contents. Increment this whenever the way metadata is extracted changes,
+#: so that entries from earlier versions are discarded.
+CACHE_VERSION = 1
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS info (
+	key TEXT PRIMARY KEY,
+	value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS metadata (
+	device INTEGER NOT NULL,
+	inode INTEGER NOT NULL,
+	size INTEGER NOT NULL,
+	mtime_ns INTEGER NOT NULL,
+	profile TEXT NOT NULL,
+	extractor TEXT,
+	tags TEXT,
+	last_used INTEGER NOT NULL,
+	PRIMARY KEY (device, inode)
+);
+"""
+
+_FileKey = Tuple[int, int, int, int]
+
+
+def default_cache_file() -> str:
+	"""
+	Returns the default location of the metadata cache, in the user's cache directory.
+	"""
+
+	if os.name == "nt":
+		cache_dir = os.environ.get("LOCALAPPDATA", os.path.expanduser('~'))
+	else:
+		cache_dir = os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache"))
+
+	return os.path.join(cache_dir, "photo-sort", "metadata.sqlite")
+
+
+def _today() -> int:
+	return int(time.time() // 86400)
+
+
+class MetadataCache:
+	"""
+	An SQLite cache of the metadata found for each file.
+
+	Entries are keyed by the file's device and inode, and are only used if its size and modification time
+	are unchanged. The whole cache is discarded if it was written by a different :data:`~.CACHE_VERSION`.
+
+	The database is opened on first use, so the cache may be created in one thread and used in another.
+	If it cannot be opened or written to, e.g. because the user's cache directory is read only,
+	a warning is printed and the sort carries on without the cache.
+
+	:param filename: The SQLite database file.
+	:param max_age: Entries which have not been used for this many days are removed when the cache is closed.
+	"""
+
+	def __init__(self, filename: str, max_age: int = 90):
+		self.filename = filename
+		self.max_age = max_age
+
+		self._connection: Optional[sqlite3.Connection] = None
+		self._keys: Dict[str, _FileKey] = {}
+
+		#: Whether the cache is in use. It is disabled if the database cannot be opened or written to.
+		self.enabled = True
+
+	@property
+	def connection(self) -> sqlite3.Connection:
+		"""
+		The connection to the database, which is opened on first use.
+		"""
+
+		if self._connection is None:
+			directory = os.path.dirname(self.filename)
+			if directory:
+				os.makedirs(directory, exist_ok=True)
+
+			connection = sqlite3.connect(self.filename)
+			connection.execute("PRAGMA journal_mode=WAL")
+			connection.execute("PRAGMA synchronous=NORMAL")
+			connection.executescript(_SCHEMA)
+
+			row = connection.execute("SELECT value FROM info WHERE key = 'version'").fetchone()
+			if row is None or row[0] != str(CACHE_VERSION):
+				with connection:
+					connection.execute("DELETE FROM metadata")
+					connection.execute("INSERT OR REPLACE INTO info VALUES ('version', ?)", (str(CACHE_VERSION), ))
+
+			self._connection = connection
+
+		return self._connection
+
+	def _disable(self, error: Exception) -> None:
+		print(f"The metadata cache {self.filename!r} cannot be used, so it is disabled: {error}", file=sys.stderr)
+		self.enabled = False
+		self._keys.clear()
+
+		if self._connection is not None:
+			self._connection.close()
+			self._connection = None
+
+	def lookup(self, filenames: Iterable[str], profile: str = '') -> Dict[str, Tuple[Optional[str], Optional[Dict]]]:
+		"""
+		Look up the cached metadata for the given files.
+
+		:param filenames:
+		:param profile: Files for which no metadata could be found are only returned
+			if they were stored with the same profile.
+
+		:returns: A mapping of filenames to ``(extractor, tags)`` tuples, for those files which are in the cache.
+		"""
+
+		if not self.enabled:
+			return {}
+
+		try:
+			return self._lookup(filenames, profile)
+		except (OSError, sqlite3.Error) as e:
+			self._disable(e)
+			return {}
+
+	def _lookup(self, filenames: Iterable[str], profile: str) -> Dict[str, Tuple[Optional[str], Optional[Dict]]]:
+		found = {}
+		used = []
+		today = _today()
+
+		for filename in filenames:
+			try:
+				stat = os.stat(filename)
+			except OSError:
+				continue
+
+			key = (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+			row = self.connection.execute(
+					"SELECT size, mtime_ns, profile, extractor, tags, last_used FROM metadata "
+					"WHERE device = ? AND inode = ?",
+					key[:2],
+					).fetchone()
+
+			if row is not None:
+				size, mtime_ns, row_profile, extractor, tags, last_used = row
+
+				if (size, mtime_ns) == key[2:] and (extractor is not None or row_profile == profile):
+					found[filename] = (extractor, json.loads(tags) if tags else None)
+					if last_used != today:
+						used.append((today, *key[:2]))
+					continue
+
+			# Kept until the metadata is stored, to save finding it again.
+			self._keys[filename] = key
+
+		if used:
+			with self.connection:
+				self.connection.executemany("UPDATE metadata SET last_used = ? WHERE device = ? AND inode = ?", used)
+
+		return found
+
+	def store(
+			self,
+			entries: Mapping[str, Tuple[Optional[str], Optional[Mapping]]],
+			profile: str = '',
+			) -> None:
+		"""
+		Store metadata in the cache.
+
+		:param entries: A mapping of filenames to ``(extractor, tags)`` tuples.
+			The tags must be serialisable as JSON.
+		:param profile: The profile the metadata was extracted with.
+		"""
+
+		if not self.enabled:
+			return
+
+		rows = []
+		today = _today()
+
+		for filename, (extractor, tags) in entries.items():
+			key = self._keys.pop(filename, None)
+			if key is None:
+				try:
+					stat = os.stat(filename)
+				except OSError:
+					continue
+				key = (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+			rows.append((*key, profile, extractor, json.dumps(tags) if tags else None, today))
+
+		if rows:
+			try:
+				with self.connection:
+					self.connection.executemany("INSERT OR REPLACE INTO metadata VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+			except (OSError, sqlite3.Error) as e:
+				self._disable(e)
+
+	def forget(self, filenames: Iterable[str]) -> None:
+		"""
+		Forget the files looked up by :meth:`~.MetadataCache.lookup` whose metadata will not be stored.
+
+		:param filenames:
+		"""
+
+		for filename in filenames:
+			self._keys.pop(filename, None)
+
+	def evict(self) -> int:
+		"""
+		Remove entries which have not been used for ``max_age`` days.
+
+		The space is then reclaimed if a large part of the database is unused.
+
+		:returns: The number of entries removed.
+		"""
+
+		with self.connection:
+			removed = self.connection.execute(
+					"DELETE FROM metadata WHERE last_used < ?",
+					(_today() - self.max_age, ),
+					).rowcount
+
+		(free_pages, ) = self.connection.execute("PRAGMA freelist_count").fetchone()
+		(total_pages, ) = self.connection.execute("PRAGMA page_count").fetchone()
+		if total_pages and free_pages / total_pages > 0.25:
+			self.connection.execute("VACUUM")
+
+		return removed
+
+	def close(self) -> None:
+		"""
+		Evict old entries and close the database.
+		"""
+
+		if self._connection is not None:
+			try:
+				self.evict()
+			except sqlite3.Error:
+				# e.g. the disk is full; the entries are evicted next time instead.
+				pass
+
+			self._connection.close()
+			self._connection = None
+
+		self._keys.clear()
+
+	def __enter__(self) -> "MetadataCache":
+		return self
+
+	def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+		self.close()
@@ -0,0 +1,597 @@
+#!/usr/bin/env python3
+#
+#  copying.py
+"""
+Copy and move files into the destination on a pool of threads.
+"""
+#
+#  Copyright © 2014-2021 Dominic Davis-Foster <dominic@davis-foster.co.uk>
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#  EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+#  MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+#  IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+#  DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+#  OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
+#  OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+# stdlib
+import errno
+import itertools
+import os
+import shutil
+import sys
+import time
+from collections import Counter, defaultdict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from threading import BoundedSemaphore, Lock
+from typing import Callable, DefaultDict, Deque, Dict, List, Optional, Sequence, Set, Tuple
+
+# this package
+from photo_sort.dedupe import full_hash
+
+__all__ = ["BACKENDS", "CopyBackends", "CopyExecutor", "MoveEngine", "device_concurrency", "fsync_path"]
+
+#: The number of concurrent copies to or from a device which is removable or rotational (e.g. an SD card reader).
+SLOW_DEVICE_LIMIT = 2
+
+
+#: The copy backends, in the order they are tried.
+BACKENDS = ("hardlink", "reflink", "copy_file_range", "sendfile", "buffered")
+
+# From linux/fs.h
+_FICLONE = 0x40049409
+
+# Errors from a backend's copy call meaning it cannot be used for a pair of filesystems,
+# rather than that the copy failed.
+_UNSUPPORTED = frozenset({
+		errno.EXDEV,
+		errno.EINVAL,
+		errno.ENOSYS,
+		errno.ENOTTY,
+		errno.EOPNOTSUPP,
+		getattr(errno, "ENOTSUP", errno.EOPNOTSUPP),
+		errno.EPERM,
+		errno.EMLINK,
+		errno.EBADF,
+		})
+
+
+class _Unsupported(Exception):
+	"""
+	Raised when a backend cannot copy between a pair of filesystems.
+
+	Errors opening or replacing the files are not wrapped, as they affect every backend alike.
+	"""
+
+	def __init__(self, error: OSError):
+		super().__init__(error)
+		self.error = error
+
+
+def _reflink(source_fd: int, destination_fd: int, size: int, block_size: int) -> None:
+	# stdlib
+	import fcntl
+
+	fcntl.ioctl(destination_fd, _FICLONE, source_fd)
+
+
+def _copy_file_range(source_fd: int, destination_fd: int, size: int, block_size: int) -> None:
+	offset = 0
+	while offset < size:
+		copied = os.copy_file_range(source_fd, destination_fd, min(size - offset, 1 << 30))
+		if not copied:
+			if not offset:
+				# Some filesystems report success but copy nothing.
+				raise OSError(errno.EINVAL, "copy_file_range copied no data")
+			break
+		offset += copied
+
+
+def _sendfile(source_fd: int, destination_fd: int, size: int, block_size: int) -> None:
+	offset = 0
+	while offset < size:
+		sent = os.sendfile(destination_fd, source_fd, offset, min(size - offset, 1 << 30))
+		if not sent:
+			if not offset:
+				raise OSError(errno.EINVAL, "sendfile copied no data")
+			break
+		offset += sent
+
+
+def _buffered(source_fd: int, destination_fd: int, size: int, block_size: int) -> None:
+	buffer = bytearray(block_size)
+	view = memoryview(buffer)
+
+	while True:
+		if hasattr(os, "readv"):
+			# Read straight into the buffer rather than allocating a new bytes object for each block.
+			read = os.readv(source_fd, [buffer])
+		else:
+			chunk = os.read(source_fd, block_size)
+			read = len(chunk)
+			view[:read] = chunk
+
+		if not read:
+			break
+
+		written = 0
+		while written < read:
+			written += os.write(destination_fd, view[written:read])
+
+
+_FD_BACKENDS: Dict[str, Callable[[int, int, int, int], None]] = {
+		"reflink": _reflink,
+		"copy_file_range": _copy_file_range,
+		"sendfile": _sendfile,
+		"buffered": _buffered,
+		}
+
+
+def _available(name: str) -> bool:
+	if name == "reflink":
+		return sys.platform.startswith("linux")
+	elif name == "copy_file_range":
+		return hasattr(os, "copy_file_range")
+	elif name == "sendfile":
+		# Copying between regular files with sendfile is only supported on Linux.
+		return sys.platform.startswith("linux") and hasattr(os, "sendfile")
+	elif name == "hardlink":
+		return hasattr(os, "link")
+	else:
+		return True
+
+
+def _format_size(size: float) -> str:
+	for unit in ("B", "kB", "MB", "GB"):
+		if size < 1000:
+			break
+		size /= 1000
+	else:
+		unit = "TB"
+
+	return f"{size:.1f} {unit}"
+
+
+class CopyBackends:
+	"""
+	Copies files with the fastest method that works between the source and destination filesystems.
+
+	The backends are tried in the order given by :py:data:`BACKENDS`.
+	When one is not supported for a ``(source device, destination device)`` pair it is skipped for
+	every later file between those devices, so the probing is only done once per pair.
+
+	Like :func:`shutil.copy2`, the file's permissions and timestamps are copied along with its data.
+
+	``hardlink`` must be asked for explicitly, as the "copy" then shares its data with the original,
+	so editing one edits the other.
+
+	:param backends: The backends to try, in order. The ``buffered`` backend is always used as a last resort.
+		By default every available backend except ``hardlink`` is tried.
+	:param block_size: The buffer size for the ``buffered`` backend.
+	"""
+
+	def __init__(self, backends: Optional[Sequence[str]] = None, block_size: int = 1024 * 1024):
+		if backends is None:
+			backends = [name for name in BACKENDS if name != "hardlink"]
+
+		for name in backends:
+			if name not in BACKENDS:
+				raise ValueError(f"Unknown copy backend {name!r}")
+
+		self.backends = [name for name in backends if _available(name)]
+		if "buffered" not in self.backends:
+			self.backends.append("buffered")
+
+		self.block_size = block_size
+
+		#: The number of files copied by each backend.
+		self.files: Counter = Counter()
+		#: The number of bytes copied by each backend.
+		self.bytes: Counter = Counter()
+		#: The time spent copying by each backend, in seconds.
+		self.seconds: DefaultDict[str, float] = defaultdict(float)
+
+		# The index in self.backends of the first backend to try for each pair of devices.
+		self._pairs: Dict[Tuple[int, int], int] = {}
+		self._lock = Lock()
+
+	def _hardlink(self, source: str, destination: str) -> None:
+		# Link to an unused temporary name, then replace the reserved file, so the name is never left unclaimed.
+		directory, filename = os.path.split(destination)
+
+		for number in itertools.count():
+			link = os.path.join(directory, f".{filename}.{number}.link")
+			try:
+				os.link(source, link)
+			except FileExistsError:
+				continue
+			except OSError as e:
+				if e.errno in _UNSUPPORTED:
+					raise _Unsupported(e) from e
+				raise
+			break
+
+		try:
+			os.replace(link, destination)
+		except OSError:
+			os.unlink(link)
+			raise
+
+	def _copy_data(self, backend: str, source: str, destination: str, size: int) -> None:
+		source_fd = os.open(source, os.O_RDONLY | getattr(os, "O_BINARY", 0))
+		try:
+			flags = os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0)
+			destination_fd = os.open(destination, flags, 0o666)
+			try:
+				_FD_BACKENDS[backend](source_fd, destination_fd, size, self.block_size)
+			except OSError as e:
+				# There is nothing to fall back to from the buffered backend.
+				if backend != "buffered" and e.errno in _UNSUPPORTED:
+					raise _Unsupported(e) from e
+				raise
+			finally:
+				os.close(destination_fd)
+		finally:
+			os.close(source_fd)
+
+		shutil.copystat(source, destination)
+
+	def copy(self, source: str, destination: str) -> str:
+		"""
+		Copy ``source`` to ``destination``, overwriting it.
+
+		:param source:
+		:param destination:
+
+		:returns: The name of the backend which copied the file.
+		"""
+
+		stat = os.stat(source)
+		pair = (stat.st_dev, os.stat(os.path.dirname(destination) or '.').st_dev)
+
+		index = self._pairs.get(pair, 0)
+
+		while True:
+			backend = self.backends[index]
+			if backend in {"hardlink", "reflink"} and pair[0] != pair[1]:
+				# These can only work within a single filesystem.
+				index = self._demote(pair, index)
+				continue
+
+			start = time.perf_counter()
+
+			try:
+				if backend == "hardlink":
+					self._hardlink(source, destination)
+				else:
+					self._copy_data(backend, source, destination, stat.st_size)
+			except _Unsupported:
+				index = self._demote(pair, index)
+				continue
+
+			elapsed = time.perf_counter() - start
+
+			with self._lock:
+				self.files[backend] += 1
+				self.bytes[backend] += stat.st_size
+				self.seconds[backend] += elapsed
+
+			return backend
+
+	def _demote(self, pair: Tuple[int, int], index: int) -> int:
+		with self._lock:
+			index = max(index + 1, self._pairs.get(pair, 0))
+			self._pairs[pair] = index
+			return index
+
+	def summary(self) -> str:
+		"""
+		Returns a human-readable summary of the files, bytes and throughput of each backend.
+
+		The throughput is per copy, so with several copies running at once the overall rate is higher.
+		"""
+
+		parts = []
+
+		for backend in self.backends:
+			if not self.files[backend]:
+				continue
+
+			rate = self.bytes[backend] / self.seconds[backend] if self.seconds[backend] else 0
+			parts.append(
+					f"{backend}: {self.files[backend]} files, "
+					f"{_format_size(self.bytes[backend])}, {_format_size(rate)}/s"
+					)
+
+		return ", ".join(parts) or "nothing"
+
+
+def fsync_path(path: str) -> None:
+	"""
+	Flush a file or directory to disk.
+
+	Directories cannot be flushed on some platforms (e.g. Windows), in which case this does nothing.
+
+	:param path:
+	"""
+
+	try:
+		fd = os.open(path, os.O_RDONLY | getattr(os, "O_BINARY", 0))
+	except (PermissionError, IsADirectoryError):
+		return
+
+	try:
+		os.fsync(fd)
+	except OSError as e:
+		if e.errno not in {errno.EINVAL, errno.EBADF}:
+			raise
+	finally:
+		os.close(fd)
+
+
+class MoveEngine:
+	"""
+	Moves files, renaming them within a filesystem and copying them safely between filesystems.
+
+	A file moved to another filesystem is copied, flushed to disk and compared against the original.
+	The originals are only deleted by :meth:`~.MoveEngine.commit`, once the destination directories
+	have also been flushed, so a crash or power cut part way through can never lose a file.
+
+	:param backends: Used to copy files between filesystems.
+	:param batch_size: The number of copied files after which :meth:`~.MoveEngine.ready` returns :py:obj:`True`.
+	:param verify: Whether to compare the contents of each copy against the original.
+	"""
+
+	def __init__(self, backends: CopyBackends, batch_size: int = 100, verify: bool = True):
+		self.backends = backends
+		self.batch_size = batch_size
+		self.verify = verify
+
+		#: The number of files moved by renaming them.
+		self.renamed = 0
+		#: The number of files moved by copying them.
+		self.copied = 0
+
+		# Files which have been copied and flushed, whose originals have not yet been deleted.
+		self._pending: List[Tuple[str, str]] = []
+		self._lock = Lock()
+
+	def move(self, source: str, destination: str) -> None:
+		"""
+		Move ``source`` to ``destination``, overwriting it.
+
+		If the file had to be copied the original remains until the next :meth:`~.MoveEngine.commit`.
+
+		:param source:
+		:param destination:
+		"""
+
+		directory = os.path.dirname(destination) or '.'
+
+		if os.stat(source).st_dev == os.stat(directory).st_dev:
+			try:
+				os.replace(source, destination)
+			except OSError as e:
+				# e.g. two bind mounts of the same filesystem.
+				if e.errno != errno.EXDEV:
+					raise
+			else:
+				with self._lock:
+					self.renamed += 1
+				return
+
+		self.backends.copy(source, destination)
+		fsync_path(destination)
+
+		if self.verify and full_hash(source) != full_hash(destination):
+			raise OSError(errno.EIO, "The copy does not match the original", destination)
+
+		with self._lock:
+			self.copied += 1
+			self._pending.append((source, destination))
+
+	def ready(self) -> bool:
+		"""
+		Returns whether a full batch of copied files is waiting for :meth:`~.MoveEngine.commit`.
+		"""
+
+		return len(self._pending) >= self.batch_size
+
+	def commit(self) -> List[Tuple[str, OSError]]:
+		"""
+		Make the copied files durable, then delete their originals.
+
+		:returns: A list of ``(source, exception)`` tuples for originals which could not be deleted.
+		"""
+
+		with self._lock:
+			pending, self._pending = self._pending, []
+
+		directories: Set[str] = {os.path.dirname(destination) or '.' for _, destination in pending}
+		for directory in directories:
+			fsync_path(directory)
+
+		failed = []
+
+		for source, _ in pending:
+			try:
+				os.unlink(source)
+			except FileNotFoundError:
+				pass
+			except OSError as e:
+				failed.append((source, e))
+
+		return failed
+
+
+def _read_flag(path: str) -> Optional[bool]:
+	try:
+		with open(path) as fp:
+			return fp.read().strip() == '1'
+	except OSError:
+		return None
+
+
+def device_concurrency(device: int, default: int = 8) -> int:
+	"""
+	Returns the number of files which should be copied to or from the given device at once.
+
+	On Linux, removable and rotational block devices are limited to :py:data:`SLOW_DEVICE_LIMIT`,
+	as they slow down when asked to seek between several files.
+	Everything else, including devices which cannot be identified, gets ``default``.
+
+	:param device: The device number, as given by :py:attr:`os.stat_result.st_dev`.
+	:param default:
+	"""
+
+	if not sys.platform.startswith("linux"):
+		return default
+
+	block = f"/sys/dev/block/{os.major(device)}:{os.minor(device)}"
+	if not os.path.isdir(block):
+		# Network and virtual filesystems.
+		return default
+
+	block = os.path.realpath(block)
+	if not os.path.isdir(os.path.join(block, "queue")):
+		# A partition; the flags are on the disk which contains it.
+		block = os.path.dirname(block)
+
+	for flag in ("removable", "queue/rotational"):
+		if _read_flag(os.path.join(block, flag)):
+			return SLOW_DEVICE_LIMIT
+
+	return default
+
+
+class CopyExecutor:
+	"""
+	Copies or moves files on a pool of threads.
+
+	The number of files read from or written to each device at once is limited,
+	so slow devices such as SD cards are not asked to seek between many files.
+
+	:meth:`~.CopyExecutor.submit` blocks while the source or destination device is busy,
+	so the caller never gets more than a few files ahead of the copies.
+	Completion callbacks are run in the thread which calls :meth:`~.CopyExecutor.submit`
+	and :meth:`~.CopyExecutor.process_completed`, never in the pool.
+
+	:param max_workers: The maximum number of files to copy at once.
+	:param device_limits: A mapping of device numbers (:py:attr:`os.stat_result.st_dev`) to the maximum number
+		of files to copy to or from that device at once. Other devices are found with :func:`~.device_concurrency`.
+	"""
+
+	def __init__(self, max_workers: int = 4, device_limits: Optional[Dict[int, int]] = None):
+		self.max_workers = max(1, max_workers)
+		self.device_limits: Dict[int, int] = dict(device_limits or {})
+
+		self._pool: Optional[ThreadPoolExecutor] = None
+		self._slots = BoundedSemaphore(self.max_workers)
+		self._devices: Dict[int, BoundedSemaphore] = {}
+		self._devices_lock = Lock()
+		self._pending: Deque[Tuple[Future, Callable[[Optional[BaseException]], None]]] = deque()
+
+	def _device_semaphore(self, device: int) -> BoundedSemaphore:
+		with self._devices_lock:
+			try:
+				return self._devices[device]
+			except KeyError:
+				if device not in self.device_limits:
+					self.device_limits[device] = device_concurrency(device, self.max_workers)
+				semaphore = self._devices[device] = BoundedSemaphore(max(1, self.device_limits[device]))
+				return semaphore
+
+	def _run(self, function: Callable[[str, str], object], source: str, destination: str, held: List) -> None:
+		try:
+			function(source, destination)
+		finally:
+			for semaphore in reversed(held):
+				semaphore.release()
+
+	def submit(
+			self,
+			function: Callable[[str, str], object],
+			source: str,
+			destination: str,
+			on_done: Callable[[Optional[BaseException]], None],
+			) -> None:
+		"""
+		Run ``function(source, destination)`` on the pool once both devices have a free slot.
+
+		:param function: e.g. :func:`shutil.copy2` or :func:`shutil.move`.
+		:param source:
+		:param destination: The destination file, whose directory must already exist.
+		:param on_done: Called with the exception raised by ``function``, or :py:obj:`None` if it succeeded.
+		"""
+
+		try:
+			devices = {os.stat(source).st_dev, os.stat(os.path.dirname(destination) or '.').st_dev}
+		except OSError as e:
+			on_done(e)
+			return
+
+		# Always acquire in the same order so two threads can never each hold what the other is waiting for.
+		held = [self._slots]
+		held.extend(self._device_semaphore(device) for device in sorted(devices))
+		for semaphore in held:
+			semaphore.acquire()
+
+		if self._pool is None:
+			self._pool = ThreadPoolExecutor(self.max_workers, thread_name_prefix="CopyThread")
+
+		try:
+			future = self._pool.submit(self._run, function, source, destination, held)
+		except BaseException:
+			for semaphore in reversed(held):
+				semaphore.release()
+			raise
+
+		self._pending.append((future, on_done))
+		self.process_completed()
+
+	def process_completed(self, wait: bool = False) -> None:
+		"""
+		Run the callbacks for copies which have finished.
+
+		:param wait: Wait for all outstanding copies to finish first.
+		"""
+
+		still_pending: Deque[Tuple[Future, Callable[[Optional[BaseException]], None]]] = deque()
+
+		while self._pending:
+			future, on_done = self._pending.popleft()
+			if wait or future.done():
+				on_done(future.exception())
+			else:
+				still_pending.append((future, on_done))
+
+		self._pending = still_pending
+
+	def close(self) -> None:
+		"""
+		Wait for all outstanding copies to finish, run their callbacks, and stop the threads.
+		"""
+
+		self.process_completed(wait=True)
+
+		if self._pool is not None:
+			self._pool.shutdown()
+			self._pool = None
+
+	def __enter__(self) -> "CopyExecutor":
+		return self
+
+	def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+		self.close()
@@ -0,0 +1,328 @@
+#!/usr/bin/env python3
+#
+#  dedupe.py
+"""
+Index of the files in the destination library, for finding byte-identical duplicates.
+"""
+#
+#  Copyright © 2014-2021 Dominic Davis-Foster <dominic@davis-foster.co.uk>
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#  EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+#  MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+#  IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+#  DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+#  OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
+#  OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+# stdlib
+import hashlib
+import os
+import sqlite3
+from typing import Dict, Optional
+
+__all__ = ["PARTIAL_BYTES", "DuplicateIndex", "full_hash", "partial_hash"]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+	path TEXT PRIMARY KEY,
+	size INTEGER NOT NULL,
+	mtime_ns INTEGER NOT NULL,
+	partial BLOB,
+	full BLOB
+);
+CREATE INDEX IF NOT EXISTS files_size ON files (size);
+CREATE TABLE IF NOT EXISTS directories (
+	path TEXT PRIMARY KEY,
+	mtime_ns INTEGER NOT NULL
+);
+"""
+
+# Files Photo Sort keeps in the library, e.g. the journal, which are not part of it.
+_PRIVATE_PREFIX = ".photo-sort-"
+
+#: The number of bytes from each end of the file used for :func:`~.partial_hash`.
+PARTIAL_BYTES = 64 * 1024
+
+
+def partial_hash(filename: str) -> bytes:
+	"""
+	Returns a hash of the first and last :data:`~.PARTIAL_BYTES` of the file.
+
+	:param filename:
+	"""
+
+	digest = hashlib.blake2b(digest_size=16)
+
+	with open(filename, "rb") as file:
+		digest.update(file.read(PARTIAL_BYTES))
+
+		size = os.fstat(file.fileno()).st_size
+		if size > 2 * PARTIAL_BYTES:
+			file.seek(size - PARTIAL_BYTES)
+		digest.update(file.read(PARTIAL_BYTES))
+
+	return digest.digest()
+
+
+def full_hash(filename: str) -> bytes:
+	"""
+	Returns a hash of the entire contents of the file.
+
+	:param filename:
+	"""
+
+	digest = hashlib.blake2b()
+
+	with open(filename, "rb") as file:
+		for block in iter(lambda: file.read(1024 * 1024), b''):
+			digest.update(block)
+
+	return digest.digest()
+
+
+class _Fingerprint:
+	"""
+	Lazily computed hashes of a file which may be a duplicate.
+	"""
+
+	def __init__(self, filename: str, stat: os.stat_result):
+		self.filename = filename
+		self.stat = stat
+		self._partial: Optional[bytes] = None
+		self._full: Optional[bytes] = None
+
+	@property
+	def partial(self) -> bytes:
+		if self._partial is None:
+			self._partial = partial_hash(self.filename)
+		return self._partial
+
+	@property
+	def full(self) -> bytes:
+		if self._full is None:
+			self._full = full_hash(self.filename)
+		return self._full
+
+
+class DuplicateIndex:
+	"""
+	An index of the files in a destination library, stored in an SQLite database in the library itself.
+
+	A file is compared against those of the same size;
+	then against those whose first and last few kilobytes match;
+	and only then is the whole of each file hashed.
+	Hashes of files in the library are computed when first needed and stored for future runs.
+
+	The library is scanned each time the index is opened, listing again only the directories which have been
+	modified since the last scan, so files added to the library by other programs are found too.
+	Files added by Photo Sort are recorded with :meth:`~.DuplicateIndex.add` as they are written.
+
+	:param root: The root directory of the library.
+	:param filename: The name of the index database, relative to ``root``.
+	"""
+
+	def __init__(self, root: str, filename: str = ".photo-sort-index.sqlite"):
+		self.root = root
+		self.filename = filename
+
+		self._connection: Optional[sqlite3.Connection] = None
+		self._fingerprints: Dict[str, _Fingerprint] = {}
+
+	@property
+	def connection(self) -> sqlite3.Connection:
+		"""
+		The connection to the database, which is opened (and the library scanned) on first use.
+		"""
+
+		if self._connection is None:
+			os.makedirs(self.root, exist_ok=True)
+			connection = sqlite3.connect(os.path.join(self.root, self.filename))
+			connection.execute("PRAGMA journal_mode=WAL")
+			connection.execute("PRAGMA synchronous=NORMAL")
+			connection.executescript(_SCHEMA)
+
+			self._connection = connection
+			self.scan()
+
+		return self._connection
+
+	def scan(self) -> int:
+		"""
+		Record the files in each directory of the library which has been modified since it was last scanned.
+
+		Only the size and modification time of new or changed files are recorded;
+		hashes are computed later as needed.
+		Entries for files which have been deleted are removed when they are next compared against.
+
+		:returns: The number of files recorded.
+		"""
+
+		scanned = dict(self.connection.execute("SELECT path, mtime_ns FROM directories").fetchall())
+		rows = []
+		directories = []
+		stack = [self.root]
+
+		while stack:
+			directory = stack.pop()
+			try:
+				# Before listing it, so a file added while it is being listed is found next time.
+				mtime_ns = os.stat(directory).st_mtime_ns
+				entries = list(os.scandir(directory))
+			except OSError:
+				continue
+
+			relative = os.path.relpath(directory, self.root)
+			changed = scanned.get(relative) != mtime_ns
+			if changed:
+				directories.append((relative, mtime_ns))
+
+			for entry in entries:
+				if entry.is_dir(follow_symlinks=False):
+					stack.append(entry.path)
+				elif changed and entry.is_file(follow_symlinks=False) and not self._is_private(entry.name):
+					path = os.path.relpath(entry.path, self.root)
+					stat = entry.stat(follow_symlinks=False)
+					row = self.connection.execute("SELECT size, mtime_ns FROM files WHERE path = ?", (path, )).fetchone()
+					if row != (stat.st_size, stat.st_mtime_ns):
+						rows.append((path, stat.st_size, stat.st_mtime_ns))
+
+		with self.connection:
+			self.connection.executemany("INSERT OR REPLACE INTO files (path, size, mtime_ns) VALUES (?, ?, ?)", rows)
+			self.connection.executemany("INSERT OR REPLACE INTO directories VALUES (?, ?)", directories)
+
+		return len(rows)
+
+	def _is_private(self, name: str) -> bool:
+		return name.startswith(self.filename) or name.startswith(_PRIVATE_PREFIX)
+
+	def find(self, filename: str) -> Optional[str]:
+		"""
+		Returns the path of a file in the library which is identical to ``filename``, if there is one.
+
+		:param filename:
+		"""
+
+		source = _Fingerprint(filename, os.stat(filename))
+		self._fingerprints[filename] = source
+
+		# The hashes are kept for add() if the file is going to be added to the library.
+		keep = False
+		try:
+			candidate = self._find(source)
+			keep = candidate is None
+			return candidate
+		finally:
+			if not keep:
+				self._fingerprints.pop(filename, None)
+
+	def _find(self, source: _Fingerprint) -> Optional[str]:
+		rows = self.connection.execute(
+				"SELECT path, mtime_ns, partial, full FROM files WHERE size = ?",
+				(source.stat.st_size, ),
+				).fetchall()
+
+		for path, mtime_ns, partial, full in rows:
+			candidate = os.path.join(self.root, path)
+
+			try:
+				stat = os.stat(candidate)
+			except OSError:
+				with self.connection:
+					self.connection.execute("DELETE FROM files WHERE path = ?", (path, ))
+				continue
+
+			if (stat.st_dev, stat.st_ino) == (source.stat.st_dev, source.stat.st_ino):
+				# The same file, e.g. when sorting within the library.
+				continue
+
+			if (stat.st_size, stat.st_mtime_ns) != (source.stat.st_size, mtime_ns):
+				# The file has changed since it was indexed.
+				self._update(path, stat.st_size, stat.st_mtime_ns, None, None)
+				if stat.st_size != source.stat.st_size:
+					continue
+				partial = full = None
+
+			if partial is None:
+				partial = partial_hash(candidate)
+				self._update(path, stat.st_size, stat.st_mtime_ns, partial, None)
+
+			if partial != source.partial:
+				continue
+
+			if full is None:
+				full = full_hash(candidate)
+				self._update(path, stat.st_size, stat.st_mtime_ns, partial, full)
+
+			if full == source.full:
+				return candidate
+
+		return None
+
+	def _update(self, path: str, size: int, mtime_ns: int, partial: Optional[bytes], full: Optional[bytes]) -> None:
+		with self.connection:
+			self.connection.execute(
+					"UPDATE files SET size = ?, mtime_ns = ?, partial = ?, full = ? WHERE path = ?",
+					(size, mtime_ns, partial, full, path),
+					)
+
+	def add(self, filename: str, source: Optional[str] = None) -> None:
+		"""
+		Record a file which has been added to the library.
+
+		:param filename: The path of the file in the library.
+		:param source: The file it was copied from.
+			Any hashes already computed for the source by :meth:`~.DuplicateIndex.find` are reused.
+		"""
+
+		stat = os.stat(filename)
+		partial = full = None
+
+		fingerprint = self._fingerprints.pop(source or filename, None)
+		if fingerprint is not None and fingerprint.stat.st_size == stat.st_size:
+			partial, full = fingerprint._partial, fingerprint._full
+
+		with self.connection:
+			self.connection.execute(
+					"INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)",
+					(os.path.relpath(filename, self.root), stat.st_size, stat.st_mtime_ns, partial, full),
+					)
+
+	def forget(self, filename: str) -> None:
+		"""
+		Forget the hashes of a file which will not be added to the library after all, e.g. as it could not be copied.
+
+		These are kept by :meth:`~.DuplicateIndex.find` for :meth:`~.DuplicateIndex.add` to reuse.
+
+		:param filename:
+		"""
+
+		self._fingerprints.pop(filename, None)
+
+	def close(self) -> None:
+		"""
+		Close the index.
+		"""
+
+		if self._connection is not None:
+			self._connection.close()
+			self._connection = None
+
+		self._fingerprints.clear()
+
+	def __enter__(self) -> "DuplicateIndex":
+		return self
+
+	def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+		self.close()
@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+#
+#  destination.py
+"""
+Tracks the contents of destination directories, so that new files can be given unique names cheaply.
+"""
+#
+#  Copyright © 2014-2021 Dominic Davis-Foster <dominic@davis-foster.co.uk>
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#  EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+#  MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+#  IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+#  DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+#  OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
+#  OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+# stdlib
+import os
+from typing import Dict, Optional, Set
+
+__all__ = ["DestinationIndex"]
+
+
+class _DirectoryNames:
+	"""
+	The names of the files in a single directory.
+	"""
+
+	def __init__(self, directory: str):
+		self.names: Set[str] = set()
+
+		# The next duplicate number to try for each filename, so repeated collisions do not rescan from (1).
+		self.next_number: Dict[str, int] = {}
+
+		# Whether the directory existed when it was listed.
+		self.exists = True
+
+		try:
+			with os.scandir(directory) as entries:
+				for entry in entries:
+					self.names.add(os.path.normcase(entry.name))
+		except FileNotFoundError:
+			self.exists = False
+
+
+class DestinationIndex:
+	"""
+	An in-memory index of the names of the files in each destination directory.
+
+	Each directory is listed once, when a file is first sorted into it,
+	and the index is kept up to date as files are added.
+	Unique names are then allocated without any further filesystem calls,
+	except for creating the file itself with ``O_EXCL`` to guard against other programs writing to the directory.
+
+	The directories known to exist are also remembered, so each is only created once per sort.
+	"""
+
+	def __init__(self):
+		self._directories: Dict[str, _DirectoryNames] = {}
+
+		# Directories which exist, by normcase'd path.
+		self._existing: Set[str] = set()
+
+		#: The number of directories created by :meth:`~.DestinationIndex.make_directory`.
+		self.directories_made = 0
+		#: The number of calls to :meth:`~.DestinationIndex.make_directory` which needed no filesystem calls.
+		self.mkdirs_avoided = 0
+
+	def _get_directory(self, directory: str) -> _DirectoryNames:
+		try:
+			return self._directories[directory]
+		except KeyError:
+			names = self._directories[directory] = _DirectoryNames(directory)
+			return names
+
+	def make_directory(self, directory: str) -> None:
+		"""
+		Create ``directory`` and any missing parents, unless it is already known to exist.
+
+		The first existing ancestor is found by walking up from ``directory``,
+		then the missing directories are created from the top down, each with a single :func:`os.mkdir`.
+
+		:param directory:
+		"""
+
+		key = os.path.normcase(directory)
+
+		if key in self._existing:
+			self.mkdirs_avoided += 1
+			return
+
+		missing = []
+		path = directory
+
+		while True:
+			key = os.path.normcase(path)
+			if key in self._existing:
+				break
+
+			names = self._directories.get(path)
+			if names is not None and names.exists:
+				break
+
+			if os.path.isdir(path):
+				break
+
+			missing.append(path)
+			parent = os.path.dirname(path)
+			if parent == path or not parent:
+				break
+			path = parent
+
+		for path in reversed(missing):
+			try:
+				os.mkdir(path)
+			except FileExistsError:
+				# Created by someone else in the meantime, or a file.
+				if not os.path.isdir(path):
+					raise
+			else:
+				self.directories_made += 1
+
+			self._existing.add(os.path.normcase(path))
+
+		self._existing.add(os.path.normcase(directory))
+
+	def allocate(self, directory: str, filename: str) -> str:
+		"""
+		Returns an unused name for ``filename`` in ``directory``, and marks it as used.
+
+		If ``filename`` is already taken a number is added to the end, e.g. ``IMG_0001 (1).JPG``.
+
+		:param directory:
+		:param filename:
+		"""
+
+		names = self._get_directory(directory)
+		key = os.path.normcase(filename)
+
+		if key not in names.names:
+			names.names.add(key)
+			return filename
+
+		base_filename, extension = os.path.splitext(filename)
+		number = names.next_number.get(key, 1)
+
+		while True:
+			candidate = f"{base_filename} ({number}){extension}"
+			if os.path.normcase(candidate) not in names.names:
+				break
+			number += 1
+
+		names.next_number[key] = number + 1
+		names.names.add(os.path.normcase(candidate))
+		return candidate
+
+	def reserve(self, directory: str, filename: str) -> str:
+		"""
+		Create an empty file in ``directory`` with an unused name for ``filename``, and return its path.
+
+		The file is created with ``O_EXCL``, so a file created by another program since the directory
+		was indexed is never overwritten. The caller should then copy or move the file over it.
+
+		:param directory: The directory, which must already exist.
+		:param filename:
+		"""
+
+		while True:
+			path = os.path.join(directory, self.allocate(directory, filename))
+
+			try:
+				fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+			except FileExistsError:
+				# Created by someone else; allocate() has now recorded it as used.
+				continue
+
+			os.close(fd)
+			return path
+
+	def link(self, source: str, directory: str, filename: str) -> str:
+		"""
+		Hard link ``source`` into ``directory`` with an unused name for ``filename``, and return the path of the link.
+
+		:param source: The file to link to.
+		:param directory: The directory, which must already exist.
+		:param filename:
+
+		:raises OSError: If the link cannot be made, e.g. because the filesystem does not support hard links.
+		"""
+
+		while True:
+			name = self.allocate(directory, filename)
+			path = os.path.join(directory, name)
+
+			try:
+				os.link(source, path)
+			except FileExistsError:
+				# Created by someone else; allocate() has now recorded it as used.
+				continue
+			except OSError:
+				self.forget(path)
+				raise
+
+			return path
+
+	def claim(self, directory: str, filename: str) -> Optional[str]:
+		"""
+		Create an empty file in ``directory`` with exactly the given name, e.g. one allocated when planning the sort.
+
+		:param directory: The directory, which must already exist.
+		:param filename:
+
+		:returns: The path of the file, or :py:obj:`None` if a file with that name already exists.
+		"""
+
+		path = os.path.join(directory, filename)
+
+		try:
+			fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+		except FileExistsError:
+			self.add(path)
+			return None
+
+		os.close(fd)
+		self.add(path)
+		return path
+
+	def release(self, path: str) -> None:
+		"""
+		Remove a file created by :meth:`~.DestinationIndex.reserve` which is no longer required.
+
+		:param path:
+		"""
+
+		try:
+			os.unlink(path)
+		except FileNotFoundError:
+			pass
+
+		self.forget(path)
+
+	def forget(self, path: str) -> None:
+		"""
+		Mark the name of a file as unused, e.g. once the file has been renamed.
+
+		:param path:
+		"""
+
+		directory, filename = os.path.split(path)
+
+		if directory in self._directories:
+			self._directories[directory].names.discard(os.path.normcase(filename))
+
+	def add(self, path: str) -> None:
+		"""
+		Record that a file has been created, without reserving it.
+
+		:param path:
+		"""
+
+		directory, filename = os.path.split(path)
+		self._get_directory(directory).names.add(os.path.normcase(filename))
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+#
+#  discovery.py
+"""
+Find the files to be sorted.
+"""
+#
+#  Copyright © 2014-2021 Dominic Davis-Foster <dominic@davis-foster.co.uk>
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#  EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+#  MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+#  IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+#  DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+#  OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
+#  OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+# stdlib
+import os
+import time
+from queue import Queue
+from threading import Event, Thread
+from typing import Callable, Iterator, Optional
+
+# this package
+from photo_sort.metrics import NULL_METRICS, Metrics
+
+__all__ = ["FileDiscovery", "scan_files"]
+
+# Put on the queue once every file has been found.
+_DONE = None
+
+
+def scan_files(source: str) -> Iterator["os.DirEntry[str]"]:
+	"""
+	Yield every file in ``source`` and its subdirectories, in the same order as :func:`os.walk`.
+
+	Each directory is listed once, and the type of each entry is taken from the listing where the
+	platform provides it, so files are found without calling :func:`os.stat` on each one.
+	Directories which cannot be read are skipped, and symbolic links to directories are not followed.
+
+	Each directory is listed in full before its files are yielded, so files and directories
+	created in it while they are being sorted (e.g. when sorting within directories) are not found.
+
+	:param source:
+	"""
+
+	stack = [source]
+
+	while stack:
+		directory = stack.pop()
+		files = []
+		subdirectories = []
+
+		try:
+			with os.scandir(directory) as entries:
+				for entry in entries:
+					try:
+						if entry.is_dir(follow_symlinks=False):
+							subdirectories.append(entry.path)
+						elif entry.is_file():
+							files.append(entry)
+					except OSError:
+						continue
+		except OSError:
+			continue
+
+		yield from files
+		stack.extend(reversed(subdirectories))
+
+
+class FileDiscovery:
+	"""
+	Finds the files to be sorted on a background thread, so sorting can begin as soon as the first is found.
+
+	Iterating over the discovery yields the path of each file as it is found,
+	and ends once the whole tree has been scanned.
+
+	:param source: The directory to search.
+	:param on_found: Called from the discovery thread with the number of files found so far,
+		at most once every ``interval`` seconds, and once more when discovery finishes.
+	:param interval: The minimum time between calls to ``on_found``, in seconds.
+	:param metrics: Records the time taken to find the files, as the ``discovery`` stage.
+	"""
+
+	def __init__(
+			self,
+			source: str,
+			on_found: Optional[Callable[[int], None]] = None,
+			interval: float = 0.1,
+			metrics: Metrics = NULL_METRICS,
+			):
+		self.source = source
+		self.on_found = on_found
+		self.interval = interval
+		self.metrics = metrics
+
+		#: The number of files found so far.
+		self.found = 0
+
+		self._queue: "Queue[Optional[str]]" = Queue()
+		self._stop_event = Event()
+		self._thread = Thread(target=self._run, name="DiscoveryThread", daemon=True)
+
+	def start(self) -> "FileDiscovery":
+		"""
+		Start searching for files.
+		"""
+
+		self._thread.start()
+		return self
+
+	def _run(self) -> None:
+		start = last_update = time.monotonic()
+
+		try:
+			for entry in scan_files(self.source):
+				if self._stop_event.is_set():
+					return
+
+				self._queue.put(entry.path)
+				self.found += 1
+
+				if self.on_found is not None and time.monotonic() - last_update >= self.interval:
+					self.on_found(self.found)
+					last_update = time.monotonic()
+
+			if self.on_found is not None:
+				self.on_found(self.found)
+
+		finally:
+			self.metrics.record("discovery", time.monotonic() - start, self.found)
+			self._queue.put(_DONE)
+
+	def stop(self) -> None:
+		"""
+		Stop searching for files. Iteration ends after the files which have already been found.
+		"""
+
+		self._stop_event.set()
+
+	def __iter__(self) -> Iterator[str]:
+		while True:
+			path = self._queue.get()
+			if path is _DONE:
+				# Leave the marker for any other iterator.
+				self._queue.put(_DONE)
+				return
+			yield path
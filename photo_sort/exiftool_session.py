@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+#
+#  exiftool_session.py
+"""
+A long-lived ``exiftool`` process which is shared by every file in a sort.
+"""
+#
+#  Copyright © 2014-2021 Dominic Davis-Foster <dominic@davis-foster.co.uk>
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#  EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+#  MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+#  IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+#  DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+#  OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
+#  OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+# stdlib
+import json
+import os
+import shutil
+import sys
+from threading import Lock
+from typing import Dict, Iterable, Optional, Sequence
+
+# 3rd party
+import exiftool  # type: ignore
+
+__all__ = ["ExifToolSession"]
+
+
+class _ExifToolDied(RuntimeError):
+	"""
+	Raised when the ``exiftool`` process exits while a command is in progress.
+	"""
+
+
+class _ExifToolGaveUp(RuntimeError):
+	"""
+	Raised when ``exiftool`` keeps exiting while running the same command.
+	"""
+
+
+class _ExifToolProcess(exiftool.ExifTool):
+	"""
+	:class:`exiftool.ExifTool` which notices when the subprocess has gone away.
+
+	The upstream implementation loops forever if ``exiftool`` exits part way through a command.
+	"""
+
+	running: bool
+
+	def execute(self, *params) -> bytes:  # noqa: D102
+		if not self.running:
+			raise ValueError("ExifTool instance not running.")
+
+		if self._process.poll() is not None:
+			raise _ExifToolDied
+
+		self._process.stdin.write(b"\n".join(params + (b"-execute\n", )))
+		self._process.stdin.flush()
+
+		output = bytearray()
+		fd = self._process.stdout.fileno()
+
+		while not output[-32:].strip().endswith(exiftool.sentinel):
+			chunk = os.read(fd, exiftool.block_size)
+			if not chunk:
+				raise _ExifToolDied
+			output += chunk
+
+		return bytes(output.strip()[:-len(exiftool.sentinel)])
+
+	def kill(self) -> None:
+		"""
+		Forcibly stop the ``exiftool`` process, e.g. after it has crashed.
+		"""
+
+		if not self.running:
+			return
+
+		try:
+			self._process.kill()
+			self._process.communicate()
+		except OSError:
+			pass
+
+		del self._process
+		self.running = False
+
+	def terminate(self) -> None:  # noqa: D102
+		try:
+			super().terminate()
+		except OSError:
+			# The process has already gone away.
+			self.kill()
+
+
+class ExifToolSession:
+	"""
+	A single ``exiftool`` process which stays open for the duration of a sort.
+
+	The process is started on first use, so sorts which never need ``exiftool`` never pay for it.
+	If ``exiftool`` crashes it is restarted and the command retried.
+	If a batch of files keeps crashing it, the files are tried one at a time,
+	and no tags are found for the files which still crash it.
+	If it is not installed, :meth:`~.ExifToolSession.get_tags_batch` finds no tags for any file.
+
+	The session may be shared between threads; commands are serialised.
+
+	:param executable: The ``exiftool`` executable to run.
+	:param max_restarts: The maximum number of times ``exiftool`` may be restarted while running one command.
+	"""
+
+	def __init__(self, executable: Optional[str] = None, max_restarts: int = 5):
+		self.executable = executable
+		self.max_restarts = max_restarts
+		self.restarts = 0
+
+		self._process: Optional[_ExifToolProcess] = None
+		self._lock = Lock()
+		self._available: Optional[bool] = None
+		self._warned = False
+		self._worked = False
+
+	@property
+	def running(self) -> bool:
+		"""
+		Whether the ``exiftool`` process is currently running.
+		"""
+
+		return self._process is not None and self._process.running
+
+	@property
+	def available(self) -> bool:
+		"""
+		Whether the ``exiftool`` executable can be found.
+		"""
+
+		if self._available is None:
+			self._available = shutil.which(self.executable or exiftool.executable) is not None
+
+		return self._available
+
+	def _not_available(self, reason: str = "exiftool could not be found") -> None:
+		if not self._warned:
+			self._warned = True
+			print(f"{reason}, so files which need it (e.g. most videos) will not be sorted.", file=sys.stderr)
+		self._available = False
+
+	def _ensure_started(self) -> _ExifToolProcess:
+		if self._process is None or not self._process.running:
+			self._process = _ExifToolProcess(self.executable)
+			try:
+				self._process.start()
+			except FileNotFoundError:
+				self._process = None
+				self._not_available()
+				raise
+
+		return self._process
+
+	def _restart(self) -> None:
+		if self._process is not None:
+			self._process.kill()
+			self._process = None
+
+		self.restarts += 1
+		if self.restarts > self.max_restarts:
+			self.restarts = 0
+			raise _ExifToolGaveUp(f"exiftool exited unexpectedly {self.max_restarts + 1} times; giving up.")
+
+	def execute_json(self, *params):
+		"""
+		Run ``exiftool`` with the given parameters and return the parsed JSON output.
+
+		:param params: Command line parameters for ``exiftool``.
+
+		:raises FileNotFoundError: If ``exiftool`` is not installed.
+		:raises RuntimeError: If ``exiftool`` exits more than ``max_restarts`` times in a row.
+		"""
+
+		with self._lock:
+			while True:
+				process = self._ensure_started()
+				try:
+					output = process.execute_json(*params)
+				except (_ExifToolDied, OSError):
+					self._restart()
+				else:
+					self.restarts = 0
+					self._worked = True
+					return output
+
+	def get_metadata(self, filename: str) -> Optional[Dict]:
+		"""
+		Returns the metadata for the given file, or :py:obj:`None` if ``exiftool`` could not read it.
+
+		:param filename:
+		"""
+
+		try:
+			return self.execute_json(filename)[0]
+		except (json.decoder.JSONDecodeError, IndexError, FileNotFoundError, _ExifToolGaveUp):
+			return None
+
+	def get_tags_batch(
+			self,
+			tags: Iterable[str],
+			filenames: Sequence[str],
+			fast: bool = True,
+			) -> Dict[str, Optional[Dict]]:
+		"""
+		Returns only the given tags for each of the given files, using a single ``exiftool`` command.
+
+		:param tags: The tags to extract, in the form ``<group>:<tag>``.
+		:param filenames:
+		:param fast: Run ``exiftool`` in fast mode, which avoids scanning to the end of each file.
+
+		:returns: A mapping of each filename to its tags,
+			or :py:obj:`None` for files where none of the tags could be found.
+		"""
+
+		if not self.available:
+			self._not_available()
+			return dict.fromkeys(filenames)
+
+		tags = list(tags)
+		params = [f"-{tag}" for tag in tags]
+		if fast:
+			params.append("-fast")
+		params.extend(filenames)
+
+		try:
+			output = self.execute_json(*params)
+		except json.decoder.JSONDecodeError:
+			# exiftool prints nothing if it could not read any of the files.
+			output = []
+		except FileNotFoundError:
+			return dict.fromkeys(filenames)
+		except _ExifToolGaveUp:
+			if len(filenames) == 1:
+				return {filenames[0]: None}
+
+			# Find the file(s) which crash exiftool, without losing the tags for the rest of the batch.
+			results: Dict[str, Optional[Dict]] = {}
+			for filename in filenames:
+				results.update(self.get_tags_batch(tags, [filename], fast))
+
+			if not self._worked:
+				# Every file crashed it, and no command has ever succeeded.
+				self._not_available("exiftool keeps exiting unexpectedly")
+
+			return results
+
+		# exiftool skips files it cannot read, so match the results up by filename rather than position.
+		by_source = {}
+		for metadata in output:
+			source = os.path.normpath(metadata.pop("SourceFile"))
+			by_source[source] = metadata or None
+
+		return {filename: by_source.get(os.path.normpath(filename)) for filename in filenames}
+
+	def close(self) -> None:
+		"""
+		Stop the ``exiftool`` process, if it is running.
+		"""
+
+		with self._lock:
+			if self._process is not None:
+				self._process.terminate()
+				self._process = None
+
+	def __enter__(self) -> "ExifToolSession":
+		return self
+
+	def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+		self.close()
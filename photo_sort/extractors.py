@@ -0,0 +1,414 @@
+#!/usr/bin/env python3
+#
+#  extractors.py
+"""
+Metadata extractors, and a chain which tries each in turn from cheapest to most expensive.
+"""
+#
+#  Copyright © 2014-2021 Dominic Davis-Foster <dominic@davis-foster.co.uk>
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#  EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+#  MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+#  IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+#  DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+#  OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
+#  OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+# stdlib
+import inspect
+import io
+from collections import Counter
+from typing import AbstractSet, BinaryIO, Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple, Union, cast
+
+# 3rd party
+import exifread
+from domdf_python_tools.iterative import chunks
+
+# this package
+from photo_sort.bmff import BmffExtractor
+from photo_sort.cache import MetadataCache
+from photo_sort.exiftool_session import ExifToolSession
+from photo_sort.fast_exif import FastExifExtractor
+from photo_sort.metrics import NULL_METRICS, Metrics
+from photo_sort.parsing import DEFAULT_RULES
+from photo_sort.utils import map_header
+
+__all__ = [
+		"EXIFTOOL_TAGS",
+		"SORT_TAGS",
+		"BatchExtractor",
+		"ExifReadExtractor",
+		"ExifToolExtractor",
+		"Extraction",
+		"Extractor",
+		"ExtractorChain",
+		"default_extractors",
+		"project",
+		]
+
+#: A callable which takes a filename and returns its metadata, or :py:obj:`None` if none could be found.
+Extractor = Callable[[str], Optional[Dict]]
+
+#: The ``exiftool`` tags used by the default :class:`~.MetadataRules`.
+EXIFTOOL_TAGS = DEFAULT_RULES.exiftool_tags
+
+#: All of the tags, from any extractor, which are used by the default :class:`~.MetadataRules`.
+SORT_TAGS = frozenset(DEFAULT_RULES.tags)
+
+
+# exifread 3.0 extracts thumbnails even when ``details=False``; earlier versions only do so when ``details=True``.
+_NO_THUMBNAIL = {"extract_thumbnail": False}
+if "extract_thumbnail" not in inspect.signature(exifread.process_file).parameters:
+	_NO_THUMBNAIL = {}
+
+
+class ExifReadExtractor:
+	"""
+	Reads the date and camera tags using :mod:`exifread`, looking only at the start of the file.
+
+	The file is memory-mapped, and at most ``header_bytes`` of it are ever read.
+	Parsing stops once ``stop_tag`` has been found, which skips the rest of the EXIF IFD and the thumbnail.
+
+	:param header_bytes: The maximum number of bytes to read from the start of the file.
+		If :py:obj:`None` the whole file is available to :mod:`exifread`.
+	:param stop_tag: The tag after which :mod:`exifread` stops parsing.
+	"""
+
+	def __init__(self, header_bytes: Optional[int] = 256 * 1024, stop_tag: str = "DateTimeOriginal"):
+		self.header_bytes = header_bytes
+		self.stop_tag = stop_tag
+
+	def __call__(self, filename: str) -> Optional[Dict]:
+		"""
+		Read the EXIF data from the given file.
+
+		:param filename:
+
+		:raises OSError: If the file cannot be opened.
+		"""
+
+		with open(filename, "rb") as file, map_header(file, self.header_bytes) as view:
+			if not view:
+				return None
+
+			# exifread only needs read(), seek() and tell(), which a memory map provides.
+			stream = io.BytesIO(view) if isinstance(view, bytes) else cast(BinaryIO, view)
+
+			try:
+				return exifread.process_file(
+						stream,
+						stop_tag=self.stop_tag,
+						details=False,
+						debug=False,
+						**_NO_THUMBNAIL,
+						) or None
+			except Exception:  # pylint: disable=broad-except
+				# The tags may run past the end of the header, and exifread raises all sorts of errors.
+				return None
+
+
+class BatchExtractor:
+	"""
+	Base class for extractors which are more efficient when given many files at once.
+	"""
+
+	def extract_batch(self, filenames: Sequence[str]) -> Dict[str, Optional[Dict]]:
+		"""
+		Returns a mapping of each filename to its metadata, or :py:obj:`None` if none could be found.
+
+		:param filenames:
+		"""
+
+		raise NotImplementedError
+
+	def __call__(self, filename: str) -> Optional[Dict]:
+		"""
+		Returns the metadata for a single file, or :py:obj:`None` if none could be found.
+
+		:param filename:
+		"""
+
+		return self.extract_batch([filename])[filename]
+
+
+class ExifToolExtractor(BatchExtractor):
+	"""
+	Extracts a fixed set of tags using ``exiftool``, sending ``batch_size`` files per command.
+
+	:param session: The ``exiftool`` session to use.
+	:param tags: The tags to extract.
+	:param batch_size: The maximum number of files to send to ``exiftool`` in a single command.
+	"""
+
+	def __init__(self, session: ExifToolSession, tags: Sequence[str] = EXIFTOOL_TAGS, batch_size: int = 50):
+		self.session = session
+		self.tags = tuple(tags)
+		self.batch_size = batch_size
+
+	@property
+	def available(self) -> bool:
+		"""
+		Whether ``exiftool`` is installed.
+		"""
+
+		return self.session.available
+
+	def extract_batch(self, filenames: Sequence[str]) -> Dict[str, Optional[Dict]]:  # noqa: D102
+		results = {}
+
+		for chunk in chunks(filenames, self.batch_size):
+			results.update(self.session.get_tags_batch(self.tags, chunk))
+
+		return results
+
+
+def project(data: Optional[Dict], tags: AbstractSet[str] = SORT_TAGS) -> Optional[Dict[str, str]]:
+	"""
+	Reduce metadata to the tags used for sorting, as strings which can be stored or sent to another process.
+
+	:param data:
+	:param tags: The tags used for sorting.
+	"""
+
+	if not data:
+		return None
+
+	return {key: str(value) for key, value in data.items() if key in tags}
+
+
+class Extraction(NamedTuple):
+	"""
+	The result of running a file through an :class:`~.ExtractorChain`.
+	"""
+
+	#: The name of the extractor which resolved the file, or :py:obj:`None` if none could.
+	extractor: Optional[str]
+
+	#: The metadata found for the file. If no extractor could resolve the file
+	#: this is the last non-empty result (if any), so the caller can still report why it could not be parsed.
+	data: Optional[Dict]
+
+	#: The error raised if the file could not be opened.
+	error: Optional[OSError] = None
+
+
+class ExtractorChain:
+	"""
+	Tries a sequence of metadata extractors in turn, stopping at the first whose output is acceptable.
+
+	Extractors should be ordered from cheapest to most expensive,
+	so that the expensive ones only run for files the cheap ones cannot handle.
+	Instances of :class:`~.BatchExtractor` are given all of the remaining files at once.
+
+	If a :class:`~.MetadataCache` is given, files are looked up there before any extractor is run,
+	and the tags in ``tags`` are stored for files which had to be extracted.
+
+	:param extractors: A sequence of ``(name, extractor)`` pairs.
+	:param accept: A callable which returns whether the metadata from an extractor is sufficient.
+	:param cache: An optional cache of metadata from previous runs.
+	:param profile: Identifies the settings ``accept`` depends on.
+		Cached failures are only reused if they were made with the same profile.
+	:param metrics: Records the time taken by the cache and by each extractor.
+	:param tags: The tags used for sorting, which are stored in the cache.
+
+	.. attribute:: counts
+
+		A :class:`collections.Counter` of the number of files resolved by each extractor
+		(or by ``"cache"``). Files which could not be resolved are counted under :py:obj:`None`.
+	"""
+
+	def __init__(
+			self,
+			extractors: Sequence[Tuple[str, Union[Extractor, BatchExtractor]]],
+			accept: Callable[[Dict], bool],
+			cache: Optional[MetadataCache] = None,
+			profile: str = '',
+			metrics: Metrics = NULL_METRICS,
+			tags: AbstractSet[str] = SORT_TAGS,
+			):
+		self.extractors = list(extractors)
+		self.accept = accept
+		self.cache = cache
+		self.profile = profile
+		self.metrics = metrics
+		self.tags = tags
+		self.counts: Counter = Counter()
+
+	def extract(self, filename: str) -> Extraction:
+		"""
+		Find the metadata for a single file.
+
+		:param filename:
+		"""
+
+		return self.extract_batch([filename])[filename]
+
+	def extract_batch(self, filenames: Sequence[str]) -> Dict[str, Extraction]:
+		"""
+		Find the metadata for each of the given files.
+
+		:param filenames:
+
+		:returns: A mapping of each filename to its :class:`~.Extraction`.
+		"""
+
+		results, pending = self.lookup_cached(filenames)
+		extracted = self.extract_uncached(pending)
+		self.store_cached(extracted)
+		results.update(extracted)
+
+		return results
+
+	def lookup_cached(self, filenames: Sequence[str]) -> Tuple[Dict[str, Extraction], List[str]]:
+		"""
+		Look up the given files in the cache.
+
+		:param filenames:
+
+		:returns: A mapping of filenames to :class:`~.Extraction` for the files which were found in the cache,
+			and a list of the files which were not.
+		"""
+
+		results: Dict[str, Extraction] = {}
+
+		if self.cache is None:
+			return results, list(filenames)
+
+		with self.metrics.time("cache.lookup", len(filenames)):
+			cached = self.cache.lookup(filenames, self.profile)
+
+		for filename, (name, data) in cached.items():
+			# A file which was resolved with different settings may not be resolved with these ones.
+			if name is None or (data is not None and self.accept(data)):
+				self.counts["cache"] += 1
+				results[filename] = Extraction(name, data)
+
+		return results, [filename for filename in filenames if filename not in results]
+
+	def extract_uncached(self, filenames: Sequence[str]) -> Dict[str, Extraction]:
+		"""
+		Find the metadata for each of the given files by running the extractors, bypassing the cache.
+
+		:param filenames:
+
+		:returns: A mapping of each filename to its :class:`~.Extraction`.
+		"""
+
+		results: Dict[str, Extraction] = {}
+		fallbacks: Dict[str, Dict] = {}
+		pending: List[str] = list(filenames)
+
+		for name, extractor in self.extractors:
+			if not pending:
+				break
+
+			with self.metrics.time(f"extract.{name}", len(pending)):
+				# A file which makes an extractor fail, e.g. because it is corrupt, is left for the next one.
+				if isinstance(extractor, BatchExtractor):
+					try:
+						found = extractor.extract_batch(pending)
+					except Exception:  # pylint: disable=broad-except
+						found = {}
+				else:
+					found = {}
+					for filename in pending:
+						try:
+							found[filename] = extractor(filename)
+						except OSError as e:
+							results[filename] = Extraction(None, None, e)
+						except Exception:  # pylint: disable=broad-except
+							pass
+
+			still_pending = []
+
+			for filename in pending:
+				data = found.get(filename)
+
+				if filename in results:
+					continue
+				elif not data:
+					still_pending.append(filename)
+				elif self.accept(data):
+					self.counts[name] += 1
+					results[filename] = Extraction(name, data)
+				else:
+					fallbacks[filename] = data
+					still_pending.append(filename)
+
+			pending = still_pending
+
+		for filename in pending:
+			self.counts[None] += 1
+			results[filename] = Extraction(None, fallbacks.get(filename))
+
+		return results
+
+	def store_cached(self, extractions: Dict[str, Extraction]) -> None:
+		"""
+		Store the results of :meth:`~.ExtractorChain.extract_uncached` in the cache.
+
+		:param extractions:
+		"""
+
+		if self.cache is None:
+			return
+
+		# Files which could not be resolved are tried again once every extractor is available, e.g. exiftool.
+		store_unresolved = all(getattr(extractor, "available", True) for _, extractor in self.extractors)
+
+		to_store = {}
+		for filename, extraction in extractions.items():
+			if extraction.error is None and (store_unresolved or extraction.extractor is not None):
+				to_store[filename] = (extraction.extractor, project(extraction.data, self.tags))
+
+		with self.metrics.time("cache.store", len(to_store)):
+			self.cache.store(to_store, self.profile)
+
+		self.cache.forget(filename for filename in extractions if filename not in to_store)
+
+	def summary(self) -> str:
+		"""
+		Returns a human-readable summary of the number of files handled by each extractor.
+		"""
+
+		parts = [f"{name}: {self.counts[name]}" for name, _ in self.extractors]
+		if self.cache is not None:
+			parts.insert(0, f"cache: {self.counts['cache']}")
+		parts.append(f"unresolved: {self.counts[None]}")
+		return ", ".join(parts)
+
+
+def default_extractors(
+		session: ExifToolSession,
+		batch_size: int = 50,
+		tags: Sequence[str] = EXIFTOOL_TAGS,
+		) -> List[Tuple[str, Union[Extractor, BatchExtractor]]]:
+	"""
+	Returns the standard sequence of extractors, from cheapest to most expensive.
+
+	exifread is only used for files the native parsers cannot handle,
+	and exiftool only for files none of them can handle.
+
+	:param session: The ``exiftool`` session to use.
+	:param batch_size: The maximum number of files to send to ``exiftool`` in a single command.
+	:param tags: The tags to ask ``exiftool`` for.
+	"""
+
+	return [
+			("native", FastExifExtractor()),
+			("bmff", BmffExtractor()),
+			("exifread", ExifReadExtractor()),
+			("exiftool", ExifToolExtractor(session, tags, batch_size=batch_size)),
+			]
@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+#
+#  fast_exif.py
+"""
+Fast extraction of the date and camera model from JPEG and TIFF-based files (including CR2, NEF, ARW and DNG).
+"""
+#
+#  Copyright © 2014-2021 Dominic Davis-Foster <dominic@davis-foster.co.uk>
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#  EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+#  MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+#  IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+#  DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+#  OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
+#  OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+# stdlib
+import mmap
+import struct
+from typing import Dict, Iterator, Optional, Tuple, Union
+
+# this package
+from photo_sort.utils import map_header
+
+__all__ = ["FastExifExtractor", "find_jpeg_exif", "read_tiff_tags"]
+
+_Buffer = Union[bytes, mmap.mmap]
+
+_ASCII = 2
+_LONG = 4
+_TYPE_SIZES = {1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 6: 1, 7: 1, 8: 2, 9: 4, 10: 8, 11: 4, 12: 8}
+
+_EXIF_IFD_POINTER = 0x8769
+
+# Tag IDs mapped to the names exifread gives them, so the output can be used by Worker.parse_date etc.
+_IFD0_TAGS = {0x0110: "Image Model", 0x0132: "Image DateTime"}
+_EXIF_TAGS = {0x9003: "EXIF DateTimeOriginal"}
+
+
+class _Truncated(ValueError):
+	"""
+	Raised when the tags extend beyond the available data.
+	"""
+
+
+def _ifd_entries(buf: _Buffer, base: int, endian: str, offset: int) -> Iterator[Tuple[int, int, int, int]]:
+	"""
+	Yields ``(tag, type, count, position)`` for each entry in the IFD at ``offset``.
+
+	``position`` is the absolute position of the entry's value in ``buf``.
+	"""
+
+	start = base + offset
+	if start + 2 > len(buf):
+		raise _Truncated
+
+	(n_entries, ) = struct.unpack_from(endian + 'H', buf, start)
+	if start + 2 + 12 * n_entries > len(buf):
+		raise _Truncated
+
+	for entry in range(start + 2, start + 2 + 12 * n_entries, 12):
+		tag, field_type, count, value_offset = struct.unpack_from(endian + "HHII", buf, entry)
+
+		if _TYPE_SIZES.get(field_type, 1) * count <= 4:
+			# The value is stored in the entry itself.
+			yield tag, field_type, count, entry + 8
+		else:
+			yield tag, field_type, count, base + value_offset
+
+
+def _read_ascii(buf: _Buffer, position: int, count: int) -> str:
+	if position + count > len(buf):
+		raise _Truncated
+
+	# Drop any garbage after a null, as exifread does.
+	value = buf[position:position + count].split(b'\0', 1)[0]
+
+	try:
+		return value.decode("UTF-8")
+	except UnicodeDecodeError:
+		return value.decode("latin-1")
+
+
+def read_tiff_tags(buf: _Buffer, base: int = 0) -> Optional[Dict[str, str]]:
+	"""
+	Read the date and camera model from the TIFF structure starting at ``base``.
+
+	Only IFD0 and the EXIF sub-IFD are examined.
+
+	:param buf: The data to parse.
+	:param base: The position of the TIFF header in ``buf``.
+
+	:returns: A mapping of exifread-style tag names to their values,
+		or :py:obj:`None` if ``buf`` does not contain a complete TIFF structure at ``base``.
+	"""
+
+	byte_order = buf[base:base + 2]
+	if byte_order == b"II":
+		endian = '<'
+	elif byte_order == b"MM":
+		endian = '>'
+	else:
+		return None
+
+	try:
+		magic, ifd0_offset = struct.unpack_from(endian + "HI", buf, base + 2)
+		if magic != 42:
+			return None
+
+		tags = {}
+		exif_offset = None
+
+		for tag, field_type, count, position in _ifd_entries(buf, base, endian, ifd0_offset):
+			if tag in _IFD0_TAGS and field_type == _ASCII:
+				tags[_IFD0_TAGS[tag]] = _read_ascii(buf, position, count)
+			elif tag == _EXIF_IFD_POINTER and field_type == _LONG:
+				(exif_offset, ) = struct.unpack_from(endian + 'I', buf, position)
+
+		if exif_offset:
+			for tag, field_type, count, position in _ifd_entries(buf, base, endian, exif_offset):
+				if tag in _EXIF_TAGS and field_type == _ASCII:
+					tags[_EXIF_TAGS[tag]] = _read_ascii(buf, position, count)
+
+	except (_Truncated, struct.error):
+		return None
+
+	return tags
+
+
+def find_jpeg_exif(buf: _Buffer) -> Optional[int]:
+	"""
+	Returns the position of the TIFF header inside the EXIF ``APP1`` segment of a JPEG file.
+
+	:py:obj:`None` is returned if there is no EXIF segment.
+
+	:param buf: The data to parse.
+	"""
+
+	position = 2
+	length = len(buf)
+
+	while position + 4 <= length:
+		if buf[position] != 0xFF:
+			return None
+
+		marker = buf[position + 1]
+
+		if marker == 0xFF:
+			# Fill byte
+			position += 1
+			continue
+		elif marker in {0xD9, 0xDA}:
+			# End of image, or start of the compressed image data
+			return None
+		elif marker == 0x01 or 0xD0 <= marker <= 0xD7:
+			# Markers without a length
+			position += 2
+			continue
+
+		(segment_length, ) = struct.unpack_from(">H", buf, position + 2)
+
+		if marker == 0xE1 and buf[position + 4:position + 10] == b"Exif\0\0":
+			return position + 10
+
+		position += 2 + segment_length
+
+	return None
+
+
+class FastExifExtractor:
+	"""
+	Reads ``DateTimeOriginal``, ``DateTime`` and ``Model`` from JPEG and TIFF-based files.
+
+	This avoids the overhead of exifread's general purpose tag handling.
+
+	Other file types give :py:obj:`None`, so a more general extractor can be tried instead.
+
+	:param header_bytes: The maximum number of bytes to read from the start of the file.
+	"""
+
+	def __init__(self, header_bytes: Optional[int] = 256 * 1024):
+		self.header_bytes = header_bytes
+
+	def __call__(self, filename: str) -> Optional[Dict]:
+		"""
+		Read the date and camera model from the given file.
+
+		:param filename:
+
+		:raises OSError: If the file cannot be opened.
+		"""
+
+		with open(filename, "rb") as file, map_header(file, self.header_bytes) as view:
+			magic = view[:4]
+
+			if magic[:2] == b"\xff\xd8":
+				base = find_jpeg_exif(view)
+				if base is None:
+					return None
+			elif magic in {b"II*\0", b"MM\0*"}:
+				base = 0
+			else:
+				return None
+
+			return read_tiff_tags(view, base) or None
@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+#
+#  journal.py
+"""
+An append-only record of the files sorted into a destination, so an interrupted sort can be resumed.
+"""
+#
+#  Copyright © 2014-2021 Dominic Davis-Foster <dominic@davis-foster.co.uk>
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#  EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+#  MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+#  IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+#  DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+#  OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
+#  OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+# stdlib
+import json
+import os
+from typing import Dict, IO, Iterable, List, Optional, Set, Tuple
+
+# this package
+from photo_sort.copying import fsync_path
+from photo_sort.dedupe import full_hash
+
+__all__ = ["JOURNAL_VERSION", "Journal", "JournalError"]
+
+#: The version of the journal format written by :class:`~.Journal`.
+JOURNAL_VERSION = 1
+
+
+def _key(path: str) -> str:
+	return os.path.normcase(os.path.abspath(path))
+
+
+class JournalError(ValueError):
+	"""
+	Raised when the journal in the destination cannot be read, e.g. as it was written by another version.
+	"""
+
+
+class Journal:
+	"""
+	An append-only journal in the destination of the files planned and completed by a sort.
+
+	Each line is a JSON array: ``["planned", source, destination]`` is written, and flushed to disk,
+	once an empty file has been created at each destination in a chunk but before the files are copied or moved,
+	and ``["done", source, destination]`` once each file is safely in the destination
+	(``destination`` is :py:obj:`None` for duplicates which were skipped).
+	``done`` records are written and flushed a batch at a time, after the files themselves have been flushed.
+
+	When a journal is left behind by a sort which did not finish, loading it finishes or undoes any
+	half-written files, and :meth:`~.Journal.is_completed` then lets the new sort skip the files
+	which were completed before.
+
+	:param directory: The destination directory.
+	:param move: Whether the files are being moved, in which case a half-moved file is finished
+		by deleting the original.
+	:param batch_size: The number of completed files after which the journal is flushed to disk.
+	:param filename: The name of the journal, relative to ``directory``.
+	"""
+
+	def __init__(
+			self,
+			directory: str,
+			move: bool = False,
+			batch_size: int = 100,
+			filename: str = ".photo-sort-journal",
+			):
+		self.directory = directory
+		self.move = move
+		self.batch_size = batch_size
+		self.filename = os.path.join(directory, filename)
+
+		#: The destination of each completed source file, by :func:`os.path.normcase`\'d absolute path.
+		self.completed: Dict[str, Optional[str]] = {}
+
+		#: The number of files half-written by an earlier sort, which were finished when the journal was opened.
+		self.finished = 0
+		#: The number of files half-written by an earlier sort, which were removed to be written again.
+		self.undone = 0
+		#: The paths in the destination of the files which were finished or removed.
+		self.recovered: List[str] = []
+
+		self._fp: Optional[IO[str]] = None
+		self._pending: List[Tuple[str, Optional[str]]] = []
+
+	@property
+	def resumed(self) -> bool:
+		"""
+		Whether an earlier sort into this destination was interrupted.
+		"""
+
+		return bool(self.completed or self.finished or self.undone)
+
+	def load(self) -> "Journal":
+		"""
+		Read the journal left by an earlier sort, if there is one, and recover any half-written files.
+
+		:raises JournalError: If the journal was written by another version of Photo Sort, or is damaged.
+		"""
+
+		planned: Dict[str, Tuple[str, str]] = {}
+
+		try:
+			with open(self.filename, encoding="UTF-8", errors="replace") as fp:
+				lines = fp.readlines()
+			exists = True
+		except FileNotFoundError:
+			lines = []
+			exists = False
+
+		if lines and (not lines[0].endswith('\n') or not lines[0].strip()):
+			# The header was only partly written, e.g. the disk filled up, so nothing else was recorded.
+			lines = []
+		elif lines and lines[0] != self._header():
+			raise JournalError(
+					f"The journal {self.filename!r} was written by a different version of Photo Sort, or is damaged. "
+					"Finish the interrupted sort with the version which started it, "
+					"or delete the journal to sort into this destination without resuming."
+					)
+
+		for line in lines[1:]:
+			try:
+				kind, source, destination = json.loads(line)
+			except ValueError:
+				# The last line may have been only partly written.
+				break
+
+			if kind == "planned":
+				planned[_key(source)] = (source, destination)
+			elif kind == "done":
+				self.completed[_key(source)] = destination
+
+		written = {_key(destination) for destination in self.completed.values() if destination is not None}
+
+		for key, (source, destination) in planned.items():
+			if key not in self.completed and _key(destination) not in written:
+				if self._recover(source, destination):
+					self.recovered.append(destination)
+
+		if exists:
+			# Only the completed files are needed from now on.
+			self._rewrite()
+
+		return self
+
+	def _recover(self, source: str, destination: str) -> bool:
+		if not os.path.lexists(destination):
+			# Never started, or already undone.
+			return False
+
+		if not os.path.lexists(source):
+			# Moved by renaming, or copied between filesystems and the original deleted.
+			self.completed[_key(source)] = destination
+			self.finished += 1
+			return True
+
+		try:
+			identical = os.path.getsize(source) == os.path.getsize(destination)
+			identical = identical and full_hash(source) == full_hash(destination)
+		except OSError:
+			identical = False
+
+		if identical:
+			fsync_path(destination)
+			if self.move:
+				os.unlink(source)
+			self.completed[_key(source)] = destination
+			self.finished += 1
+		else:
+			os.unlink(destination)
+			self.undone += 1
+
+		return True
+
+	def _header(self) -> str:
+		return json.dumps(["photo-sort-journal", JOURNAL_VERSION]) + '\n'
+
+	def _rewrite(self) -> None:
+		tmp_filename = f"{self.filename}.tmp"
+
+		with open(tmp_filename, 'w', encoding="UTF-8") as fp:
+			fp.write(self._header())
+			# The keys are normalised, but are still the paths of the source files.
+			for source, destination in self.completed.items():
+				fp.write(json.dumps(["done", source, destination], separators=(',', ':')) + '\n')
+			fp.flush()
+			os.fsync(fp.fileno())
+
+		os.replace(tmp_filename, self.filename)
+		fsync_path(self.directory)
+
+	def _write(self, records: Iterable[Tuple[str, str, Optional[str]]]) -> None:
+		if self._fp is None:
+			os.makedirs(self.directory, exist_ok=True)
+			self._fp = open(self.filename, 'a', encoding="UTF-8")
+			if not self._fp.tell():
+				self._fp.write(self._header())
+
+		for record in records:
+			self._fp.write(json.dumps(record, separators=(',', ':')) + '\n')
+
+		self._fp.flush()
+		os.fsync(self._fp.fileno())
+
+	def is_completed(self, source: str) -> bool:
+		"""
+		Returns whether ``source`` was sorted by an earlier run.
+
+		:param source:
+		"""
+
+		return _key(source) in self.completed
+
+	def plan(self, files: Iterable[Tuple[str, str]]) -> None:
+		"""
+		Record that the given files are about to be written, and flush the journal to disk.
+
+		:param files: ``(source, destination)`` tuples.
+		"""
+
+		self._write(("planned", source, destination) for source, destination in files)
+
+	def complete(self, source: str, destination: Optional[str]) -> None:
+		"""
+		Record that a file has been copied or moved.
+
+		The record is written with the rest of its batch, by :meth:`~.Journal.sync`.
+
+		:param source:
+		:param destination: The path of the file in the destination,
+			or :py:obj:`None` if it was a duplicate which was skipped.
+		"""
+
+		self.completed[_key(source)] = destination
+		self._pending.append((source, destination))
+
+		if len(self._pending) >= self.batch_size:
+			self.sync()
+
+	def sync(self) -> None:
+		"""
+		Flush the completed files to disk, then record them in the journal.
+		"""
+
+		if not self._pending:
+			return
+
+		pending, self._pending = self._pending, []
+
+		directories: Set[str] = set()
+		for _, destination in pending:
+			if destination is not None:
+				fsync_path(destination)
+				directories.add(os.path.dirname(destination) or '.')
+
+		for directory in directories:
+			fsync_path(directory)
+
+		self._write(("done", source, destination) for source, destination in pending)
+
+	def close(self) -> None:
+		"""
+		Record any outstanding completed files and close the journal.
+		"""
+
+		self.sync()
+
+		if self._fp is not None:
+			self._fp.close()
+			self._fp = None
+
+	def prune(self) -> None:
+		"""
+		Close the journal, and forget the completed files whose sources no longer exist, e.g. because they were moved.
+
+		The remaining files are still skipped by the next sort into this destination.
+		"""
+
+		self.close()
+		self.completed = {key: destination for key, destination in self.completed.items() if os.path.lexists(key)}
+		self._rewrite()
+
+	def remove(self) -> None:
+		"""
+		Delete the journal, once the sort has finished and there is nothing left to resume.
+		"""
+
+		self.close()
+		self._pending = []
+
+		try:
+			os.unlink(self.filename)
+		except FileNotFoundError:
+			pass
+
+	def __enter__(self) -> "Journal":
+		return self.load()
+
+	def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+		self.close()
@@ -29,24 +29,20 @@ Provides the main window class, and its background worker thread.
 # stdlib
 import json
 import os
-import shutil
-from datetime import timedelta
-from threading import Event, Thread
-from typing import Dict, List
+from typing import Any, Dict, Optional
 
 # 3rd party
-import exifread  # type: ignore
-import exiftool  # type: ignore
 import wx  # type: ignore  # nodep
-from domdf_python_tools.paths import maybe_make
 from domdf_wxpython_tools.events import SimpleEvent  # type: ignore  # TODO
 from domdf_wxpython_tools.picker import dir_picker  # type: ignore
-from domdf_wxpython_tools.timer_thread import Timer, timer_event  # type: ignore
 
 # this package
-from photo_sort.errors import ExifError
+from photo_sort.discovery import FileDiscovery
 from photo_sort.manage_cameras import ManageCameras
+from photo_sort.parsing import MetadataRules
+from photo_sort.progress import Progress, ProgressAggregator
 from photo_sort.settings_dialog import SettingsDialog
+from photo_sort.worker import Worker, mode_copy, mode_move
 
 __all__ = ["Worker", "Launcher"]
 
@@ -56,282 +52,8 @@ __all__ = ["Worker", "Launcher"]
 # begin wxGlade: extracode
 # end wxGlade
 
-progress_event = SimpleEvent("Progress")
 sorting_done = SimpleEvent("Done")
 
-worker_thread_running = False
-
-mode_copy = 0
-mode_move = 1
-
-########################################################################
-
-
-class Worker(Thread):
-	"""
-	Worker Thread for performing sorting.
-
-	Includes code from https://gist.github.com/samarthbhargav/5a515a399f7113137331
-
-
-	:param parent: Class to send event updates to
-	:param filelist: List of file paths to sort
-	:param destination: Base directory to sort files into
-	:param mode: Whether to copy or move the files, default Copy
-	:param within_dirs: Whether to sort within directories, default False
-	:param by_datetime: Whether to sort by date and time, default False (i.e. just by date)
-	:param by_camera: Whether to sort by camera name, default False
-	"""
-
-	def __init__(
-			self,
-			parent: wx.Window,
-			filelist: List,
-			destination: str,
-			mode: int = mode_copy,
-			within_dirs: bool = False,
-			by_datetime: bool = False,
-			by_camera: bool = False
-			):
-		self._stopevent = Event()
-		Thread.__init__(self, name="WorkerThread")
-		self._parent = parent
-		global worker_thread_running
-		worker_thread_running = True
-
-		print(f"Destination: {destination}")
-		if mode == mode_copy:
-			print("Mode: Copy")
-		elif mode == mode_move:
-			print("Mode: Move")
-		else:
-			print("Unknown mode. Defaulting to 'Copy'")
-			mode = mode_copy
-
-		print(f"Sort Within Directories: {within_dirs}")
-		print(f"Sort by Date and Time: {by_datetime}")
-		print(f"Sort by Camera: {by_camera}")
-
-		self.destination = destination
-		self.mode = mode
-		self.within_dirs = within_dirs
-		self.by_datetime = by_datetime
-		self.by_camera = by_camera
-		self.filelist = filelist
-
-	@staticmethod
-	def parse_date(data: Dict) -> str:
-		"""
-		Determine the date the photograph was taken from its EXIF data.
-
-		:param data: EXIF data to find the date from.
-		"""
-
-		print(data)
-		try:
-			date = str(data["EXIF DateTimeOriginal"])[:10]
-			date = date.replace(':', '_').replace(' ', '_')
-		except KeyError:
-
-			try:
-				print("attempt 2")
-				date = str(data["Image DateTime"])[:10]
-				date = date.replace(':', '_').replace(' ', '_')
-			except KeyError:
-				try:
-					print("attempt 3 - video file")
-					date = str(data["EXIF:DateTimeOriginal"])[:10]
-					date = date.replace(':', '_').replace(' ', '_')
-				except KeyError:
-					try:
-						print("attempt 4 - video file")
-						date = str(data["QuickTime:MediaCreateDate"])[:10]
-						date = date.replace(':', '_').replace(' ', '_')
-					except KeyError:
-						return ExifError().parse_error()
-
-		return date
-
-	def parse_camera(self, data: Dict) -> str:
-		"""
-		Determine the camera the photograph was taken with its EXIF data.
-
-		:param data: EXIF data to find the camera from.
-		"""
-
-		camera = ''
-
-		if self.by_camera:
-			try:
-				raw_camera = str(data["Image Model"])
-				if raw_camera in self._parent.cameras:
-					camera = self._parent.cameras[raw_camera]
-				else:
-					camera = raw_camera
-			except KeyError:
-				# Video files, Canon
-				try:
-					raw_camera = str(data["EXIF:Model"])
-					if raw_camera in self._parent.cameras:
-						camera = self._parent.cameras[raw_camera]
-					else:
-						camera = raw_camera
-				except KeyError:
-					# Video files, Panasonic
-					try:
-						raw_camera = str(data["MakerNotes:Model"])
-						if raw_camera in self._parent.cameras:
-							camera = self._parent.cameras[raw_camera]
-						else:
-							camera = raw_camera
-					except KeyError:
-						# Video files, GoPro 7
-						try:
-							raw_camera = str(data["QuickTime:Model"])
-							if raw_camera in self._parent.cameras:
-								camera = self._parent.cameras[raw_camera]
-							else:
-								camera = raw_camera
-						except KeyError:
-							try:
-								raw_camera = str(data["QuickTime:LensSerialNumber"])
-								if raw_camera in self._parent.cameras:
-									camera = self._parent.cameras[raw_camera]
-								else:
-									camera = raw_camera
-							except KeyError:
-								pass
-
-		return camera
-
-	def run(self) -> None:
-		"""
-		Run the worker thread.
-		"""
-
-		print("Working...")
-
-		for filepath in self.filelist:
-
-			if self._stopevent.is_set():
-				return
-
-			error = False
-
-			path_length = 80
-
-			if len(filepath) > path_length:
-				filename_string = "..." + filepath[-path_length:]
-			else:
-				filename_string = filepath + ' ' * (path_length - len(filepath))
-
-			print(f'\r{filename_string}', end='')
-
-			try:
-				file = open(filepath, "rb")
-			except BaseException:
-				ExifError().open_error().show(filename_string)
-				error = True
-				continue
-
-			# get the tags
-			data = exifread.process_file(file, details=False, debug=False)
-
-			with exiftool.ExifTool() as et:
-				try:
-					metadata = et.get_metadata(filepath)
-				except json.decoder.JSONDecodeError:
-					metadata = None
-
-				# using exiftool as a backup for video files
-
-			if not data:
-				data = metadata
-				if not metadata:
-					error = True
-					ExifError().no_data().show(filename_string)
-			"""try:
-				date = str(data['Image DateTime'])[:10]
-				date = date.replace(':', '_').replace(' ', '_')
-			except KeyError:
-
-				try:
-					print("attempt 2")
-					date = str(data["EXIF DateTimeOriginal"])[:10]
-					date = date.replace(':', '_').replace(' ', '_')
-				except KeyError:
-					print(f"\r'{filename_string}': Unable to parse EXIF data.\n")
-					error = True"""
-
-			date = self.parse_date(data)
-			if isinstance(date, ExifError):
-				error = True
-				date.show(filename_string)
-
-			if not error:
-
-				camera = self.parse_camera(data)
-
-				destination_path = os.path.join(self.destination, date, camera)
-				maybe_make(destination_path, parents=True)
-
-				# print(f"{date}  {camera} -> {destination_path}               ")
-
-				destination_filename = os.path.split(filepath)[-1]
-
-				# If file already exists, add a (number) to the end of the filename
-				if os.path.isfile(os.path.join(destination_path, destination_filename)):
-					# TODO: Use filecmp to see if files are identical
-
-					num = 1
-					while True:
-						# Determine the fist available duplicate number
-						base_filename, extension = os.path.splitext(destination_filename)
-						if not os.path.isfile(f"{base_filename} ({num}){extension}"):
-							destination_filename = f"{base_filename} ({num}){extension}"
-							break
-						num += 1
-
-				print(f"{date}  {camera} -> {os.path.join(destination_path, destination_filename)}               ")
-
-				if self.mode == mode_copy:
-					try:
-						shutil.copy2(filepath, os.path.join(destination_path, destination_filename))
-					except BaseException:
-						print(f"\r'{filename_string}': Could not copy file.\n")
-						ExifError().copy_error().show(filename_string)
-
-				elif self.mode == mode_move:
-					try:
-						shutil.move(filepath, os.path.join(destination_path, destination_filename))
-					except BaseException:
-						ExifError().move_error().show(filename_string)
-
-			file.close()
-
-			if not self._stopevent.is_set():
-				# evt = ProgressEvent(myEVT_PROGRESS, -1)
-				# wx.PostEvent(self._parent, evt)
-				progress_event.trigger()
-
-		global worker_thread_running
-		worker_thread_running = False
-
-		# evt = CompletionEvent(myEVT_DONE, -1)
-		# wx.PostEvent(self._parent, evt)
-		sorting_done.trigger()
-
-	def join(self, timeout=None):
-		"""
-		Stop the thread and wait for it to end.
-
-		:param timeout:
-		"""
-
-		self._stopevent.set()
-		Thread.join(self, timeout)
-
-
 ########################################################################
 
 
@@ -377,17 +99,11 @@ class Launcher(wx.Frame):
 		# end wxGlade
 
 		# Bind Events
-		progress_event.set_receiver(self)
-		progress_event.Bind(self.increase_file_count)
-
 		sorting_done.set_receiver(self)
 		sorting_done.Bind(self.on_sort_done)
 
 		self.Bind(wx.EVT_CLOSE, self.on_close)
 
-		timer_event.set_receiver(self)
-		timer_event.Bind(self.update_time_elapsed)
-
 	def __set_properties(self):
 		# begin wxGlade: Launcher.__set_properties
 		self.SetTitle("Sort Photographs")
@@ -397,10 +113,13 @@ class Launcher(wx.Frame):
 		# end wxGlade
 
 		# Load camera and directories settings
+		self.cameras: Dict[str, str] = {}
+		self.rules: Dict[str, Any] = {}
 
 		try:
 			with open("settings.json") as f:
-				self.cameras, directories = json.load(f)
+				self.cameras, directories, *rules = json.load(f)
+				self.rules = rules[0] if rules else {}
 				self.source_dir_picker.SetInitialValue(directories["Source"])
 				self.destination_dir_picker.SetInitialValue(directories["Destination"])
 		except FileNotFoundError:
@@ -472,7 +191,7 @@ class Launcher(wx.Frame):
 		self.current_file_count = 0
 
 		self.time_elapsed_text = time_elapsed_text
-		self.elapsed_time = 0
+		self.progress_aggregator: Optional[ProgressAggregator] = None
 
 	def set_max_file_count(self, value: int):
 		"""
@@ -501,20 +220,33 @@ class Launcher(wx.Frame):
 		self.file_count_text.SetLabel(f"Processing {self.current_file_count} of {self.max_file_count}")
 		self.progress_gauge.SetValue(self.current_file_count)
 
-	def increase_file_count(self, *_):
+	def show_progress(self, progress: Progress):
 		"""
-		Increase the count of files which have been sorted by ``1``.
+		Show the progress of the sort, with its throughput and the estimated time remaining.
+
+		:param progress:
 		"""
 
-		self.current_file_count += 1
+		self.current_file_count = progress.files
+		if progress.total is not None and progress.total != self.max_file_count:
+			self.max_file_count = progress.total
+			self.progress_gauge.SetRange(max(progress.total, 1))
+
 		self.update_file_count()
+		self.file_count_text.SetLabel(
+				f"Processing {self.current_file_count} of {self.max_file_count} ({progress.format_rate()})"
+				)
+		self.time_elapsed_text.SetLabel(progress.format_time())
+		self.Layout()
 
 	def on_sort_done(self, *_):
 		"""
 		Tidy up after all files have been sorted.
 		"""
 
-		self.timer.join()
+		if self.progress_aggregator is not None:
+			self.show_progress(self.progress_aggregator.snapshot())
+
 		self.sort_btn.Enable()
 		self.cancel_btn.SetLabel("Close")
 
@@ -522,15 +254,6 @@ class Launcher(wx.Frame):
 		self.file_count_text.SetLabel(label)
 		wx.MessageDialog(self, "Sort Complete", "Sort Complete", style=wx.OK | wx.ICON_INFORMATION).ShowModal()
 
-	def update_time_elapsed(self, *_):
-		"""
-		Increase the elapsed time by one and update the displayed value.
-		"""
-
-		self.elapsed_time += 1
-		self.time_elapsed_text.SetLabel(f"{timedelta(seconds=self.elapsed_time)}")
-		self.Layout()
-
 	def do_manage_cameras(self, event):  # wxGlade: Launcher.<event_handler>
 		"""
 		Handler for ``Manage Cameras`` button.
@@ -538,7 +261,14 @@ class Launcher(wx.Frame):
 		Opens ``Manage Cameras`` dialog.
 		"""
 
-		with ManageCameras(self, data=self.cameras) as dlg:
+		try:
+			rules = MetadataRules.from_settings(self.rules)
+		except ValueError as e:
+			wx.MessageDialog(self, str(e), "Error", style=wx.OK | wx.ICON_ERROR).ShowModal()
+			event.Skip()
+			return
+
+		with ManageCameras(self, data=self.cameras, rules=rules) as dlg:
 			res = dlg.ShowModal()
 			if res == wx.ID_APPLY:
 				self.cameras = dlg.get_data()
@@ -546,113 +276,42 @@ class Launcher(wx.Frame):
 
 		event.Skip()
 
-	def within_dirs_ignore(self, event):  # noqa: D102
-		event.Skip()
-
-	def within_dirs_folder_done(self, event):
-		"""
-		Tidy up after all files have been sorted with ``within_dirs=True``.
-		"""
-
-		event.Skip()
-
-		self.increase_file_count()
-
-		if self.current_file_count == self.max_file_count:
-			self.timer.join()
-			self.sort_btn.Enable()
-			self.cancel_btn.SetLabel("Close")
-
-			label = f"Complete: {self.current_file_count} file{'s' if self.current_file_count > 1 else ''} sorted"
-			self.file_count_text.SetLabel(label)
-			wx.MessageDialog(self, "Sort Complete", "Sort Complete", style=wx.OK | wx.ICON_INFORMATION).ShowModal()
-
-			# Reset event bindings
-			progress_event.Unbind()
-			sorting_done.Unbind()
-
-			progress_event.Bind(self.increase_file_count)
-			sorting_done.Bind(self.increase_file_count)
-
 	def sort_within_dirs(self):
 		"""
 		Sort photos within directories.
-		"""
-
-		# Rebind events
-		progress_event.Unbind()
-		sorting_done.Unbind()
-
-		progress_event.Bind(self.within_dirs_ignore)
-		sorting_done.Bind(self.within_dirs_folder_done)
-
-		main_source = self.source_dir_picker.get_value()
-		print(f"Main Source: {main_source}")
-
-		subdir_list = [x[0] for x in os.walk(main_source)]
-		self.set_max_file_count(len(subdir_list))
-		# TODO: Handle no folders
-		print(subdir_list)
-
-		if len(subdir_list) >= 1:
-			for subdir in subdir_list:
-				print(f"Subdir: {subdir}")
 
-				print(os.path.split(subdir)[-1])
-
-				onlyfiles = []
-
-				print(f"Source: {subdir}")
-
-				for root, dirs, files in os.walk(subdir):
-					for filename in os.listdir(root):
-						if os.path.isfile(os.path.join(root, filename)):
-							onlyfiles.append(os.path.join(root, filename))
-
-				print(onlyfiles)
-
-				if self.copy_radio_btn.GetValue() and not self.move_radio_btn.GetValue():
-					mode = mode_copy
-				elif self.move_radio_btn.GetValue() and not self.move_radio_btn.GetValue():
-					mode = mode_move
-				else:
-					mode = mode_copy
-
-				self.elapsed_time = 0
+		Every file below the source directory is sorted into the directory which contains it.
+		"""
 
-				self.worker = Worker(
-						self,
-						filelist=onlyfiles,
-						destination=subdir,
-						mode=mode,  # TODO: Disable copy checkbox if within dirs selected
-						within_dirs=True,
-						by_datetime=self.datetime_checkbox.GetValue(),
-						by_camera=self.camera_checkbox.GetValue(),
-						)
-				self.timer = Timer(self)
-				self.timer.start()
-				self.worker.start()
+		self._start_sort(within_dirs=True)
 
 	def sort(self) -> None:  # wxGlade: Launcher.<event_handler>
 		"""
 		Run sort.
 		"""
 
-		onlyfiles = []
+		self._start_sort(within_dirs=False)
 
+	def _start_sort(self, within_dirs: bool) -> None:
 		source = self.source_dir_picker.get_value()
 		print(f"Source: {source}")
 
-		for root, dirs, files in os.walk(source):
-			for filename in os.listdir(root):
-				if os.path.isfile(os.path.join(root, filename)):
-					onlyfiles.append(os.path.join(root, filename))
+		if within_dirs:
+			destination = source
+		else:
+			destination = self.destination_dir_picker.get_value()
 
-		print(onlyfiles)
 		self.reset_file_count()
-		self.set_max_file_count(len(onlyfiles))
+		self.set_max_file_count(0)
+		self.time_elapsed_text.SetLabel("0:00:00")
 		# TODO: Handle no files
 
+		# Updates from the worker are combined, and shown at most ten times a second.
+		self.progress_aggregator = ProgressAggregator(lambda progress: wx.CallAfter(self.show_progress, progress))
+
+		# Files are sorted as they are found; the total is updated as the search continues.
+		self.discovery = FileDiscovery(source, on_found=self.progress_aggregator.set_total)
+
 		if self.copy_radio_btn.GetValue() and not self.move_radio_btn.GetValue():
 			mode = mode_copy
 		elif self.move_radio_btn.GetValue() and not self.copy_radio_btn.GetValue():
@@ -660,21 +319,37 @@ class Launcher(wx.Frame):
 		else:
 			mode = mode_copy
 
-		self.elapsed_time = 0
-
-		self.worker = Worker(
-				self,
-				filelist=onlyfiles,
-				destination=self.destination_dir_picker.get_value(),
-				mode=mode,
-				within_dirs=self.within_dirs_checkbox.GetValue(),
-				by_datetime=self.datetime_checkbox.GetValue(),
-				by_camera=self.camera_checkbox.GetValue(),
-				)
-		self.timer = Timer(self)
-		self.timer.start()
+		try:
+			self.worker = Worker(
+					filelist=self.discovery,
+					destination=destination,
+					mode=mode,
+					within_dirs=within_dirs,
+					by_datetime=self.datetime_checkbox.GetValue(),
+					by_camera=self.camera_checkbox.GetValue(),
+					cameras=self.cameras,
+					rules=self.rules,
+					template=self.rules.get("template"),
+					on_progress=self.progress_aggregator.advance,
+					on_done=sorting_done.trigger,
+					)
+		except ValueError as e:
+			# e.g. a mistake in the template or camera names in settings.json
+			wx.MessageDialog(self, str(e), "Error", style=wx.OK | wx.ICON_ERROR).ShowModal()
+			return
+
+		self.discovery.start()
 		self.worker.start()
 
+	@property
+	def sorting(self) -> bool:
+		"""
+		Whether a sort is in progress.
+		"""
+
+		worker = getattr(self, "worker", None)
+		return worker is not None and worker.running and worker.is_alive()
+
 	def sort_handler(self, event) -> None:  # wxGlade: Launcher.<event_handler>
 		"""
 		Handler for the "sort" button to determine which function
@@ -693,16 +368,16 @@ class Launcher(wx.Frame):
 
 	def stop_threads(self) -> None:
 		"""
-		Stop worker and timer threads.
+		Stop the discovery and worker threads.
 		"""
 
 		try:
-			self.worker.join()
+			self.discovery.stop()
 		except AttributeError:
 			pass
 
 		try:
-			self.timer.join()
+			self.worker.join()
 		except AttributeError:
 			pass
 
@@ -711,7 +386,7 @@ class Launcher(wx.Frame):
 		Handler for closing the window.
 		"""
 
-		if worker_thread_running:
+		if self.sorting:
 			res = wx.MessageDialog(
 					self,
 					"Are you sure you want to cancel?",
@@ -724,16 +399,19 @@ class Launcher(wx.Frame):
 					return
 			self.stop_threads()
 
-		# Save camera and directory settings
+		# Save camera and directory settings, and any rules which were added to the file by hand
+		settings = [
+				self.cameras,
+				{
+						"Source": self.source_dir_picker.GetValue(),
+						"Destination": self.destination_dir_picker.GetValue(),
+						},
+				]
+		if self.rules:
+			settings.append(self.rules)
+
 		with open("settings.json", 'w') as f:
-			json.dump([
-					self.cameras,
-					{
-							"Source": self.source_dir_picker.GetValue(),
-							"Destination": self.destination_dir_picker.GetValue(),
-							}
-					],
-						f)
+			json.dump(settings, f)
 
 		self.Destroy()  # you may also do:  event.Skip()
 		# since the default event handler does call Destroy(), too
@@ -743,13 +421,12 @@ class Launcher(wx.Frame):
 		Handler for the cancel/close button, depending on context.
 		"""
 
-		if worker_thread_running:
+		if self.sorting:
 			res = wx.MessageDialog(
 					self, "Are you sure you want to cancel?", "Cancel?", style=wx.YES_NO | wx.ICON_QUESTION
 					).ShowModal()
 			if res == wx.ID_YES:
 				self.stop_threads()
-				self.timer.join()
 				self.sort_btn.Enable()
 				self.cancel_btn.SetLabel("Close")
 
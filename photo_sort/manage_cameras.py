@@ -28,7 +28,7 @@ Provides a class to manage the mapping of camera IDs to human-readable names.
 
 # stdlib
 import json
-from typing import Dict
+from typing import Dict, Optional
 
 # 3rd party
 import exifread  # type: ignore
@@ -36,6 +36,9 @@ import exiftool  # type: ignore
 import wx  # type: ignore  # nodep
 import wx.grid  # type: ignore  # nodep
 
+# this package
+from photo_sort.parsing import DEFAULT_RULES, MetadataRules
+
 __all__ = ["manage_cameras"]
 
 # begin wxGlade: dependencies
@@ -57,6 +60,7 @@ class ManageCameras(wx.Dialog):
 	:param style:
 	:param name:
 	:param data:
+	:param rules: The rules for finding the camera in an image's metadata.
 	"""
 
 	# TODO: docstring for __init__'s arguments
@@ -70,7 +74,8 @@ class ManageCameras(wx.Dialog):
 			size=wx.DefaultSize,
 			style=wx.DEFAULT_DIALOG_STYLE,
 			name=wx.DialogNameStr,
-			data=None
+			data=None,
+			rules: Optional[MetadataRules] = None,
 			):
 
 		if not data:
@@ -104,6 +109,7 @@ class ManageCameras(wx.Dialog):
 		self.Bind(wx.EVT_BUTTON, self.do_remove, self.remove_btn)
 		self.Bind(wx.EVT_BUTTON, self.do_apply, self.apply_btn)
 		# end wxGlade
+		self.rules = rules or DEFAULT_RULES
 		self.grid_1.Bind(wx.grid.EVT_GRID_SELECT_CELL, self.on_select_cell)
 		self.grid_1.DeleteRows(1, 10)
 
@@ -209,18 +215,16 @@ class ManageCameras(wx.Dialog):
 
 			pathname = fileDialog.GetPath()
 
-			print(pathname)
-
 			try:
 				with open(pathname, "rb") as file:
-					data = exifread.process_file(file)
-					exif_camera = str(data["Image Model"])
+					data = exifread.process_file(file, details=False)
+			except OSError:
+				data = {}
 
-			except (OSError, KeyError):
-				# wx.MessageDialog(self, f"Cannot open file '{pathname}'.", "Error",
-				# 				 style=wx.OK | wx.ICON_ERROR).ShowModal()
-				# Video File
+			exif_camera = self.rules.raw_camera(data)
 
+			if exif_camera is None:
+				# Video File
 				with exiftool.ExifTool() as et:
 					try:
 						data = et.get_metadata(pathname)
@@ -228,44 +232,33 @@ class ManageCameras(wx.Dialog):
 						wx.MessageDialog(
 								self, f"Cannot open file '{pathname}'.", "Error", style=wx.OK | wx.ICON_ERROR
 								).ShowModal()
-
-					# Video files, Canon
-					try:
-						exif_camera = str(data["EXIF:Model"])
-					except KeyError:
-						# Video files, Panasonic
-						try:
-							exif_camera = str(data["MakerNotes:Model"])
-						except KeyError:
-							# Video files, GoPro 7
-							try:
-								exif_camera = str(data["QuickTime:Model"])
-							except KeyError:
-								try:
-									exif_camera = str(data["QuickTime:LensSerialNumber"])
-								except KeyError:
-									wx.MessageDialog(
-											self,
-											f"Cannot parse EXIF data from file '{pathname}'.",
-											"Error",
-											style=wx.OK | wx.ICON_ERROR
-											).ShowModal()
-									event.Skip()
-									return
-
-					print(exif_camera)
-
-					for row in range(self.grid_1.GetNumberRows()):
-						if exif_camera == self.grid_1.GetCellValue(row, 0):
-							wx.MessageDialog(
-									self,
-									f"The camera '{exif_camera}' is already in the table.",
-									"Error",
-									style=wx.OK | wx.ICON_ERROR
-									).ShowModal()
-							return
-				self.grid_1.SetCellValue(self.grid_1.GetNumberRows() - 1, 0, exif_camera)
-				self.grid_1.AppendRows()
+						event.Skip()
+						return
+
+				exif_camera = self.rules.raw_camera(data)
+
+			if exif_camera is None:
+				wx.MessageDialog(
+						self,
+						f"Cannot parse EXIF data from file '{pathname}'.",
+						"Error",
+						style=wx.OK | wx.ICON_ERROR
+						).ShowModal()
+				event.Skip()
+				return
+
+			for row in range(self.grid_1.GetNumberRows()):
+				if exif_camera == self.grid_1.GetCellValue(row, 0):
+					wx.MessageDialog(
+							self,
+							f"The camera '{exif_camera}' is already in the table.",
+							"Error",
+							style=wx.OK | wx.ICON_ERROR
+							).ShowModal()
+					return
+
+			self.grid_1.SetCellValue(self.grid_1.GetNumberRows() - 1, 0, exif_camera)
+			self.grid_1.AppendRows()
 
 		event.Skip()
 
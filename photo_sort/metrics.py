@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+#
+#  metrics.py
+"""
+Timing and throughput metrics for each stage of a sort.
+"""
+#
+#  Copyright © 2014-2021 Dominic Davis-Foster <dominic@davis-foster.co.uk>
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#  EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+#  MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+#  IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+#  DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+#  OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
+#  OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+# stdlib
+import bisect
+import json
+import os
+import time
+from threading import Lock
+from typing import Dict, Iterable, Iterator, List, TypeVar
+
+__all__ = ["BUCKETS", "Metrics", "NullMetrics", "NULL_METRICS", "StageMetrics"]
+
+_T = TypeVar("_T")
+
+#: The upper bounds of the latency histogram buckets, in seconds.
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class StageMetrics:
+	"""
+	The metrics for a single stage of a sort.
+	"""
+
+	def __init__(self):
+		#: The number of items (usually files) processed by the stage.
+		self.count = 0
+		#: The total time spent in the stage, in seconds.
+		self.seconds = 0.0
+		#: The number of bytes processed by the stage.
+		self.bytes = 0
+		#: The number of timings in each bucket of :py:data:`BUCKETS`, plus one for longer timings.
+		self.histogram: List[int] = [0] * (len(BUCKETS) + 1)
+
+	def to_dict(self) -> Dict:
+		"""
+		Returns the metrics as a dictionary suitable for JSON.
+		"""
+
+		bounds = [str(bound) for bound in BUCKETS] + ["+Inf"]
+
+		return {
+				"count": self.count,
+				"seconds": self.seconds,
+				"bytes": self.bytes,
+				"histogram": dict(zip(bounds, self.histogram)),
+				}
+
+
+class _Timer:
+
+	__slots__ = ("_metrics", "_stage", "_count", "_start")
+
+	def __init__(self, metrics: "Metrics", stage: str, count: int):
+		self._metrics = metrics
+		self._stage = stage
+		self._count = count
+
+	def __enter__(self) -> None:
+		self._start = time.perf_counter()
+
+	def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+		self._metrics.record(self._stage, time.perf_counter() - self._start, self._count)
+
+
+class Metrics:
+	"""
+	Records the number of items, the time taken and a latency histogram for each stage of a sort.
+
+	May be used from several threads at once.
+	"""
+
+	#: Whether metrics are being recorded.
+	enabled: bool = True
+
+	def __init__(self):
+		self.stages: Dict[str, StageMetrics] = {}
+		self._lock = Lock()
+		self._start = time.time()
+
+	def time(self, stage: str, count: int = 1) -> _Timer:
+		"""
+		Returns a context manager which records the time taken by the code within it.
+
+		:param stage: The name of the stage, e.g. ``"copy"``.
+		:param count: The number of items processed.
+		"""
+
+		return _Timer(self, stage, count)
+
+	def iterate(self, stage: str, iterable: Iterable[_T]) -> Iterator[_T]:
+		"""
+		Iterate over ``iterable``, recording the time spent waiting for each item.
+
+		:param stage:
+		:param iterable:
+		"""
+
+		iterator = iter(iterable)
+
+		while True:
+			start = time.perf_counter()
+			try:
+				item = next(iterator)
+			except StopIteration:
+				return
+			self.record(stage, time.perf_counter() - start)
+			yield item
+
+	def record(self, stage: str, seconds: float, count: int = 1) -> None:
+		"""
+		Record a timing.
+
+		:param stage:
+		:param seconds:
+		:param count: The number of items processed.
+		"""
+
+		with self._lock:
+			metrics = self.stages.get(stage)
+			if metrics is None:
+				metrics = self.stages[stage] = StageMetrics()
+
+			metrics.count += count
+			metrics.seconds += seconds
+			metrics.histogram[bisect.bisect_left(BUCKETS, seconds)] += 1
+
+	def add_bytes(self, stage: str, size: int) -> None:
+		"""
+		Record bytes processed by a stage, e.g. copied.
+
+		:param stage:
+		:param size:
+		"""
+
+		with self._lock:
+			metrics = self.stages.get(stage)
+			if metrics is None:
+				metrics = self.stages[stage] = StageMetrics()
+
+			metrics.bytes += size
+
+	def to_dict(self) -> Dict:
+		"""
+		Returns the metrics as a dictionary suitable for JSON.
+		"""
+
+		with self._lock:
+			return {
+					"started": self._start,
+					"wall_seconds": time.time() - self._start,
+					"stages": {name: stage.to_dict() for name, stage in sorted(self.stages.items())},
+					}
+
+	def write_json(self, filename: str) -> None:
+		"""
+		Write the metrics to a JSON file.
+
+		:param filename:
+		"""
+
+		_write_atomic(filename, json.dumps(self.to_dict(), indent=2))
+
+	def write_prometheus(self, filename: str) -> None:
+		"""
+		Write the metrics in the Prometheus text format, for the node exporter's textfile collector.
+
+		:param filename: Should end in ``.prom``.
+		"""
+
+		lines = [
+				"# HELP photo_sort_stage_seconds Time spent in each stage of a sort.",
+				"# TYPE photo_sort_stage_seconds histogram",
+				]
+
+		with self._lock:
+			stages = sorted(self.stages.items())
+
+			for name, stage in stages:
+				cumulative = 0
+				for bound, number in zip([*map(str, BUCKETS), "+Inf"], stage.histogram):
+					cumulative += number
+					lines.append(f'photo_sort_stage_seconds_bucket{{stage="{name}",le="{bound}"}} {cumulative}')
+				lines.append(f'photo_sort_stage_seconds_sum{{stage="{name}"}} {stage.seconds}')
+				lines.append(f'photo_sort_stage_seconds_count{{stage="{name}"}} {cumulative}')
+
+			lines.append("# HELP photo_sort_stage_items_total Items processed by each stage of a sort.")
+			lines.append("# TYPE photo_sort_stage_items_total counter")
+			for name, stage in stages:
+				lines.append(f'photo_sort_stage_items_total{{stage="{name}"}} {stage.count}')
+
+			lines.append("# HELP photo_sort_stage_bytes_total Bytes processed by each stage of a sort.")
+			lines.append("# TYPE photo_sort_stage_bytes_total counter")
+			for name, stage in stages:
+				lines.append(f'photo_sort_stage_bytes_total{{stage="{name}"}} {stage.bytes}')
+
+			lines.append("# HELP photo_sort_last_run_timestamp_seconds When the last sort started.")
+			lines.append("# TYPE photo_sort_last_run_timestamp_seconds gauge")
+			lines.append(f"photo_sort_last_run_timestamp_seconds {self._start}")
+
+		_write_atomic(filename, '\n'.join(lines) + '\n')
+
+
+class _NullTimer:
+
+	__slots__ = ()
+
+	def __enter__(self) -> None:
+		pass
+
+	def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+		pass
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class NullMetrics(Metrics):
+	"""
+	A :class:`~.Metrics` which records nothing, used when metrics are disabled.
+	"""
+
+	enabled = False
+
+	def time(self, stage: str, count: int = 1) -> _Timer:  # noqa: D102
+		return _NULL_TIMER  # type: ignore[return-value]
+
+	def iterate(self, stage: str, iterable: Iterable[_T]) -> Iterator[_T]:  # noqa: D102
+		return iter(iterable)
+
+	def record(self, stage: str, seconds: float, count: int = 1) -> None:  # noqa: D102
+		pass
+
+	def add_bytes(self, stage: str, size: int) -> None:  # noqa: D102
+		pass
+
+
+#: A shared :class:`~.NullMetrics`.
+NULL_METRICS = NullMetrics()
+
+
+def _write_atomic(filename: str, text: str) -> None:
+	# Readers such as the textfile collector must never see a half-written file.
+	temporary = f"{filename}.tmp"
+
+	with open(temporary, 'w', encoding="UTF-8") as fp:
+		fp.write(text)
+
+	os.replace(temporary, filename)
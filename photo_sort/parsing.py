@@ -0,0 +1,393 @@
+#!/usr/bin/env python3
+#
+#  parsing.py
+"""
+Rules for determining the date and camera from metadata.
+"""
+#
+#  Copyright © 2014-2021 Dominic Davis-Foster <dominic@davis-foster.co.uk>
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#  EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+#  MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+#  IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+#  DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+#  OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
+#  OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+# stdlib
+import hashlib
+import json
+import re
+from typing import Dict, List, Mapping, NamedTuple, Optional, Pattern, Sequence, Tuple, Union
+
+# this package
+from photo_sort.errors import ExifError
+
+__all__ = [
+		"CAMERA_TAGS",
+		"DATE_TAGS",
+		"DEFAULT_RULES",
+		"CameraNames",
+		"MetadataRules",
+		"Resolved",
+		"Timestamp",
+		"parse_date",
+		"parse_raw_camera",
+		"parse_timestamp",
+		]
+
+#: The tags the date is read from, in order of preference.
+#: Names with a colon (``<group>:<tag>``) are those given by ``exiftool``; the others are those given by exifread.
+DATE_TAGS = (
+		"EXIF DateTimeOriginal",
+		"Image DateTime",
+		"EXIF:DateTimeOriginal",  # Video files
+		"QuickTime:MediaCreateDate",  # Video files
+		)
+
+#: The tags the camera is read from, in order of preference.
+CAMERA_TAGS = (
+		"Image Model",
+		"EXIF:Model",  # Video files, Canon
+		"MakerNotes:Model",  # Video files, Panasonic
+		"QuickTime:Model",  # Video files, GoPro 7
+		"QuickTime:LensSerialNumber",
+		)
+
+# e.g. ``2019:07:14 12:34:56``, ``2019-07-14T12:34:56+01:00`` or ``2019:07:14``.
+_TIMESTAMP = re.compile(r"(\d{4})[:\-/](\d\d)[:\-/](\d\d)(?:[ T](\d\d):(\d\d)(?::(\d\d))?)?")
+
+
+class Timestamp(NamedTuple):
+	"""
+	The date and time a photograph was taken.
+	"""
+
+	year: int
+	month: int
+	day: int
+	hour: int = 0
+	minute: int = 0
+	second: int = 0
+
+	@property
+	def date(self) -> str:
+		"""
+		The date, in the form ``YYYY_MM_DD``.
+		"""
+
+		return f"{self.year:04}_{self.month:02}_{self.day:02}"
+
+	@property
+	def time(self) -> str:
+		"""
+		The time, in the form ``HH_MM_SS``.
+		"""
+
+		return f"{self.hour:02}_{self.minute:02}_{self.second:02}"
+
+
+def parse_timestamp(value: str) -> Optional[Timestamp]:
+	"""
+	Parse a date and time from metadata, e.g. ``2019:07:14 12:34:56``.
+
+	Any time zone is ignored, as are fractions of a second. The time may be omitted.
+
+	:param value:
+
+	:returns: The timestamp, or :py:obj:`None` if ``value`` is not a date,
+		e.g. the ``0000:00:00 00:00:00`` some cameras write when their clock has not been set.
+	"""
+
+	match = _TIMESTAMP.match(value.strip())
+	if match is None:
+		return None
+
+	timestamp = Timestamp(*(int(group or 0) for group in match.groups()))
+	if not timestamp.year or not 1 <= timestamp.month <= 12 or not 1 <= timestamp.day <= 31:
+		return None
+
+	return timestamp
+
+
+class CameraNames:
+	r"""
+	Maps camera models, as the camera reports them, to the names to sort them under.
+
+	Each key in ``cameras`` is one of:
+
+	* a model name, which must match exactly;
+	* a prefix ending in ``*``, e.g. ``Canon EOS *``, which matches any model starting with it;
+	* a regular expression between slashes, e.g. ``/HERO\d+ Black/``, which must match the whole model.
+
+	Exact matches are preferred, then the longest matching prefix, then the first matching regular expression.
+	Models without a match keep their own name.
+	The name for each model is worked out once, and remembered.
+
+	:param cameras: A mapping of models or patterns to names, as saved in ``settings.json``.
+
+	:raises ValueError: If one of the regular expressions is invalid.
+	"""
+
+	def __init__(self, cameras: Optional[Mapping[str, str]] = None):
+		self._exact: Dict[str, str] = {}
+		self._prefixes: List[Tuple[str, str]] = []
+		self._patterns: List[Tuple[Pattern, str]] = []
+
+		for key, name in (cameras or {}).items():
+			if len(key) > 2 and key.startswith('/') and key.endswith('/'):
+				try:
+					pattern = re.compile(key[1:-1])
+				except re.error as e:
+					raise ValueError(f"Invalid regular expression for camera {key!r}: {e}") from None
+				self._patterns.append((pattern, name))
+			elif key.endswith('*'):
+				self._prefixes.append((key[:-1], name))
+			else:
+				self._exact[key] = name
+
+		self._prefixes.sort(key=lambda prefix: len(prefix[0]), reverse=True)
+
+		self._cache: Dict[str, str] = dict(self._exact)
+
+	def __getitem__(self, model: str) -> str:
+		try:
+			return self._cache[model]
+		except KeyError:
+			name = self._cache[model] = self._lookup(model)
+			return name
+
+	def _lookup(self, model: str) -> str:
+		for prefix, name in self._prefixes:
+			if model.startswith(prefix):
+				return name
+
+		for pattern, name in self._patterns:
+			if pattern.fullmatch(model):
+				return name
+
+		return model
+
+
+class MetadataRules:
+	"""
+	Determines the date and camera from metadata, by trying a list of tags for each in turn.
+
+	The rules can be changed in ``settings.json`` (see :meth:`~.MetadataRules.from_settings`),
+	so dates and cameras can be found in new formats without changing the code.
+
+	:param date_tags: The tags the date is read from, in order of preference.
+	:param camera_tags: The tags the camera is read from, in order of preference.
+	:param cameras: A mapping of camera models (or patterns) to the names to sort them under. See :class:`~.CameraNames`.
+	"""
+
+	def __init__(
+			self,
+			date_tags: Sequence[str] = DATE_TAGS,
+			camera_tags: Sequence[str] = CAMERA_TAGS,
+			cameras: Optional[Mapping[str, str]] = None,
+			):
+		self.date_tags = tuple(date_tags)
+		self.camera_tags = tuple(camera_tags)
+		self.camera_names = CameraNames(cameras)
+
+	@classmethod
+	def from_settings(
+			cls,
+			settings: Optional[Mapping[str, Sequence[str]]] = None,
+			cameras: Optional[Mapping[str, str]] = None,
+			) -> "MetadataRules":
+		"""
+		Construct rules from the ``rules`` section of ``settings.json``.
+
+		:param settings: A mapping which may contain ``"date"`` and ``"camera"`` lists of tags.
+			Either may be omitted to use the defaults.
+		:param cameras: A mapping of camera models (or patterns) to the names to sort them under.
+
+		:raises ValueError: If the settings are invalid.
+		"""
+
+		settings = settings or {}
+		tags = {}
+
+		for key, default in (("date", DATE_TAGS), ("camera", CAMERA_TAGS)):
+			value = settings.get(key, default)
+			if not isinstance(value, (list, tuple)) or not all(isinstance(tag, str) for tag in value):
+				raise ValueError(f"The {key!r} rule must be a list of tags, not {value!r}")
+			tags[key] = value
+
+		return cls(tags["date"], tags["camera"], cameras)
+
+	@property
+	def tags(self) -> Tuple[str, ...]:
+		"""
+		Every tag which is used by the rules.
+		"""
+
+		return tuple(dict.fromkeys(self.date_tags + self.camera_tags))
+
+	@property
+	def exiftool_tags(self) -> Tuple[str, ...]:
+		"""
+		The tags which are used by the rules, in the ``<group>:<tag>`` form which ``exiftool`` is asked for.
+		"""
+
+		return tuple(tag for tag in self.tags if ':' in tag)
+
+	@property
+	def fingerprint(self) -> str:
+		"""
+		A short string which changes if the tags change, or ``''`` for the default tags.
+		"""
+
+		if self.date_tags == DATE_TAGS and self.camera_tags == CAMERA_TAGS:
+			return ''
+
+		tags = json.dumps([self.date_tags, self.camera_tags]).encode("UTF-8")
+		return hashlib.sha1(tags).hexdigest()[:8]
+
+	@staticmethod
+	def _first(data: Mapping, tags: Tuple[str, ...]) -> Optional[str]:
+		for tag in tags:
+			value = data.get(tag)
+			if value is not None:
+				return str(value)
+
+		return None
+
+	def _find_date(self, data: Mapping) -> Tuple[Optional[str], Optional[Timestamp]]:
+		# Tags whose value is not a date are skipped, e.g. a camera which writes "0000:00:00 00:00:00".
+		for tag in self.date_tags:
+			value = data.get(tag)
+			if value is not None:
+				timestamp = parse_timestamp(str(value))
+				if timestamp is not None:
+					return str(value), timestamp
+
+		return None, None
+
+	def raw_date(self, data: Mapping) -> Optional[str]:
+		"""
+		Returns the date and time the photograph was taken, as given in its metadata (e.g. ``2019:07:14 12:34:56``).
+
+		This is the value :meth:`~.MetadataRules.timestamp` is parsed from.
+
+		:param data:
+
+		:returns: The value, or :py:obj:`None` if no date could be found.
+		"""
+
+		return self._find_date(data)[0]
+
+	def timestamp(self, data: Mapping) -> Optional[Timestamp]:
+		"""
+		Determine the date and time the photograph was taken.
+
+		:param data:
+
+		:returns: The timestamp, or :py:obj:`None` if it could not be found.
+		"""
+
+		return self._find_date(data)[1]
+
+	def date(self, data: Mapping) -> Union[str, ExifError]:
+		"""
+		Determine the date the photograph was taken, in the form ``YYYY_MM_DD``.
+
+		:param data:
+		"""
+
+		timestamp = self.timestamp(data)
+		if timestamp is None:
+			return ExifError().parse_error()
+
+		return timestamp.date
+
+	def raw_camera(self, data: Mapping) -> Optional[str]:
+		"""
+		Determine the camera the photograph was taken with, as the camera reports it.
+
+		This is before any user-defined names are applied.
+
+		:param data:
+		"""
+
+		return self._first(data, self.camera_tags)
+
+	def camera(self, data: Mapping) -> Optional[str]:
+		"""
+		Determine the name of the camera the photograph was taken with, after applying user-defined names.
+
+		:param data:
+		"""
+
+		raw_camera = self._first(data, self.camera_tags)
+		if raw_camera is None:
+			return None
+
+		return self.camera_names[raw_camera]
+
+
+#: The rules used when none are given in the settings.
+DEFAULT_RULES = MetadataRules()
+
+
+def parse_date(data: Dict) -> Union[str, ExifError]:
+	"""
+	Determine the date the photograph was taken from its EXIF data, using the default rules.
+
+	:param data: EXIF data to find the date from.
+	"""
+
+	return DEFAULT_RULES.date(data)
+
+
+def parse_raw_camera(data: Dict) -> Optional[str]:
+	"""
+	Determine the camera the photograph was taken with from its EXIF data, using the default rules.
+
+	The name is as the camera reports it (i.e. before any user-defined names are applied).
+
+	:param data: EXIF data to find the camera from.
+	"""
+
+	return DEFAULT_RULES.raw_camera(data)
+
+
+class Resolved:
+	"""
+	Returns whether the date (and, if sorting by camera, the camera) can be determined from the given metadata.
+
+	This is a class rather than a closure so it can be sent to other processes.
+
+	:param by_camera: Whether the camera is also required.
+	:param rules: The rules for finding the date and camera.
+	"""
+
+	def __init__(self, by_camera: bool = False, rules: MetadataRules = DEFAULT_RULES):
+		self.by_camera = by_camera
+		self.rules = rules
+
+	def __call__(self, data: Dict) -> bool:
+		"""
+		Returns whether the date (and, if sorting by camera, the camera) can be determined from ``data``.
+
+		:param data:
+		"""
+
+		if self.rules.timestamp(data) is None:
+			return False
+
+		return not self.by_camera or bool(self.rules.raw_camera(data))
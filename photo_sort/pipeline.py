@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+#
+#  pipeline.py
+"""
+Reading metadata ahead of sorting, optionally in a pool of processes.
+"""
+#
+#  Copyright © 2014-2021 Dominic Davis-Foster <dominic@davis-foster.co.uk>
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#  EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+#  MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+#  IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+#  DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+#  OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
+#  OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+# stdlib
+import multiprocessing
+import time
+from collections import Counter, deque
+from itertools import islice
+from multiprocessing.pool import Pool
+from multiprocessing.util import Finalize
+from threading import Event
+from typing import Deque, Dict, Generator, Iterable, Iterator, List, Optional, Tuple
+
+# this package
+from photo_sort.exiftool_session import ExifToolSession
+from photo_sort.extractors import Extraction, ExtractorChain, default_extractors, project
+from photo_sort.parsing import DEFAULT_RULES, MetadataRules, Resolved
+
+__all__ = ["MetadataPipeline", "batched", "iter_metadata"]
+
+# The extractor chain in each process of the pool.
+_chain: Optional[ExtractorChain] = None
+
+
+def batched(iterable: Iterable[str], size: int) -> Iterator[List[str]]:
+	"""
+	Yield successive lists of ``size`` items from ``iterable``, which may be an iterator.
+
+	:param iterable:
+	:param size:
+	"""
+
+	iterator = iter(iterable)
+
+	while True:
+		batch = list(islice(iterator, size))
+		if not batch:
+			return
+		yield batch
+
+
+def iter_metadata(
+		chain: ExtractorChain,
+		filenames: Iterable[str],
+		batch_size: int = 50,
+		) -> Generator[Tuple[str, Extraction], None, None]:
+	"""
+	Read the metadata for each file in the current thread, a batch at a time.
+
+	:param chain:
+	:param filenames:
+	:param batch_size: The number of files to read before yielding them.
+
+	:returns: An iterator of ``(filename, extraction)`` tuples, in the same order as ``filenames``.
+	"""
+
+	for batch in batched(filenames, batch_size):
+		extractions = chain.extract_batch(batch)
+		for filename in batch:
+			yield filename, extractions[filename]
+
+
+def _initialise(by_camera: bool, batch_size: int, rules: MetadataRules) -> None:
+	global _chain
+
+	session = ExifToolSession()
+	Finalize(session, session.close, exitpriority=10)
+	_chain = ExtractorChain(
+			default_extractors(session, batch_size, rules.exiftool_tags),
+			accept=Resolved(by_camera, rules),
+			tags=frozenset(rules.tags),
+			)
+
+
+def _extract(filenames: List[str]) -> Tuple[Dict[str, Extraction], Counter]:
+	assert _chain is not None
+
+	_chain.counts.clear()
+	extractions = _chain.extract_uncached(filenames)
+
+	# Only send back the tags which are needed, as plain strings.
+	for filename, extraction in extractions.items():
+		extractions[filename] = extraction._replace(data=project(extraction.data, _chain.tags))
+
+	return extractions, Counter(_chain.counts)
+
+
+class MetadataPipeline:
+	"""
+	Reads metadata in a pool of processes.
+
+	The files are parsed in parallel while the calling thread sorts the files which have already been read.
+
+	The cache (if any) is read and written in the calling thread,
+	and only files which are not in the cache are sent to the pool.
+	At most ``max_pending`` batches are read ahead of the file being sorted.
+
+	The pool is started on first use, and kept for later calls to :meth:`~.MetadataPipeline.run`
+	until the pipeline is closed.
+
+	If a batch fails in the pool it is read again in the calling thread.
+	So is a batch which is not finished within ``timeout`` seconds, e.g. because the process reading it was killed;
+	the pool is then restarted, in case a process is stuck, and the other outstanding batches sent to it again.
+
+	:param chain: The calling thread's extractor chain. Its cache is used, and its counts updated.
+	:param by_camera: Whether files must have a camera model to be resolved.
+	:param processes: The number of processes. Defaults to the number of CPUs.
+	:param batch_size: The number of files sent to a process at once.
+	:param max_pending: The maximum number of batches in progress. Defaults to twice the number of processes.
+	:param rules: The rules for finding the date and camera.
+	:param timeout: The time a process may spend on a batch before it is read in the calling thread instead.
+	"""
+
+	def __init__(
+			self,
+			chain: ExtractorChain,
+			by_camera: bool,
+			processes: Optional[int] = None,
+			batch_size: int = 50,
+			max_pending: Optional[int] = None,
+			rules: MetadataRules = DEFAULT_RULES,
+			timeout: float = 120,
+			):
+		self.chain = chain
+		self.by_camera = by_camera
+		self.processes = processes or multiprocessing.cpu_count()
+		self.batch_size = batch_size
+		self.max_pending = max_pending or 2 * self.processes
+		self.rules = rules
+		self.timeout = timeout
+
+		self._pool: Optional[Pool] = None
+
+	def _get_pool(self) -> Pool:
+		if self._pool is None:
+			# Forking a process with a GUI (or any other threads) running is unsafe.
+			context = multiprocessing.get_context("spawn")
+			self._pool = context.Pool(self.processes, _initialise, (self.by_camera, self.batch_size, self.rules))
+
+		return self._pool
+
+	def run(self, filenames: Iterable[str], stop_event: Event) -> Generator[Tuple[str, Extraction], None, None]:
+		"""
+		Read the metadata for each of the given files.
+
+		:param filenames:
+		:param stop_event: When set, outstanding work is abandoned and the pool is stopped.
+
+		:returns: An iterator of ``(filename, extraction)`` tuples, in the same order as ``filenames``.
+		"""
+
+		batches = batched(filenames, self.batch_size)
+		pending: Deque = deque()
+		finished = False
+
+		def submit_next() -> None:
+			batch = next(batches, None)
+			if batch is None:
+				return
+
+			cached, uncached = self.chain.lookup_cached(batch)
+			result = self._get_pool().apply_async(_extract, (uncached, )) if uncached else None
+			pending.append((batch, cached, result))
+
+		def restart() -> None:
+			self.terminate()
+			pool = self._get_pool()
+
+			for index, (batch, cached, result) in enumerate(pending):
+				if result is not None and not result.ready():
+					uncached = [filename for filename in batch if filename not in cached]
+					pending[index] = (batch, cached, pool.apply_async(_extract, (uncached, )))
+
+		try:
+			for _ in range(self.max_pending):
+				submit_next()
+
+			while pending:
+				batch, extractions, result = pending.popleft()
+				submit_next()
+
+				if result is not None:
+					# The batches ahead of this one are finished, so it is being read by now.
+					deadline = time.monotonic() + self.timeout
+					while not result.ready() and time.monotonic() < deadline:
+						if stop_event.is_set():
+							return
+						result.wait(0.1)
+
+					if result.ready() and result.successful():
+						extracted, counts = result.get()
+						self.chain.counts.update(counts)
+					else:
+						if not result.ready():
+							restart()
+						extracted = self.chain.extract_uncached([f for f in batch if f not in extractions])
+
+					self.chain.store_cached(extracted)
+					extractions.update(extracted)
+
+				for filename in batch:
+					yield filename, extractions[filename]
+
+			finished = True
+
+		finally:
+			if not finished:
+				# Abandon any outstanding work.
+				self.terminate()
+
+	def terminate(self) -> None:
+		"""
+		Stop the pool straight away.
+		"""
+
+		if self._pool is not None:
+			# exiftool processes exit by themselves when their parent's pipes close.
+			self._pool.terminate()
+			self._pool = None
+
+	def close(self) -> None:
+		"""
+		Wait for the processes in the pool to exit.
+		"""
+
+		if self._pool is not None:
+			self._pool.close()
+			self._pool.join()
+			self._pool = None
+
+	def __enter__(self) -> "MetadataPipeline":
+		return self
+
+	def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+		self.close()
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+#
+#  plan.py
+"""
+Sort plans, which record where each file will be sorted to before anything is copied or moved.
+"""
+#
+#  Copyright © 2014-2021 Dominic Davis-Foster <dominic@davis-foster.co.uk>
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#  EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+#  MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+#  IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+#  DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+#  OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
+#  OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+# stdlib
+import json
+import os
+from typing import Dict, Iterator, List, Optional, Tuple
+
+__all__ = ["PLAN_VERSION", "SortPlan"]
+
+#: The version of the plan file format. Plans written by other versions cannot be loaded.
+PLAN_VERSION = 2
+
+
+class SortPlan:
+	"""
+	The destination of each file in a sort, grouped by destination directory.
+
+	A plan is made without changing anything in the destination, and can be saved and executed later.
+
+	:param mode: Whether the files are to be copied or moved (``mode_copy`` or ``mode_move``).
+	:param on_duplicate: What to do with files identical to one already in the destination.
+	:param destination: The directory the files are to be sorted into.
+	"""
+
+	def __init__(self, mode: int = 0, on_duplicate: int = 1, destination: Optional[str] = None):
+		self.mode = mode
+		self.on_duplicate = on_duplicate
+		self.destination = destination
+
+		#: A mapping of each destination directory to ``(source, filename)`` tuples for the files to be put there.
+		self.directories: Dict[str, List[Tuple[str, str]]] = {}
+
+		#: ``(source, reason)`` tuples for files which cannot be sorted.
+		self.unsorted: List[Tuple[str, str]] = []
+
+	def add(self, source: str, directory: str, filename: str) -> None:
+		"""
+		Add a file to the plan.
+
+		:param source: The file to be sorted.
+		:param directory: The directory to sort it into.
+		:param filename: Its name in that directory.
+		"""
+
+		self.directories.setdefault(directory, []).append((source, filename))
+
+	def add_unsorted(self, source: str, reason: str) -> None:
+		"""
+		Record that a file cannot be sorted.
+
+		:param source:
+		:param reason: e.g. ``"No EXIF data found"``.
+		"""
+
+		self.unsorted.append((source, reason))
+
+	def update(self, other: "SortPlan") -> None:
+		"""
+		Add the files from another plan to this one.
+
+		:param other:
+		"""
+
+		for directory, files in other.directories.items():
+			self.directories.setdefault(directory, []).extend(files)
+
+		self.unsorted.extend(other.unsorted)
+
+	def __iter__(self) -> Iterator[Tuple[str, str, str]]:
+		"""
+		Returns an iterator of ``(source, directory, filename)`` tuples, one directory at a time.
+		"""
+
+		for directory, files in self.directories.items():
+			for source, filename in files:
+				yield source, directory, filename
+
+	def __len__(self) -> int:
+		"""
+		Returns the number of files to be copied or moved.
+		"""
+
+		return sum(len(files) for files in self.directories.values())
+
+	def dump(self, filename: str) -> None:
+		"""
+		Write the plan to a file.
+
+		The file is written to a temporary name first, so an existing plan is never left half-overwritten.
+		Paths are made absolute, so the plan can be executed from any directory.
+
+		:param filename:
+		"""
+
+		abspath = os.path.abspath
+
+		directories = [
+				[abspath(directory), [(abspath(source), name) for source, name in files]]
+				for directory, files in self.directories.items()
+				]
+
+		data = {
+				"version": PLAN_VERSION,
+				"mode": self.mode,
+				"on_duplicate": self.on_duplicate,
+				"destination": None if self.destination is None else abspath(self.destination),
+				"directories": directories,
+				"unsorted": [(abspath(source), reason) for source, reason in self.unsorted],
+				}
+
+		temporary = f"{filename}.tmp"
+
+		with open(temporary, 'w', encoding="UTF-8") as fp:
+			json.dump(data, fp, separators=(',', ':'))
+
+		os.replace(temporary, filename)
+
+	@classmethod
+	def load(cls, filename: str) -> "SortPlan":
+		"""
+		Read a plan written by :meth:`~.SortPlan.dump`.
+
+		:param filename:
+		"""
+
+		with open(filename, encoding="UTF-8") as fp:
+			data = json.load(fp)
+
+		if data.get("version") != PLAN_VERSION:
+			raise ValueError(f"Unsupported sort plan version {data.get('version')!r} in {filename!r}")
+
+		plan = cls(data["mode"], data["on_duplicate"], data["destination"])
+
+		for directory, files in data["directories"]:
+			plan.directories[directory] = [(source, name) for source, name in files]
+
+		plan.unsorted = [(source, reason) for source, reason in data["unsorted"]]
+
+		return plan
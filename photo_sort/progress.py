@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+#
+#  progress.py
+"""
+Aggregated, rate-limited progress reporting for a sort.
+"""
+#
+#  Copyright © 2014-2021 Dominic Davis-Foster <dominic@davis-foster.co.uk>
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#  EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+#  MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+#  IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+#  DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+#  OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
+#  OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+# stdlib
+import time
+from collections import deque
+from datetime import timedelta
+from threading import Lock
+from typing import Callable, Deque, NamedTuple, Optional, Tuple
+
+__all__ = ["Progress", "ProgressAggregator"]
+
+
+class Progress(NamedTuple):
+	"""
+	A snapshot of the progress of a sort.
+	"""
+
+	#: The number of files which have been dealt with.
+	files: int
+
+	#: The total number of files, or :py:obj:`None` if it is not yet known.
+	total: Optional[int]
+
+	#: The number of bytes which have been copied or moved.
+	bytes: int
+
+	#: The time since the sort started, in seconds.
+	elapsed: float
+
+	#: The recent rate of files per second.
+	files_per_second: float
+
+	#: The recent rate of bytes per second.
+	bytes_per_second: float
+
+	#: The estimated time until the sort finishes, in seconds, or :py:obj:`None` if it cannot be estimated.
+	eta: Optional[float]
+
+	def format_rate(self) -> str:
+		"""
+		Returns the rates as a human-readable string, e.g. ``"120.0 files/s, 48.2 MB/s"``.
+		"""
+
+		return f"{self.files_per_second:.1f} files/s, {self.bytes_per_second / 1e6:.1f} MB/s"
+
+	def format_time(self) -> str:
+		"""
+		Returns the elapsed and remaining time as a human-readable string.
+		"""
+
+		elapsed = timedelta(seconds=int(self.elapsed))
+
+		if self.eta is None:
+			return f"{elapsed}"
+		else:
+			return f"{elapsed} (about {timedelta(seconds=int(self.eta))} left)"
+
+
+class ProgressAggregator:
+	"""
+	Collects progress from the worker and passes it on to ``callback`` at most ``max_rate`` times a second.
+
+	The methods may be called from any thread; ``callback`` is called from whichever thread made the update,
+	so a GUI should hand the :class:`~.Progress` to its main thread, e.g. with :func:`wx.CallAfter`.
+
+	:param callback: Called with a :class:`~.Progress`.
+	:param max_rate: The maximum number of times per second to call ``callback``.
+	:param window: The period over which the rates are measured, in seconds.
+	"""
+
+	def __init__(
+			self,
+			callback: Callable[[Progress], None],
+			max_rate: float = 10,
+			window: float = 5,
+			):
+		self.callback = callback
+		self.interval = 1 / max_rate
+		self.window = window
+
+		self.files = 0
+		self.bytes = 0
+		self.total: Optional[int] = None
+
+		self._lock = Lock()
+		self._start = time.monotonic()
+		self._last_update = 0.0
+
+		# (time, files, bytes) samples covering the last ``window`` seconds.
+		self._samples: Deque[Tuple[float, int, int]] = deque([(self._start, 0, 0)])
+
+	def set_total(self, total: int) -> None:
+		"""
+		Set the total number of files to be sorted, which may increase as more files are found.
+
+		:param total:
+		"""
+
+		with self._lock:
+			self.total = total
+
+		self._maybe_update()
+
+	def advance(self, files: int = 1, size: int = 0) -> None:
+		"""
+		Record that files have been dealt with.
+
+		:param files: The number of files.
+		:param size: The number of bytes copied or moved.
+		"""
+
+		with self._lock:
+			self.files += files
+			self.bytes += size
+
+		self._maybe_update()
+
+	def finish(self) -> None:
+		"""
+		Send the final progress, regardless of when the last update was sent.
+		"""
+
+		self.callback(self.snapshot())
+
+	def snapshot(self) -> Progress:
+		"""
+		Returns the current progress.
+		"""
+
+		now = time.monotonic()
+
+		with self._lock:
+			self._samples.append((now, self.files, self.bytes))
+			while len(self._samples) > 2 and now - self._samples[1][0] >= self.window:
+				self._samples.popleft()
+
+			first_time, first_files, first_bytes = self._samples[0]
+			period = now - first_time
+
+			if period > 0:
+				files_per_second = (self.files - first_files) / period
+				bytes_per_second = (self.bytes - first_bytes) / period
+			else:
+				files_per_second = bytes_per_second = 0.0
+
+			eta: Optional[float] = None
+			if self.total is not None and files_per_second > 0:
+				eta = max(self.total - self.files, 0) / files_per_second
+
+			return Progress(
+					files=self.files,
+					total=self.total,
+					bytes=self.bytes,
+					elapsed=now - self._start,
+					files_per_second=files_per_second,
+					bytes_per_second=bytes_per_second,
+					eta=eta,
+					)
+
+	def _maybe_update(self) -> None:
+		now = time.monotonic()
+
+		with self._lock:
+			if now - self._last_update < self.interval:
+				return
+			self._last_update = now
+
+		self.callback(self.snapshot())
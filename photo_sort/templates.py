@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+#
+#  templates.py
+"""
+Templates for the directories files are sorted into, e.g. ``{year}/{month:02}/{date}_{camera}``.
+"""
+#
+#  Copyright © 2014-2021 Dominic Davis-Foster <dominic@davis-foster.co.uk>
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#  EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+#  MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+#  IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+#  DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+#  OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
+#  OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+# stdlib
+import os
+import string
+from typing import Callable, FrozenSet, List
+
+# this package
+from photo_sort.parsing import Timestamp
+
+__all__ = ["DATE_TEMPLATE", "DATETIME_TEMPLATE", "FIELDS", "PathTemplate", "default_template"]
+
+#: The fields which may be used in a template.
+FIELDS = frozenset({"year", "month", "day", "hour", "minute", "second", "date", "time", "camera"})
+
+#: The default template, a directory for each day.
+DATE_TEMPLATE = "{date}"
+
+#: The default template when sorting by date and time, a directory for each hour of each day.
+DATETIME_TEMPLATE = "{date}/{hour:02}"
+
+# Removed from the ends of each directory name, e.g. for ``{date}_{camera}`` when the camera is not known.
+_SEPARATORS = " _-."
+
+
+def default_template(by_datetime: bool = False, by_camera: bool = False) -> str:
+	"""
+	Returns the template for the "Sort by Date and Time" and "Sort by Camera" options.
+
+	:param by_datetime:
+	:param by_camera:
+	"""
+
+	template = DATETIME_TEMPLATE if by_datetime else DATE_TEMPLATE
+
+	if by_camera:
+		template += "/{camera}"
+
+	return template
+
+
+class PathTemplate:
+	"""
+	A template for the directory, relative to the destination, which a file is sorted into.
+
+	Templates use :meth:`str.format` syntax, with the fields in :data:`~.FIELDS`. For example,
+	``{year}/{month:02}/{date}_{camera}`` sorts a photograph taken on 14th July 2019 into ``2019/07/2019_07_14_Canon``.
+	``year``, ``month``, ``day``, ``hour``, ``minute`` and ``second`` are integers;
+	``date`` is ``YYYY_MM_DD``, ``time`` is ``HH_MM_SS``, and ``camera`` is the camera's name (or ``''``).
+
+	Directories are separated by ``/``. Separators (`` _-.``) at either end of a directory name are removed,
+	as are directories which are empty, so templates containing ``{camera}`` work when it is not known.
+
+	The template is checked and compiled when it is constructed.
+
+	:param template:
+
+	:raises ValueError: If the template is invalid or uses unknown fields.
+	"""
+
+	def __init__(self, template: str):
+		self.template = template
+		self._components: List[Callable[..., str]] = []
+
+		#: The fields used by the template.
+		self.fields: FrozenSet[str] = frozenset()
+
+		for component in template.replace('\\', '/').split('/'):
+			try:
+				fields = [field for _, field, _, _ in string.Formatter().parse(component) if field is not None]
+			except ValueError as e:
+				raise ValueError(f"Invalid template {template!r}: {e}") from None
+
+			for field in fields:
+				if field not in FIELDS:
+					raise ValueError(f"Unknown field {field!r} in template {template!r}")
+
+			self.fields |= set(fields)
+
+			if component:
+				self._components.append(component.format)
+
+		if not self._components:
+			raise ValueError("The template is empty")
+
+		try:
+			self.format(Timestamp(2000, 1, 1), "camera")
+		except (ValueError, TypeError, IndexError) as e:
+			raise ValueError(f"Invalid template {template!r}: {e}") from None
+
+	def format(self, timestamp: Timestamp, camera: str = '') -> str:  # noqa: A003  # pylint: disable=redefined-builtin
+		"""
+		Returns the directory for a file, relative to the destination.
+
+		:param timestamp: When the file was taken.
+		:param camera: The name of the camera, or ``''`` if it is not known or not sorted by.
+		"""
+
+		year, month, day, hour, minute, second = timestamp
+		fields = {
+				"year": year,
+				"month": month,
+				"day": day,
+				"hour": hour,
+				"minute": minute,
+				"second": second,
+				"date": f"{year:04}_{month:02}_{day:02}",
+				"time": f"{hour:02}_{minute:02}_{second:02}",
+				# A camera name must not create extra directories.
+				"camera": camera.replace('/', '_').replace(os.sep, '_'),
+				}
+
+		directories = []
+		for component in self._components:
+			directory = component(**fields).strip(_SEPARATORS)
+			if directory:
+				directories.append(directory)
+
+		return os.path.join(*directories) if directories else ''
+
+	def __repr__(self) -> str:
+		return f"{type(self).__name__}({self.template!r})"
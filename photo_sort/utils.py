@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+#
+#  utils.py
+"""
+General utility functions.
+"""
+#
+#  Copyright © 2014-2021 Dominic Davis-Foster <dominic@davis-foster.co.uk>
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#  EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+#  MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+#  IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+#  DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+#  OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
+#  OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+# stdlib
+import mmap
+import os
+from contextlib import contextmanager
+from typing import BinaryIO, Iterator, Optional, Union
+
+__all__ = ["map_header"]
+
+
+@contextmanager
+def map_header(
+		file: BinaryIO,
+		header_bytes: Optional[int] = None,
+		fallback: bool = True,
+		) -> Iterator[Union[mmap.mmap, bytes]]:
+	"""
+	Context manager which provides a read-only, memory-mapped view of the start of a file.
+
+	If the file cannot be memory-mapped (e.g. on some network filesystems)
+	the header is read into a :class:`bytes` object instead.
+	Empty files give an empty :class:`bytes` object.
+
+	:param file: A file opened in binary mode.
+	:param header_bytes: The maximum number of bytes to map. If :py:obj:`None` the whole file is mapped.
+	:param fallback: If :py:obj:`False`, give an empty :class:`bytes` object rather than reading the header
+		when the file cannot be memory-mapped.
+	"""
+
+	size = os.fstat(file.fileno()).st_size
+	if header_bytes is not None:
+		size = min(size, header_bytes)
+
+	if not size:
+		yield b''
+		return
+
+	try:
+		view = mmap.mmap(file.fileno(), size, access=mmap.ACCESS_READ)
+	except (OSError, ValueError):
+		if fallback:
+			file.seek(0)
+			yield file.read(size)
+		else:
+			yield b''
+		return
+
+	try:
+		yield view
+	finally:
+		view.close()
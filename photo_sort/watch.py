@@ -0,0 +1,331 @@
+#!/usr/bin/env python3
+#
+#  watch.py
+"""
+Watches a directory with inotify, and yields the files written to it in small batches once they are complete.
+"""
+#
+#  Copyright © 2014-2021 Dominic Davis-Foster <dominic@davis-foster.co.uk>
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#  EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+#  MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+#  IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+#  DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+#  OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
+#  OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+# stdlib
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import sys
+import time
+from threading import Event
+from typing import Dict, Iterator, List, NamedTuple, Optional
+
+__all__ = ["FolderWatcher", "Inotify", "InotifyEvent"]
+
+# From <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+_EVENT_HEADER = struct.Struct("iIII")
+
+# The events which are watched for in each directory.
+_WATCH_MASK = (
+		IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+		| IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+		)
+
+
+class InotifyEvent(NamedTuple):
+	"""
+	An event read from an :class:`~.Inotify` instance.
+	"""
+
+	#: The watch descriptor of the directory the event happened in.
+	wd: int
+	#: The ``IN_*`` flags describing the event.
+	mask: int
+	#: Links the two halves of a rename.
+	cookie: int
+	#: The name of the file or directory within the watched directory, or ``''`` for the directory itself.
+	name: str
+
+
+class Inotify:
+	"""
+	A minimal wrapper around the Linux inotify API, using :mod:`ctypes`.
+
+	:raises OSError: If inotify is not available, e.g. on other platforms.
+	"""
+
+	def __init__(self):
+		if not sys.platform.startswith("linux"):
+			raise OSError(errno.ENOSYS, "inotify is only available on Linux")
+
+		self._libc = ctypes.CDLL(ctypes.util.find_library('c') or "libc.so.6", use_errno=True)
+		self._libc.inotify_init1.argtypes = [ctypes.c_int]
+		self._libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+		self._libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+
+		self.fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+		if self.fd < 0:
+			self._raise()
+
+		self._poll = select.poll()
+		self._poll.register(self.fd, select.POLLIN)
+
+	@staticmethod
+	def _raise(filename: Optional[str] = None) -> None:
+		error = ctypes.get_errno()
+		raise OSError(error, os.strerror(error), filename)
+
+	def add_watch(self, path: str, mask: int) -> int:
+		"""
+		Watch a file or directory, or change the events watched for if it is already watched.
+
+		:param path:
+		:param mask: The ``IN_*`` flags of the events to watch for.
+
+		:returns: The watch descriptor, which is the same for every path to the same inode.
+		"""
+
+		wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+		if wd < 0:
+			self._raise(path)
+		return wd
+
+	def remove_watch(self, wd: int) -> None:
+		"""
+		Stop watching a file or directory.
+
+		:param wd: The watch descriptor returned by :meth:`~.Inotify.add_watch`.
+		"""
+
+		self._libc.inotify_rm_watch(self.fd, wd)
+
+	def read_events(self, timeout: Optional[float] = None) -> List[InotifyEvent]:
+		"""
+		Wait for events, and return all those which are available.
+
+		:param timeout: The maximum time to wait, in seconds, or :py:obj:`None` to wait indefinitely.
+
+		:returns: An empty list if no events arrived before the timeout.
+		"""
+
+		if not self._poll.poll(None if timeout is None else int(timeout * 1000)):
+			return []
+
+		try:
+			buffer = os.read(self.fd, 64 * 1024)
+		except BlockingIOError:
+			return []
+
+		events = []
+		offset = 0
+
+		while offset < len(buffer):
+			wd, mask, cookie, length = _EVENT_HEADER.unpack_from(buffer, offset)
+			offset += _EVENT_HEADER.size
+			name = os.fsdecode(buffer[offset:offset + length].rstrip(b'\0'))
+			offset += length
+			events.append(InotifyEvent(wd, mask, cookie, name))
+
+		return events
+
+	def close(self) -> None:
+		"""
+		Stop watching everything.
+		"""
+
+		if self.fd >= 0:
+			os.close(self.fd)
+			self.fd = -1
+
+	def __enter__(self) -> "Inotify":
+		return self
+
+	def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+		self.close()
+
+
+class FolderWatcher:
+	"""
+	Watches a directory tree and yields the files written to it, in batches, once they are complete.
+
+	A file is complete once it has been closed after writing (or moved into the tree) and then left alone
+	for ``settle`` seconds, which allows for programs which write a file in several goes.
+	New subdirectories are watched as they appear, so the tree is only scanned in full when watching starts,
+	and again if the kernel's event queue overflows.
+
+	Iterating over the watcher yields lists of paths until :meth:`~.FolderWatcher.stop` is called.
+
+	:param source: The directory to watch.
+	:param settle: The time a file must be left alone before it is considered complete, in seconds.
+	:param batch_window: The time to wait for more complete files before yielding a batch, in seconds.
+	:param max_batch: The maximum number of files in a batch.
+	:param scan_existing: Whether to yield the files which are already in the tree when watching starts.
+
+	:raises OSError: If inotify is not available, e.g. on other platforms.
+	"""
+
+	def __init__(
+			self,
+			source: str,
+			settle: float = 2.0,
+			batch_window: float = 1.0,
+			max_batch: int = 1000,
+			scan_existing: bool = True,
+			):
+		self.source = source
+		self.settle = settle
+		self.batch_window = batch_window
+		self.max_batch = max_batch
+		self.scan_existing = scan_existing
+
+		self._inotify = Inotify()
+		self._directories: Dict[int, str] = {}
+
+		# The time of the last event for each file which has been written, but may not yet be complete.
+		self._closed: Dict[str, float] = {}
+
+		self._stop_event = Event()
+
+	def stop(self) -> None:
+		"""
+		Stop watching. Iteration ends within a second, after yielding any files which are complete.
+		"""
+
+		self._stop_event.set()
+
+	def _watch_tree(self, directory: str, found_at: Optional[float]) -> None:
+		# Watch the directory and its subdirectories.
+		# Files already in them are treated as written at ``found_at``, or ignored if it is None.
+		stack = [directory]
+
+		while stack:
+			directory = stack.pop()
+			try:
+				wd = self._inotify.add_watch(directory, _WATCH_MASK)
+			except OSError:
+				continue
+
+			self._directories[wd] = directory
+
+			try:
+				with os.scandir(directory) as entries:
+					for entry in entries:
+						if entry.is_dir(follow_symlinks=False):
+							stack.append(entry.path)
+						elif found_at is not None and entry.is_file():
+							self._closed[entry.path] = found_at
+			except OSError:
+				continue
+
+	def _handle(self, event: InotifyEvent, now: float) -> None:
+		if event.mask & IN_Q_OVERFLOW:
+			# Events have been lost, so look again at everything.
+			self._watch_tree(self.source, now)
+			return
+
+		directory = self._directories.get(event.wd)
+		if directory is None:
+			return
+
+		if event.mask & IN_IGNORED or (not event.name and event.mask & (IN_DELETE_SELF | IN_MOVE_SELF)):
+			# The directory itself has gone.
+			self._directories.pop(event.wd, None)
+			return
+
+		path = os.path.join(directory, event.name)
+
+		if event.mask & IN_ISDIR:
+			if event.mask & (IN_CREATE | IN_MOVED_TO):
+				# Files may be written to the new directory before it is watched.
+				self._watch_tree(path, now)
+		elif event.mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+			self._closed[path] = now
+		elif event.mask & (IN_DELETE | IN_MOVED_FROM | IN_MODIFY):
+			# A file which is modified again is complete once it is next closed.
+			self._closed.pop(path, None)
+		elif event.mask & IN_ATTRIB and path in self._closed:
+			# e.g. the modification time being set after copying.
+			self._closed[path] = now
+
+	def _complete(self, now: float) -> List[str]:
+		complete = [path for path, last_event in self._closed.items() if now - last_event >= self.settle]
+		for path in complete:
+			del self._closed[path]
+		return [path for path in complete if os.path.isfile(path)]
+
+	def _next_deadline(self, now: float) -> float:
+		if not self._closed:
+			return now + 1
+		return min(self._closed.values()) + self.settle
+
+	def __iter__(self) -> Iterator[List[str]]:
+		self._watch_tree(self.source, time.monotonic() - self.settle if self.scan_existing else None)
+
+		batch: List[str] = []
+		batch_started = 0.0
+
+		try:
+			while not self._stop_event.is_set():
+				now = time.monotonic()
+
+				deadline = self._next_deadline(now)
+				if batch:
+					deadline = min(deadline, batch_started + self.batch_window)
+
+				# Wake at least once a second to check for stop().
+				timeout = min(max(deadline - now, 0), 1)
+
+				events = self._inotify.read_events(timeout)
+				now = time.monotonic()
+				for event in events:
+					self._handle(event, now)
+
+				complete = self._complete(now)
+				if complete and not batch:
+					batch_started = now
+				batch.extend(complete)
+
+				if batch and (len(batch) >= self.max_batch or now - batch_started >= self.batch_window):
+					yield batch[:self.max_batch]
+					batch = batch[self.max_batch:]
+					batch_started = now
+
+			if batch:
+				yield batch
+
+		finally:
+			self._inotify.close()
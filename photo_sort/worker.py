@@ -0,0 +1,846 @@
+#!/usr/bin/env python3
+#
+#  worker.py
+"""
+The background thread which sorts files, independent of the GUI.
+"""
+#
+#  Copyright © 2014-2021 Dominic Davis-Foster <dominic@davis-foster.co.uk>
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#  EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+#  MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+#  IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+#  DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+#  OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
+#  OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+# stdlib
+import os
+from contextlib import ExitStack, closing, contextmanager
+from threading import Event, Thread
+from typing import Callable, Dict, Generator, Iterable, Iterator, List, Optional, Sequence, Set, Tuple, Union
+
+# 3rd party
+from domdf_python_tools.iterative import chunks
+
+# this package
+from photo_sort.cache import MetadataCache, default_cache_file
+from photo_sort.copying import CopyBackends, CopyExecutor, MoveEngine
+from photo_sort.dedupe import DuplicateIndex
+from photo_sort.destination import DestinationIndex
+from photo_sort.errors import ExifError
+from photo_sort.exiftool_session import ExifToolSession
+from photo_sort.extractors import Extraction, ExtractorChain, default_extractors
+from photo_sort.journal import Journal
+from photo_sort.metrics import NULL_METRICS, Metrics
+from photo_sort.parsing import MetadataRules, Resolved
+from photo_sort.pipeline import MetadataPipeline, iter_metadata
+from photo_sort.plan import SortPlan
+from photo_sort.templates import PathTemplate, default_template
+
+__all__ = [
+		"Worker",
+		"duplicate_copy",
+		"duplicate_link",
+		"duplicate_skip",
+		"mode_copy",
+		"mode_move",
+		]
+
+mode_copy = 0
+mode_move = 1
+
+duplicate_copy = 0
+duplicate_skip = 1
+duplicate_link = 2
+
+
+class Worker(Thread):
+	"""
+	Worker Thread for performing sorting.
+
+	Includes code from https://gist.github.com/samarthbhargav/5a515a399f7113137331
+
+	The worker does not depend on the GUI; progress is reported through the ``on_progress`` and ``on_done`` callbacks,
+	which are called from the worker thread.
+
+	:param filelist: The paths of the files to sort. May be an iterator, e.g. a :class:`~.FileDiscovery`.
+	:param destination: Base directory to sort files into. Ignored when sorting within directories,
+		where each file is sorted into the directory which contains it.
+	:param mode: Whether to copy or move the files, default Copy
+	:param within_dirs: Whether to sort within directories, default False
+	:param by_datetime: Whether to sort by date and time (into a directory for each hour), default False
+		(i.e. just by date)
+	:param by_camera: Whether to sort by camera name, default False
+	:param on_duplicate: What to do with files identical to one already in the destination:
+		copy them anyway, skip them, or hard link to the existing file. Default Skip.
+	:param processes: The number of processes to read metadata with.
+		If :py:obj:`None` metadata is read in the worker thread. Default None.
+	:param copy_threads: The maximum number of files to copy or move at once. Default 4.
+	:param copy_backends: The ways of copying files to try, in order. See :class:`~.CopyBackends`.
+		Default chosen automatically for each source and destination filesystem.
+	:param cameras: A mapping of camera model names (or patterns; see :class:`~.CameraNames`)
+		to the names to sort them under.
+	:param rules: The tags to find the date and camera in, as given in ``settings.json``.
+		See :meth:`MetadataRules.from_settings() <.MetadataRules.from_settings>`. Default the built-in tags.
+	:param template: The directories to sort files into, relative to the destination,
+		e.g. ``{year}/{month:02}/{date}``. See :class:`~.PathTemplate`.
+		Default chosen from ``by_datetime`` and ``by_camera``.
+	:param on_progress: Called with a number of files and their total size in bytes
+		as they are copied, moved, or found to be impossible to sort. See :class:`~.ProgressAggregator`.
+	:param on_done: Called once all files have been sorted.
+	:param plan: A plan made by an earlier dry run to execute. ``filelist`` and the sorting options are then ignored.
+	:param dry_run: Only plan where each file would be sorted to, without changing anything in the destination.
+		The plan is then available as :attr:`~.Worker.plan`.
+	:param save_plan: The file to save the plan to in a dry run.
+	:param metrics: Records the time taken by each stage of the sort. Default disabled.
+	:param journal: Record the progress of the sort in a journal in the destination, so that if it is interrupted
+		the next sort into the same destination carries on where it left off. Default True.
+	:param cache: Cache the metadata of each file in the user's cache directory,
+		so it need not be read again in later sorts. Default True.
+	"""
+
+	#: The number of files whose metadata is read before they are sorted.
+	#: Files which need ``exiftool`` are sent to it together.
+	batch_size: int = 50
+
+	#: The number of files planned at a time before they are copied or moved.
+	plan_chunk_size: int = 1000
+
+	def __init__(
+			self,
+			filelist: Iterable[str],
+			destination: str,
+			mode: int = mode_copy,
+			within_dirs: bool = False,
+			by_datetime: bool = False,
+			by_camera: bool = False,
+			on_duplicate: int = duplicate_skip,
+			processes: Optional[int] = None,
+			copy_threads: int = 4,
+			copy_backends: Optional[Sequence[str]] = None,
+			cameras: Optional[Dict[str, str]] = None,
+			rules: Optional[Dict[str, Sequence[str]]] = None,
+			template: Optional[str] = None,
+			on_progress: Optional[Callable[[int, int], None]] = None,
+			on_done: Optional[Callable[[], None]] = None,
+			plan: Optional[SortPlan] = None,
+			dry_run: bool = False,
+			save_plan: Optional[str] = None,
+			metrics: Optional[Metrics] = None,
+			journal: bool = True,
+			cache: bool = True,
+			):
+		self._stopevent = Event()
+		Thread.__init__(self, name="WorkerThread")
+		self.cameras = cameras or {}
+		self.rules = MetadataRules.from_settings(rules, self.cameras)
+		self.on_progress = on_progress
+		self.on_done = on_done
+
+		#: Whether the sort is in progress.
+		self.running = True
+
+		#: The number of files which have been sorted.
+		self.sorted_count = 0
+		#: The number of files which could not be read, copied or moved.
+		self.failed_count = 0
+		#: The number of files which were not sorted because their date could not be found.
+		self.unsorted_count = 0
+		#: The number of files which were skipped because an earlier, interrupted sort had already sorted them.
+		self.resumed_count = 0
+
+		if plan is not None:
+			mode = plan.mode
+			on_duplicate = plan.on_duplicate
+
+		print(f"Destination: {destination}")
+		if mode == mode_copy:
+			print("Mode: Copy")
+		elif mode == mode_move:
+			print("Mode: Move")
+		else:
+			print("Unknown mode. Defaulting to 'Copy'")
+			mode = mode_copy
+
+		print(f"Sort Within Directories: {within_dirs}")
+		# Checked before anything is sorted, so a mistake in the template is found straight away.
+		self.template = PathTemplate(template or default_template(by_datetime, by_camera))
+		if "camera" in self.template.fields:
+			by_camera = True
+
+		print(f"Sort by Date and Time: {by_datetime}")
+		print(f"Sort by Camera: {by_camera}")
+		print(f"Template: {self.template.template}")
+
+		if within_dirs:
+			# The files being sorted are already in the destination.
+			on_duplicate = duplicate_copy
+
+		self.destination = destination
+		self.mode = mode
+		self.within_dirs = within_dirs
+		self.by_datetime = by_datetime
+		self.by_camera = by_camera
+		self.filelist = filelist
+		self.on_duplicate = on_duplicate
+		self.processes = processes
+		self.plan = plan
+		self.dry_run = dry_run
+		self.save_plan = save_plan
+		self.metrics = metrics or NULL_METRICS
+
+		# A single exiftool process is shared by every file in the sort.
+		self.exiftool = ExifToolSession()
+
+		# Metadata from previous runs, for files which have not changed since.
+		self.cache: Optional[MetadataCache] = None
+		if cache:
+			self.cache = MetadataCache(default_cache_file())
+
+		# Files already in the destination, for finding duplicates.
+		self.duplicates: Optional[DuplicateIndex] = None
+		if on_duplicate != duplicate_copy:
+			self.duplicates = DuplicateIndex(destination)
+		self.duplicate_count = 0
+
+		# The names of the files in each destination directory.
+		self.names = DestinationIndex()
+
+		# Files written by this sort, which must not be sorted again if the search finds them.
+		self.written: Set[str] = set()
+
+		# Files sorted so far when there is no journal to record them, by normcase'd absolute path,
+		# so that files which are found again (e.g. when watching a folder) are not read or hashed again.
+		self._sorted: Set[str] = set()
+
+		# Progress of the sort, for resuming it if it is interrupted.
+		self.journal: Optional[Journal] = None
+		if journal and not dry_run:
+			self.journal = Journal(destination, move=mode == mode_move)
+
+		# Files copied between filesystems whose originals have not yet been deleted.
+		self._uncommitted: List[Tuple[str, str]] = []
+
+		# Copies run in the background while the next files are examined.
+		self.copier = CopyExecutor(copy_threads)
+		self.backends = CopyBackends(copy_backends)
+		self.mover = MoveEngine(self.backends)
+
+		self.extractors = ExtractorChain(
+				default_extractors(self.exiftool, self.batch_size, self.rules.exiftool_tags),
+				accept=Resolved(by_camera, self.rules),
+				cache=self.cache,
+				profile=("camera" if by_camera else "date") + self.rules.fingerprint,
+				metrics=self.metrics,
+				tags=frozenset(self.rules.tags),
+				)
+
+		# Processes to read metadata in, which are started when first needed.
+		self.pipeline: Optional[MetadataPipeline] = None
+		if processes:
+			self.pipeline = MetadataPipeline(self.extractors, by_camera, processes, self.batch_size, rules=self.rules)
+
+	def parse_date(self, data: Dict) -> Union[str, ExifError]:
+		"""
+		Determine the date the photograph was taken from its EXIF data.
+
+		:param data: EXIF data to find the date from.
+		"""
+
+		return self.rules.date(data)
+
+	def parse_camera(self, data: Dict) -> str:
+		"""
+		Determine the camera the photograph was taken with its EXIF data.
+
+		:param data: EXIF data to find the camera from.
+		"""
+
+		if not self.by_camera:
+			return ''
+
+		return self.rules.camera(data) or ''
+
+	def run(self) -> None:
+		"""
+		Run the worker thread.
+		"""
+
+		print("Working...")
+
+		with self.session():
+			if self.plan is not None:
+				self.execute(self.plan)
+			else:
+				self.sort(self.filelist)
+
+		if self._stopevent.is_set():
+			self.running = False
+			return
+
+		if self.journal is not None:
+			# Finished, so there is nothing to resume.
+			self.journal.remove()
+
+		self.print_summary()
+
+		self.running = False
+
+		if self.on_done is not None:
+			self.on_done()
+
+	@contextmanager
+	def session(self) -> Iterator[None]:
+		"""
+		Context manager which opens the ``exiftool`` process, caches, indexes and journal, and closes them afterwards.
+
+		Several lists of files may be sorted with :meth:`~.Worker.sort` while they are open,
+		e.g. when watching a folder for new files.
+		"""
+
+		with ExitStack() as stack:
+			stack.enter_context(self.exiftool)
+			if self.cache is not None:
+				stack.enter_context(self.cache)
+			if self.pipeline is not None:
+				stack.enter_context(self.pipeline)
+			if self.duplicates is not None:
+				stack.enter_context(self.duplicates)
+			if self.journal is not None:
+				stack.enter_context(self.journal)
+				self.resume()
+
+			# Originals of files moved between filesystems are deleted once the copies are safely on disk,
+			# including when the sort is cancelled.
+			if self.mode == mode_move:
+				stack.callback(self.commit_moves)
+
+			# Closed first, so copies in progress can finish and be recorded in the duplicate index.
+			stack.enter_context(self.copier)
+
+			yield
+
+	def sort(self, filelist: Iterable[str]) -> None:
+		"""
+		Sort the given files, and wait for them to be copied or moved.
+
+		Must be called within :meth:`~.Worker.session`.
+
+		:param filelist: The paths of the files to sort.
+		"""
+
+		# get the tags, using exiftool as a backup for video files
+		extractions: Generator[Tuple[str, Extraction], None, None]
+		if self.pipeline is not None:
+			extractions = self.pipeline.run(self.skip_sorted(filelist), self._stopevent)
+		else:
+			extractions = iter_metadata(self.extractors, self.skip_sorted(filelist), self.batch_size)
+
+		with closing(extractions):
+			if self.dry_run:
+				if self.plan is None:
+					self.plan = SortPlan(self.mode, self.on_duplicate, self.destination)
+
+				for plan in self.iter_plans(extractions):
+					self.plan.update(plan)
+					self._advance(len(plan))
+
+				if self.save_plan is not None and not self._stopevent.is_set():
+					self.plan.dump(self.save_plan)
+
+			else:
+				# Plans are executed a chunk at a time, so copying starts while later files are being read.
+				for plan in self.iter_plans(extractions):
+					self.execute(plan)
+
+		self.copier.process_completed(wait=True)
+		if self.mode == mode_move:
+			self.commit_moves()
+		if self.journal is not None:
+			self.journal.sync()
+
+	def print_summary(self) -> None:
+		"""
+		Print how the files were read and sorted.
+		"""
+
+		print(f"\nMetadata read by {self.extractors.summary()}")
+		if self.dry_run:
+			assert self.plan is not None
+			print(f"Planned: {len(self.plan)} files into {len(self.plan.directories)} directories")
+		elif self.mode == mode_copy:
+			print(f"Copied by {self.backends.summary()}")
+		else:
+			print(f"Moved: {self.mover.renamed} renamed, {self.mover.copied} copied between filesystems")
+			if self.mover.copied:
+				print(f"Copied by {self.backends.summary()}")
+		if self.duplicates is not None:
+			print(f"Duplicates found: {self.duplicate_count}")
+		if not self.dry_run:
+			print(
+					f"Directories: {self.names.directories_made} created, "
+					f"{self.names.mkdirs_avoided} mkdir calls avoided"
+					)
+		if self.resumed_count:
+			print(f"Already sorted by an earlier, interrupted sort: {self.resumed_count}")
+
+	def _advance(self, files: int = 1, size: int = 0) -> None:
+		if self.on_progress is not None and not self._stopevent.is_set():
+			self.on_progress(files, size)
+
+	@staticmethod
+	def _filename_string(filepath: str) -> str:
+		path_length = 80
+
+		if len(filepath) > path_length:
+			return "..." + filepath[-path_length:]
+		else:
+			return filepath + ' ' * (path_length - len(filepath))
+
+	def resume(self) -> None:
+		"""
+		Carry on from where an earlier, interrupted sort into the same destination left off.
+
+		Files it half-wrote have been finished or removed by :meth:`Journal.load() <.Journal.load>`;
+		the files it completed are skipped by :meth:`~.Worker.skip_sorted` and :meth:`~.Worker.execute`.
+		"""
+
+		assert self.journal is not None
+
+		# Neither the journal nor the files already sorted are to be sorted, when sorting within directories.
+		self.written.add(os.path.normcase(self.journal.filename))
+
+		if not self.journal.resumed:
+			return
+
+		for destination in self.journal.completed.values():
+			if destination is not None:
+				self.written.add(os.path.normcase(destination))
+
+		# Files which were removed may already have been found by the search.
+		self.written.update(map(os.path.normcase, self.journal.recovered))
+
+		print(
+				f"Resuming an interrupted sort: {len(self.journal.completed)} files already sorted, "
+				f"{self.journal.finished} finished and {self.journal.undone} to be written again."
+				)
+
+	def skip_sorted(self, filelist: Iterable[str]) -> Iterator[str]:
+		"""
+		Yields the files from ``filelist`` which have not already been sorted, without reading their metadata.
+
+		:param filelist:
+		"""
+
+		for filepath in filelist:
+			if os.path.normcase(filepath) in self.written:
+				self._advance()
+			elif self.journal is not None and self.journal.is_completed(filepath):
+				self.resumed_count += 1
+				self._advance()
+			elif os.path.normcase(os.path.abspath(filepath)) in self._sorted:
+				self._advance()
+			else:
+				yield filepath
+
+	def iter_plans(self, extractions: Iterable[Tuple[str, Extraction]]) -> Iterator[SortPlan]:
+		"""
+		Plan where each file is to be sorted to, a chunk of :attr:`~.Worker.plan_chunk_size` files at a time.
+
+		Files which cannot be sorted are counted as done as soon as they have been planned.
+
+		:param extractions: ``(filename, extraction)`` tuples for the files to sort.
+		"""
+
+		plan = SortPlan(self.mode, self.on_duplicate, self.destination)
+		planned = 0
+
+		for filepath, extraction in self.metrics.iterate("metadata", extractions):
+			if self._stopevent.is_set():
+				return
+
+			if not self.add_to_plan(plan, filepath, extraction):
+				self._advance()
+
+			planned += 1
+			if planned >= self.plan_chunk_size:
+				yield plan
+				plan = SortPlan(self.mode, self.on_duplicate, self.destination)
+				planned = 0
+
+		if planned:
+			yield plan
+
+	def add_to_plan(self, plan: SortPlan, filepath: str, extraction: Optional[Extraction] = None) -> bool:
+		"""
+		Decide where a single file is to be sorted to, without changing anything in the destination.
+
+		:param plan: The plan to add the file to.
+		:param filepath: The file to sort.
+		:param extraction: The file's metadata, if it has already been read.
+
+		:returns: Whether the file is to be copied or moved.
+		"""
+
+		filename_string = self._filename_string(filepath)
+
+		print(f'\r{filename_string}', end='')
+
+		if os.path.normcase(filepath) in self.written:
+			return False
+
+		if extraction is None:
+			extraction = self.extractors.extract(filepath)
+
+		if extraction.error is not None:
+			error = ExifError().open_error()
+			error.show(filename_string)
+			plan.add_unsorted(filepath, str(error.message))
+			self.failed_count += 1
+			return False
+
+		data = extraction.data
+
+		if not data:
+			error = ExifError().no_data()
+			error.show(filename_string)
+			plan.add_unsorted(filepath, str(error.message))
+			self.unsorted_count += 1
+			return False
+
+		with self.metrics.time("parse"):
+			timestamp = self.rules.timestamp(data)
+			camera = self.parse_camera(data)
+
+		if timestamp is None:
+			error = ExifError().parse_error()
+			error.show(filename_string)
+			plan.add_unsorted(filepath, str(error.message))
+			self.unsorted_count += 1
+			return False
+
+		directory = self.template.format(timestamp, camera)
+
+		if self.within_dirs:
+			destination_path = os.path.join(os.path.dirname(filepath), directory)
+		else:
+			destination_path = os.path.join(self.destination, directory)
+
+		# If file already exists, add a (number) to the end of the filename
+		with self.metrics.time("allocate"):
+			filename = self.names.allocate(destination_path, os.path.split(filepath)[-1])
+		plan.add(filepath, destination_path, filename)
+
+		print(f"{directory} -> {os.path.join(destination_path, filename)}               ")
+
+		return True
+
+	def execute(self, plan: SortPlan) -> None:
+		"""
+		Copy or move the files in a plan, one destination directory at a time.
+
+		:param plan:
+		"""
+
+		for directory, files in plan.directories.items():
+			for chunk in chunks(files, self.batch_size):
+				if self._stopevent.is_set():
+					return
+
+				claimed = self.claim_files(directory, chunk)
+
+				if self.journal is not None and claimed:
+					# Any of these files might be half-written if the sort is interrupted.
+					# They are only recorded once they have been created, so a file which was already there
+					# is never mistaken for one of them when resuming.
+					with self.metrics.time("journal", len(claimed)):
+						self.journal.plan((filepath, destination) for filepath, destination, _ in claimed)
+
+				for index, (filepath, destination, duplicate) in enumerate(claimed):
+					if self._stopevent.is_set():
+						for unsorted, unused, _ in claimed[index:]:
+							self.names.release(unused)
+							if self.duplicates is not None:
+								self.duplicates.forget(unsorted)
+						return
+
+					# Progress is reported once the file has been copied or moved.
+					self.execute_file(filepath, destination, duplicate)
+
+	def claim_files(
+			self,
+			directory: str,
+			files: Sequence[Tuple[str, str]],
+			) -> List[Tuple[str, str, Optional[str]]]:
+		"""
+		Create an empty file in the destination for each file in a plan which is still to be copied or moved.
+
+		If a file with the planned name has appeared since the plan was made, the next free name is used instead.
+		Files which have already been sorted, and duplicates which are to be skipped, are counted as done.
+
+		:param directory: The directory to sort the files into.
+		:param files: ``(source, filename)`` tuples for the files, as given by :attr:`SortPlan.directories`.
+
+		:returns: ``(source, destination, duplicate)`` tuples for the files which are to be copied or moved,
+			where ``duplicate`` is an identical file already in the destination, if there is one.
+		"""
+
+		to_claim = []
+
+		for filepath, filename in files:
+			if self.journal is not None and self.journal.is_completed(filepath):
+				# e.g. a plan from an earlier dry run which was partly executed.
+				self.resumed_count += 1
+				self._advance()
+				continue
+
+			with self.metrics.time("duplicates"):
+				duplicate = self.find_duplicate(filepath)
+			if duplicate is not None:
+				print(f"\r'{self._filename_string(filepath)}': Identical to '{duplicate}'.\n")
+				if self.on_duplicate == duplicate_skip or self._is_in_directory(duplicate, directory):
+					# Linking to a file in the same directory would only add a numbered copy of its name.
+					self._complete(filepath, None)
+					self._advance()
+					continue
+
+			to_claim.append((filepath, filename, duplicate))
+
+		if not to_claim:
+			return []
+
+		with self.metrics.time("mkdir"):
+			self.names.make_directory(directory)
+
+		# The files are created together, after the slower checks above,
+		# so few are left behind empty if the sort is interrupted before they are journaled.
+		claimed = []
+
+		with self.metrics.time("claim", len(to_claim)):
+			for filepath, filename, duplicate in to_claim:
+				destination = self.names.claim(directory, filename)
+				if destination is None:
+					destination = self.names.reserve(directory, os.path.split(filepath)[-1])
+
+				self.written.add(os.path.normcase(destination))
+				claimed.append((filepath, destination, duplicate))
+
+		return claimed
+
+	def execute_file(self, filepath: str, destination: str, duplicate: Optional[str] = None) -> None:
+		"""
+		Copy or move a single file to the destination given by a plan.
+
+		:param filepath: The file to sort.
+		:param destination: The path to copy or move it to,
+			where an empty file has been created by :meth:`~.Worker.claim_files`.
+		:param duplicate: An identical file already in the destination, if there is one.
+		"""
+
+		if duplicate is not None:
+			try:
+				linked = self.link_duplicate(filepath, duplicate, destination)
+			except OSError as e:
+				self.file_done(filepath, destination, self._filename_string(filepath), e)
+				return
+
+			if linked:
+				self.sorted_count += 1
+				self._complete(filepath, destination)
+				self._advance()
+				return
+
+		operation: Callable[[str, str], object]
+		if self.mode == mode_copy:
+			operation = self.backends.copy
+		else:
+			operation = self.mover.move
+
+		if self.metrics.enabled:
+			operation = self._timed(self._stage, operation)
+
+		filename_string = self._filename_string(filepath)
+
+		def callback(exception: Optional[BaseException]) -> None:
+			self.file_done(filepath, destination, filename_string, exception)
+
+		self.copier.submit(operation, filepath, destination, callback)
+
+	def file_done(
+			self,
+			filepath: str,
+			destination: str,
+			filename_string: str,
+			exception: Optional[BaseException],
+			) -> None:
+		"""
+		Called in the worker thread once a file has been copied or moved.
+
+		:param filepath: The file being sorted.
+		:param destination: The path it was copied or moved to.
+		:param filename_string: The name of the file to show in error messages.
+		:param exception: The exception raised while copying or moving the file, if any.
+		"""
+
+		if exception is not None:
+			if self.mode == mode_copy:
+				print(f"\r'{filename_string}': Could not copy file.\n")
+				ExifError().copy_error().show(filename_string)
+			else:
+				ExifError().move_error().show(filename_string)
+
+			self.failed_count += 1
+			self.names.release(destination)
+			if self.duplicates is not None:
+				self.duplicates.forget(filepath)
+			self._advance()
+			return
+
+		self.sorted_count += 1
+
+		try:
+			size = os.stat(destination).st_size
+		except OSError:
+			size = 0
+
+		self._advance(size=size)
+		self.metrics.add_bytes(self._stage, size)
+
+		if self.duplicates is not None:
+			self.duplicates.add(destination, source=filepath)
+
+		if self.mode == mode_move and os.path.lexists(filepath):
+			# Copied to another filesystem; complete once the original has been deleted.
+			self._uncommitted.append((filepath, destination))
+		else:
+			self._complete(filepath, destination)
+
+		if self.mode == mode_move and self.mover.ready():
+			self.commit_moves()
+
+	def _complete(self, filepath: str, destination: Optional[str]) -> None:
+		if self.journal is not None:
+			with self.metrics.time("journal"):
+				self.journal.complete(filepath, destination)
+		else:
+			self._sorted.add(os.path.normcase(os.path.abspath(filepath)))
+
+	@property
+	def _stage(self) -> str:
+		return "copy" if self.mode == mode_copy else "move"
+
+	def _timed(self, stage: str, operation: Callable[[str, str], object]) -> Callable[[str, str], None]:
+		# Times the copy or move itself, on the thread which runs it.
+
+		def timed(source: str, destination: str) -> None:
+			with self.metrics.time(stage):
+				operation(source, destination)
+
+		return timed
+
+	def commit_moves(self) -> None:
+		"""
+		Delete the originals of files which have been copied to another filesystem, once the copies are durable.
+		"""
+
+		with self.metrics.time("commit"):
+			failed = self.mover.commit()
+
+		for filepath, _ in failed:
+			print(f"\r'{filepath}': Could not remove the original after copying it.\n")
+			ExifError().move_error().show(filepath)
+			self.failed_count += 1
+
+		uncommitted, self._uncommitted = self._uncommitted, []
+		failed_files = {filepath for filepath, _ in failed}
+
+		for filepath, destination in uncommitted:
+			if filepath not in failed_files:
+				self._complete(filepath, destination)
+
+	def find_duplicate(self, filepath: str) -> Optional[str]:
+		"""
+		Returns the path of a file in the destination which is identical to ``filepath``, if there is one.
+
+		:param filepath:
+		"""
+
+		if self.duplicates is None:
+			return None
+
+		try:
+			duplicate = self.duplicates.find(filepath)
+		except OSError:
+			return None
+
+		if duplicate is not None:
+			self.duplicate_count += 1
+
+		return duplicate
+
+	def link_duplicate(self, filepath: str, duplicate: str, destination: str) -> bool:
+		"""
+		Hard link a file into the destination from an identical file which is already there.
+
+		In move mode the source file is then removed.
+
+		:param filepath: The file being sorted.
+		:param duplicate: The identical file in the destination.
+		:param destination: The path of the link, which has been reserved with :meth:`DestinationIndex.reserve`.
+
+		:returns: :py:obj:`False` if the link could not be made (e.g. the filesystem does not support hard links),
+			in which case the file should be copied or moved as usual.
+
+		:raises OSError: If the link was made but could not be put in place, or the source could not be removed.
+		"""
+
+		if self.on_duplicate != duplicate_link:
+			return False
+
+		directory, filename = os.path.split(destination)
+
+		# Link to a temporary name, then replace the reserved file, so the name is never left unclaimed.
+		try:
+			link = self.names.link(duplicate, directory, f".{filename}.link")
+		except OSError:
+			return False
+
+		try:
+			os.replace(link, destination)
+		except OSError:
+			self.names.release(link)
+			raise
+
+		self.names.forget(link)
+
+		if self.mode == mode_move:
+			os.unlink(filepath)
+
+		return True
+
+	@staticmethod
+	def _is_in_directory(path: str, directory: str) -> bool:
+		return os.path.normcase(os.path.abspath(os.path.dirname(path))) == os.path.normcase(os.path.abspath(directory))
+
+	def join(self, timeout=None):
+		"""
+		Stop the thread and wait for it to end.
+
+		:param timeout:
+		"""
+
+		self._stopevent.set()
+		Thread.join(self, timeout)
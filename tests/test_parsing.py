@@ -0,0 +1,25 @@
+# this package
+from photo_sort.parsing import DEFAULT_RULES, Timestamp, parse_timestamp
+
+
+def test_parse_timestamp():
+	assert parse_timestamp("2019:07:14 12:34:56") == Timestamp(2019, 7, 14, 12, 34, 56)
+	assert parse_timestamp("2019-07-14T12:34:56+01:00") == Timestamp(2019, 7, 14, 12, 34, 56)
+	assert parse_timestamp("2019:07:14") == Timestamp(2019, 7, 14)
+
+
+def test_parse_timestamp_invalid():
+	assert parse_timestamp("0000:00:00 00:00:00") is None
+	assert parse_timestamp("2019:00:14 12:34:56") is None
+	assert parse_timestamp("2019:13:14 12:34:56") is None
+	assert parse_timestamp("2019:07:00 12:34:56") is None
+	assert parse_timestamp("2019:07:32 12:34:56") is None
+	assert parse_timestamp("    :  :     :  :  ") is None
+
+
+def test_zeroed_date_falls_back():
+	data = {"EXIF DateTimeOriginal": "0000:00:00 00:00:00", "Image DateTime": "2019:07:14 12:34:56"}
+
+	assert DEFAULT_RULES.raw_date(data) == "2019:07:14 12:34:56"
+	assert DEFAULT_RULES.timestamp(data) == Timestamp(2019, 7, 14, 12, 34, 56)
+	assert DEFAULT_RULES.date(data) == "2019_07_14"